@@ -0,0 +1,251 @@
+'''
+Class: AsyncModalClient
+=======================
+
+Description:
+------------
+
+	Non-blocking front-end to a ModalClient, for services that serve
+	many concurrent requests.
+
+	Every method returns a future (concurrent.futures.Future; the
+	'futures' backport on Python 2) instead of blocking: mongodb calls
+	run on a small pool of metadata threads, and disk item
+	loads/saves (decoding PNGs, etc.) on a separate pool of decode
+	threads, so slow decodes never starve metadata lookups. Futures
+	can be waited on directly, given callbacks, or awaited from an
+	asyncio event loop via asyncio.wrap_future.
+
+
+Example Usage:
+--------------
+
+	aclient = AsyncModalClient(client)
+
+	frame = aclient.get(Frame, frame_id).result()
+	image, subtitles = frame.get_items(['image', 'subtitles']).result()
+
+	cursor = aclient.iter(Frame)
+	batch = cursor.next_batch().result()
+	while batch:
+		...
+		batch = cursor.next_batch().result()
+
+	# from asyncio (Python 3)
+	frame = await asyncio.wrap_future(aclient.get(Frame, frame_id))
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import threading
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def resolved(value):
+	"""
+		returns a future already resolved to value
+	"""
+	future = Future()
+	future.set_result(value)
+	return future
+
+
+def gather(futures):
+	"""
+		returns a future resolving to the list of futures' results, in
+		order, or to the first exception raised
+	"""
+	result = Future()
+	remaining = [len(futures)]
+	lock = threading.Lock()
+	def done(f):
+		with lock:
+			if result.done():
+				return
+			if not f.exception() is None:
+				result.set_exception(f.exception())
+				return
+			remaining[0] -= 1
+			if remaining[0] == 0:
+				result.set_result([f_.result() for f_ in futures])
+	if len(futures) == 0:
+		return resolved([])
+	for f in futures:
+		f.add_done_callback(done)
+	return result
+
+
+class AsyncModalClient(object):
+	"""
+		Class: AsyncModalClient
+		=======================
+
+		Wraps a ModalClient; mirrors get, get_many, iter and insert
+		with methods returning futures. Objects are returned as
+		AsyncDataObjects.
+	"""
+
+	def __init__(self, client, metadata_workers=4, decode_workers=8):
+		"""
+			Args:
+			-----
+			- client: ModalClient to wrap
+			- metadata_workers: threads for mongodb calls
+			- decode_workers: threads for disk item loads/saves
+		"""
+		self.client = client
+		self.metadata_executor = ThreadPoolExecutor(metadata_workers)
+		self.decode_executor = ThreadPoolExecutor(decode_workers)
+
+
+	def close(self):
+		"""
+			shuts down the thread pools, waiting for pending calls
+		"""
+		self.metadata_executor.shutdown(wait=True)
+		self.decode_executor.shutdown(wait=True)
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
+
+
+	def run_metadata(self, func, *args, **kwargs):
+		return self.metadata_executor.submit(func, *args, **kwargs)
+
+
+	def run_decode(self, func, *args, **kwargs):
+		return self.decode_executor.submit(func, *args, **kwargs)
+
+
+	def wrap(self, dataobject):
+		return AsyncDataObject(self, dataobject)
+
+
+
+
+	################################################################################
+	####################[ GET/ITER/INSERT	]#######################################
+	################################################################################
+
+	def get(self, datatype, _id):
+		"""
+			future AsyncDataObject of type datatype named _id
+		"""
+		return self.run_metadata(lambda: self.wrap(self.client.get(datatype, _id)))
+
+
+	def get_many(self, datatype, _ids):
+		"""
+			future list of AsyncDataObjects, fetched in one query
+		"""
+		_ids = list(_ids)
+		return self.run_metadata(lambda: [self.wrap(d) for d in self.client.get_many(datatype, _ids)])
+
+
+	def iter(self, datatype, batch_size=256, view=False):
+		"""
+			returns an AsyncCursor over all objects of datatype
+		"""
+		return AsyncCursor(self, self.client.iter(datatype, view=view), batch_size)
+
+
+	def insert(self, datatype, _id, item_data, parent=None, method='cp'):
+		"""
+			future AsyncDataObject; see ModalClient.insert. parent may
+			be a DataObject or an AsyncDataObject.
+		"""
+		if isinstance(parent, AsyncDataObject):
+			parent = parent.dataobject
+		return self.run_metadata(lambda: self.wrap(self.client.insert(datatype, _id, item_data, parent=parent, method=method)))
+
+
+
+class AsyncCursor(object):
+	"""
+		Class: AsyncCursor
+		==================
+
+		Batched asynchronous iteration over a ModalClient.iter
+		generator; next_batch() resolves to a list of up to batch_size
+		AsyncDataObjects, or [] once exhausted.
+	"""
+
+	def __init__(self, aclient, iterator, batch_size):
+		self.aclient = aclient
+		self.iterator = iterator
+		self.batch_size = batch_size
+		self.lock = threading.Lock()
+
+
+	def fetch(self):
+		with self.lock:
+			return [self.aclient.wrap(d) for d in islice(self.iterator, self.batch_size)]
+
+
+	def next_batch(self):
+		return self.aclient.run_metadata(self.fetch)
+
+
+
+class AsyncDataObject(object):
+	"""
+		Class: AsyncDataObject
+		======================
+
+		Wraps a DataObject; get_item/set_item/del_item return futures.
+		Memory items resolve immediately; disk items are loaded/saved,
+		and derived items computed, on the decode pool. Other attributes (_id, root, present_items,
+		...) are those of the wrapped DataObject.
+	"""
+
+	def __init__(self, aclient, dataobject):
+		self.aclient = aclient
+		self.dataobject = dataobject
+
+
+	def __getattr__(self, name):
+		return getattr(self.dataobject, name)
+
+
+	def is_disk_item(self, key):
+		self.dataobject.detect_keyerror(key)
+		return self.dataobject.schema.modes[key] == 'disk'
+
+
+	def get_item(self, key):
+		"""
+			future item; disk items are loaded and derived items computed
+			on the decode pool
+		"""
+		if self.is_disk_item(key) or key in self.dataobject.schema.derived:
+			return self.aclient.run_decode(self.dataobject.__getitem__, key)
+		return resolved(self.dataobject[key])
+
+
+	def get_items(self, keys):
+		"""
+			future list of the named items, loaded concurrently
+		"""
+		return gather([self.get_item(k) for k in keys])
+
+
+	def set_item(self, key, value):
+		"""
+			sets item; disk items are saved and mongodb updated on the
+			decode pool
+		"""
+		return self.aclient.run_decode(self.dataobject.__setitem__, key, value)
+
+
+	def del_item(self, key):
+		return self.aclient.run_decode(self.dataobject.__delitem__, key)
@@ -0,0 +1,454 @@
+'''
+Module: BackgroundJobs
+======================
+
+Description:
+------------
+
+	Long-running filesystem work that ModalClient hands off to
+	daemon threads so callers don't block on it.
+
+	BackgroundDeleter: removes directory trees. Each directory is
+	first renamed into a trash directory on the same filesystem, so
+	it disappears atomically from the caller's point of view; the
+	(slow) recursive removal happens afterwards in the background.
+	Trash left over from an interrupted process is removed the next
+	time a deleter starts.
+
+	DiskWriter: pool of daemon threads running queued disk item
+	saves (write-behind); the queue is bounded, so producers block 
+	rather than buffering unboundedly.
+
+	BackgroundJob: base class for resumable batch jobs over a
+	collection, run either synchronously or on a daemon thread, with
+	progress reporting.
+
+	PurgeItemJob: removes one item from every object of a datatype,
+	walking the collection once in _id order; files are removed by a
+	thread pool, then the item is $unset in bulk, batch by batch.
+	Checkpointed, so an interrupted purge resumes where it stopped.
+
+	BackfillJob: computes a newly added item for every existing object
+	of a datatype on a thread pool, saving disk items as it goes and 
+	writing metadata with one bulk_write per batch and notifying the
+	client's listeners. Checkpointed like PurgeItemJob, so an
+	interrupted backfill resumes after its last batch.
+
+
+Example Usage:
+--------------
+
+	deleter = BackgroundDeleter('/data/.ModalDB_trash')
+	deleter.delete('/data/Video/video_1') # returns immediately
+	deleter.wait() # blocks until the trash is empty
+
+	writer = DiskWriter(workers=4)
+	writer.submit(func, *args) # returns immediately
+	writer.flush() # blocks until all submitted calls are done
+
+	job = PurgeItemJob(client, Frame, 'features', filename='features.npy').start()
+	job.progress() # {'done':20000, 'total':10000000}
+	job.wait()
+
+	job = BackfillJob(client, Frame, 'n_pixels', lambda frame: frame['image'].size).start()
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import uuid
+import shutil
+import threading
+import traceback
+from Queue import Queue
+from multiprocessing.pool import ThreadPool
+from pymongo import UpdateOne
+
+
+class BackgroundDeleter(object):
+	"""
+		Class: BackgroundDeleter
+		========================
+
+		Renames directories into trash_dir, then removes them on a
+		daemon thread.
+	"""
+
+	def __init__(self, trash_dir):
+		self.trash_dir = trash_dir
+		self.pid = os.getpid()
+		self.queue = Queue()
+		self.errors = []
+		if not os.path.exists(self.trash_dir):
+			os.makedirs(self.trash_dir)
+
+		#=====[ Leftovers from interrupted deletes	]=====
+		for name in os.listdir(self.trash_dir):
+			self.queue.put(os.path.join(self.trash_dir, name))
+
+		self.thread = threading.Thread(target=self.worker_loop)
+		self.thread.daemon = True
+		self.thread.start()
+
+
+	def delete(self, path):
+		"""
+			moves path into the trash and schedules its removal;
+			returns once path no longer exists
+		"""
+		trash_path = os.path.join(self.trash_dir, '%s.%s' % (os.path.basename(path.rstrip('/')), uuid.uuid4().hex))
+		os.rename(path, trash_path)
+		self.queue.put(trash_path)
+
+
+	def wait(self):
+		"""
+			blocks until all scheduled removals have finished; raises
+			if any failed
+		"""
+		self.queue.join()
+		if len(self.errors) > 0:
+			errors, self.errors = self.errors, []
+			raise Exception("%d deletes failed; first: %s: %s" % (len(errors), errors[0][0], errors[0][1]))
+
+
+	def worker_loop(self):
+		while True:
+			trash_path = self.queue.get()
+			try:
+				shutil.rmtree(trash_path)
+			except Exception as e:
+				self.errors.append((trash_path, e))
+			finally:
+				self.queue.task_done()
+
+
+
+class DiskWriter(object):
+	"""
+		Class: DiskWriter
+		=================
+
+		Runs submitted calls on a pool of daemon threads. Exceptions
+		are collected and raised by the next flush().
+	"""
+
+	def __init__(self, workers=4, max_pending=256):
+		self.workers = workers
+		self.max_pending = max_pending
+		self.start()
+
+
+	def start(self):
+		self.pid = os.getpid()
+		self.queue = Queue(maxsize=self.max_pending)
+		self.errors = []
+		self.threads = [threading.Thread(target=self.worker_loop) for _ in range(self.workers)]
+		for thread in self.threads:
+			thread.daemon = True
+			thread.start()
+
+
+	def submit(self, func, *args):
+		"""
+			queues func(*args); blocks while max_pending calls are queued
+		"""
+		if not self.pid == os.getpid():
+			self.start()
+		self.queue.put((func, args))
+
+
+	def flush(self):
+		"""
+			blocks until all submitted calls are done; raises if any failed
+		"""
+		self.queue.join()
+		if len(self.errors) > 0:
+			errors, self.errors = self.errors, []
+			raise Exception("%d disk writes failed; first:\n%s" % (len(errors), errors[0]))
+
+
+	def close(self):
+		"""
+			flushes, then stops the worker threads
+		"""
+		try:
+			self.flush()
+		finally:
+			for _ in self.threads:
+				self.queue.put(None)
+			for thread in self.threads:
+				thread.join()
+
+
+	def worker_loop(self):
+		for func, args in iter(self.queue.get, None):
+			try:
+				func(*args)
+			except Exception:
+				self.errors.append(traceback.format_exc())
+			finally:
+				self.queue.task_done()
+		self.queue.task_done()
+
+
+class BackgroundJob(object):
+	"""
+		Class: BackgroundJob
+		====================
+
+		Base class for batch jobs; subclasses implement run(), calling
+		report(n) after each batch. start() runs the job on a daemon 
+		thread, run() runs it in the caller's.
+
+		callback(job), if given, is called after each batch.
+
+		Jobs over a collection that walk it in _id order can resume 
+		after a crash: they name themselves with checkpoint_id and 
+		call load_checkpoint() before starting, save_checkpoint() 
+		after each batch; self.last_id is saved in the JobCheckpoints 
+		collection. The next job with the same checkpoint_id starts 
+		after a finished one's.
+	"""
+	checkpoint_collection = 'JobCheckpoints'
+	checkpoint_id = None
+
+	def __init__(self, callback=None):
+		self.callback = callback
+		self.done = 0
+		self.total = None
+		self.error = None
+		self.thread = None
+
+
+	def start(self):
+		self.thread = threading.Thread(target=self.run_safely)
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+
+	def run_safely(self):
+		try:
+			self.run()
+		except Exception:
+			self.error = traceback.format_exc()
+
+
+	def run(self):
+		raise NotImplementedError
+
+
+	def wait(self):
+		"""
+			blocks until the job finishes; raises if it failed
+		"""
+		if not self.thread is None:
+			self.thread.join()
+		if not self.error is None:
+			raise Exception("Background job failed:\n%s" % self.error)
+
+
+	def is_running(self):
+		return not self.thread is None and self.thread.is_alive()
+
+
+	def report(self, n):
+		self.done += n
+		if not self.callback is None:
+			self.callback(self)
+
+
+	def progress(self):
+		return {'done':self.done, 'total':self.total}
+
+
+	def load_checkpoint(self):
+		"""
+			resumes from an unfinished checkpoint, setting self.last_id, 
+			or starts a new one; returns the checkpoint
+		"""
+		checkpoints = self.client.db[self.checkpoint_collection]
+		checkpoint = checkpoints.find_one({'_id':self.checkpoint_id})
+		if checkpoint is None or checkpoint['finished']:
+			checkpoint = {'_id':self.checkpoint_id, 'last_id':None, 'finished':False}
+			checkpoints.replace_one({'_id':self.checkpoint_id}, checkpoint, upsert=True)
+		self.last_id = checkpoint['last_id']
+		return checkpoint
+
+
+	def save_checkpoint(self, finished=False, inc=None):
+		"""
+			saves self.last_id; inc maps other checkpoint fields to
+			amounts to increment them by
+		"""
+		update = {'$set':{'last_id':self.last_id, 'finished':finished}}
+		if inc:
+			update['$inc'] = inc
+		self.client.db[self.checkpoint_collection].update_one({'_id':self.checkpoint_id}, update)
+
+
+
+class PurgeItemJob(BackgroundJob):
+	"""
+		Class: PurgeItemJob
+		===================
+
+		Removes item_name from every object of datatype: deletes its
+		file (if filename is given, i.e. it's a disk item) and $unsets
+		it from the object's mongo_doc.
+	"""
+
+	def __init__(self, client, datatype, item_name, filename=None, batch_size=1000, workers=8, callback=None):
+		super(PurgeItemJob, self).__init__(callback)
+		self.client = client
+		self.datatype = datatype
+		self.item_name = item_name
+		self.filename = filename
+		self.batch_size = batch_size
+		self.workers = workers
+		self.last_id = None
+		self.checkpoint_id = 'purge.%s.%s' % (datatype.__name__, item_name)
+
+
+	def remove_file(self, path):
+		if os.path.exists(path):
+			os.remove(path)
+
+
+	def run(self):
+		collection = self.client.get_collection(self.datatype)
+		key = 'items.' + self.item_name
+		self.load_checkpoint()
+		query = lambda: {} if self.last_id is None else {'_id':{'$gt':self.last_id}}
+		self.total = self.done + collection.count_documents(dict(query(), **{key:{'$exists':True}}))
+		pool = ThreadPool(self.workers) if not self.filename is None else None
+		try:
+			while True:
+				docs = list(collection.find(query(), {'_id':1, 'root':1, key:1}).sort('_id', 1).limit(self.batch_size))
+				if len(docs) == 0:
+					break
+				purged = [d for d in docs if self.item_name in d.get('items', {})]
+				ids = [d['_id'] for d in purged]
+
+				#=====[ files first: a doc without the item has no file	]=====
+				if len(ids) > 0:
+					if not pool is None:
+						pool.map(self.remove_file, [os.path.join(d['root'], self.filename) for d in purged])
+					collection.update_many({'_id':{'$in':ids}}, {'$unset':{key:''}})
+					if len(self.client.listeners) > 0:
+						for doc in collection.find({'_id':{'$in':ids}}, {'items':1}):
+							self.client.notify('update', self.datatype, doc['_id'], doc['items'])
+				self.last_id = docs[-1]['_id']
+				self.save_checkpoint()
+				self.report(len(ids))
+			self.save_checkpoint(finished=True)
+		finally:
+			if not pool is None:
+				pool.close()
+
+
+
+class BackfillJob(BackgroundJob):
+	"""
+		Class: BackfillJob
+		==================
+
+		Sets item_name := func(dataobject) for every object of datatype
+		that doesn't have it yet; objects for which func returns None
+		are skipped. The item must already be in the schema.
+
+		Objects are visited in _id order and checkpointed (see
+		BackgroundJob), so a job interrupted by a crash resumes after
+		the last written batch rather than retrying the skipped
+		objects. Skipped _ids are recorded one document each in the
+		BackfillSkipped collection (see skipped_ids()), their number
+		in the checkpoint.
+	"""
+	skipped_collection = 'BackfillSkipped'
+
+	def __init__(self, client, datatype, item_name, func, batch_size=256, workers=8, callback=None):
+		super(BackfillJob, self).__init__(callback)
+		self.client = client
+		self.datatype = datatype
+		self.item_name = item_name
+		self.func = func
+		self.batch_size = batch_size
+		self.workers = workers
+		self.last_id = None
+		self.n_skipped = 0
+		self.checkpoint_id = 'backfill.%s.%s' % (datatype.__name__, item_name)
+
+		table = client.get_schema(datatype)
+		self.save_func = table.save_funcs.get(item_name)
+		self.filename = table.filenames.get(item_name)
+		if table.modes[item_name] == 'disk' and self.save_func is None:
+			raise TypeError("Can't backfill disk item %s without a save_func" % item_name)
+
+
+	def skipped_ids(self):
+		"""
+			iterates over _ids of objects func returned None for, in
+			the current (or last finished) run
+		"""
+		cursor = self.client.db[self.skipped_collection].find({'job':self.checkpoint_id}, {'object_id':1})
+		return (d['object_id'] for d in cursor)
+
+
+	def record_skipped(self, ids):
+		if len(ids) == 0:
+			return
+		key = lambda _id: '%s\t%s' % (self.checkpoint_id, _id)
+		self.client.db[self.skipped_collection].bulk_write([UpdateOne({'_id':key(_id)}, {'$set':{'job':self.checkpoint_id, 'object_id':_id}}, upsert=True) for _id in ids], ordered=False)
+
+
+	def compute(self, mongo_doc):
+		"""
+			returns the value to record in mongo_doc['items'] (the path
+			for disk items), or None
+		"""
+		value = self.func(self.client.mongo_doc_to_dataobject(self.datatype, mongo_doc))
+		if value is None or self.filename is None:
+			return value
+		path = os.path.join(mongo_doc['root'], self.filename)
+		self.save_func(value, path)
+		return path
+
+
+	def run(self):
+		collection = self.client.get_collection(self.datatype)
+		key = 'items.' + self.item_name
+		todo = {key:{'$exists':False}}
+		checkpoint = self.load_checkpoint()
+		if self.last_id is None:
+			self.client.db[self.skipped_collection].delete_many({'job':self.checkpoint_id})
+		self.n_skipped = checkpoint.get('skipped', 0)
+		query = lambda: dict(todo) if self.last_id is None else dict(todo, _id={'$gt':self.last_id})
+		self.total = self.done + collection.count_documents(query())
+		pool = ThreadPool(self.workers)
+		try:
+			while True:
+				docs = list(collection.find(query()).sort('_id', 1).limit(self.batch_size))
+				if len(docs) == 0:
+					break
+
+				values = pool.map(self.compute, docs)
+				written = [(d['_id'], v) for d, v in zip(docs, values) if not v is None]
+				if len(written) > 0:
+					collection.bulk_write([UpdateOne({'_id':_id}, {'$set':{key:v}}) for _id, v in written], ordered=False)
+					if len(self.client.listeners) > 0:
+						for doc in collection.find({'_id':{'$in':[_id for _id, _ in written]}}, {'items':1}):
+							self.client.notify('update', self.datatype, doc['_id'], doc['items'])
+				skipped = [d['_id'] for d, v in zip(docs, values) if v is None]
+				self.record_skipped(skipped)
+				self.n_skipped += len(skipped)
+				self.last_id = docs[-1]['_id']
+				self.save_checkpoint(inc={'skipped':len(skipped)})
+				self.report(len(docs))
+			self.save_checkpoint(finished=True)
+		finally:
+			pool.close()
@@ -0,0 +1,377 @@
+'''
+Module: Clustering
+==================
+
+Description:
+------------
+
+	Out-of-core k-means over feature items: features are streamed in
+	chunks, never loaded all at once, and clustered by mini-batch
+	k-means (Sculley, 2010).
+
+	Key properties:
+		- streams from ModalDB (FeatureStream: one row per object for
+			vector items, per mask for matrix items) or from a .npy
+			file memory-mapped (MatrixStream)
+		- nearest-centroid assignment split across threads (numpy
+			releases the GIL in its matrix products)
+		- centroids checkpointed every checkpoint_every batches and at
+			the end of each epoch; fitting again with the same
+			checkpoint resumes
+		- assignments written back as a memory item, one bulk_write per
+			batch of objects
+
+
+Example Usage:
+--------------
+
+	kmeans = MiniBatchKMeans(1000, checkpoint_path='/data/kmeans.npz')
+	kmeans.fit(FeatureStream(client, Frame, 'cnn_features', normalize=True), epochs=2)
+	write_assignments(client, Frame, 'cnn_features', 'cluster_id', kmeans)
+	client.get(Frame, 'video_1/frame_3')['cluster_id'] # 417, or [417, 12, ...] per mask
+
+	labels = kmeans.predict_stream(MatrixStream('/data/features.npy'))
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from pymongo import UpdateOne
+
+
+def l2_normalize(X):
+	return X / np.maximum(np.sqrt((X ** 2).sum(axis=1)), 1e-12)[:, np.newaxis]
+
+
+
+
+################################################################################
+####################[ STREAMS	]###############################################
+################################################################################
+
+class MatrixStream(object):
+	"""
+		Class: MatrixStream
+		===================
+
+		Iterates over (row indices, rows) chunks of a .npy matrix,
+		memory-mapped so only one chunk is in memory at a time.
+	"""
+
+	def __init__(self, path, chunk_size=100000, normalize=False):
+		self.matrix = np.load(path, mmap_mode='r')
+		self.chunk_size = chunk_size
+		self.normalize = normalize
+
+
+	def __len__(self):
+		return len(self.matrix)
+
+
+	def __iter__(self):
+		for start in xrange(0, len(self.matrix), self.chunk_size):
+			stop = min(len(self.matrix), start + self.chunk_size)
+			X = np.asarray(self.matrix[start:stop], dtype=np.float32)
+			yield range(start, stop), (l2_normalize(X) if self.normalize else X)
+
+
+
+class FeatureStream(object):
+	"""
+		Class: FeatureStream
+		====================
+
+		Iterates over (keys, rows) chunks of item over all objects of
+		datatype that have it, in _id order. Keys are _ids for vector
+		items and (_id, row) for matrix items; features are loaded by a
+		thread pool.
+	"""
+
+	def __init__(self, client, datatype, item, chunk_size=10000, workers=8, normalize=False):
+		self.client = client
+		self.datatype = datatype
+		self.item = item
+		self.chunk_size = chunk_size
+		self.workers = workers
+		self.normalize = normalize
+
+		table = client.get_schema(datatype)
+		self.load_func = table.load_funcs.get(item) if table.modes[item] == 'disk' else None
+
+
+	def __len__(self):
+		"""
+			number of objects (not rows)
+		"""
+		return self.client.count(self.datatype, {'items.' + self.item:{'$exists':True}})
+
+
+	def load(self, mongo_doc):
+		value = mongo_doc['items'][self.item]
+		return mongo_doc['_id'], np.asarray(value if self.load_func is None else self.load_func(value))
+
+
+	def __iter__(self):
+		key = 'items.' + self.item
+		cursor = self.client.get_collection(self.datatype).find({key:{'$exists':True}}, {key:1}).sort('_id', 1)
+		pool = ThreadPool(self.workers)
+		try:
+			keys, rows = [], []
+			for _id, feature in pool.imap(self.load, cursor, chunksize=16):
+				if feature.ndim == 1:
+					keys.append(_id)
+					rows.append(feature[np.newaxis, :])
+				else:
+					keys.extend([(_id, row) for row in range(len(feature))])
+					rows.append(feature.reshape(len(feature), -1))
+				if len(keys) >= self.chunk_size:
+					yield keys, self.stack(rows)
+					keys, rows = [], []
+			if len(keys) > 0:
+				yield keys, self.stack(rows)
+		finally:
+			pool.close()
+
+
+	def stack(self, rows):
+		X = np.concatenate(rows).astype(np.float32)
+		return l2_normalize(X) if self.normalize else X
+
+
+
+
+################################################################################
+####################[ MINI-BATCH K-MEANS	]###################################
+################################################################################
+
+class MiniBatchKMeans(object):
+	"""
+		Class: MiniBatchKMeans
+		======================
+
+		Mini-batch k-means over streams of (keys, rows) chunks; see
+		module docstring.
+	"""
+
+	def __init__(self, n_clusters, batch_size=1000, workers=8, checkpoint_path=None, checkpoint_every=100, seed=0):
+		"""
+			Args:
+			-----
+			- n_clusters: number of centroids
+			- batch_size: rows per centroid update
+			- workers: threads computing assignments
+			- checkpoint_path: (optional) .npz file centroids are saved
+				to and, if it exists, resumed from
+			- checkpoint_every: batches between checkpoints
+		"""
+		self.n_clusters = n_clusters
+		self.batch_size = batch_size
+		self.workers = workers
+		self.checkpoint_path = checkpoint_path
+		self.checkpoint_every = checkpoint_every
+		self.seed = seed
+
+		self.centroids = None
+		self.counts = np.zeros(n_clusters, dtype=np.float64)
+		self.epoch = 0 			# completed epochs
+		self.n_batches = 0 		# batches done within the current epoch
+		self.stream_shape = None 	# [len(stream), stream.chunk_size] fitted to
+		if not checkpoint_path is None and os.path.exists(checkpoint_path):
+			self.load_checkpoint()
+
+
+	def load_checkpoint(self):
+		checkpoint = np.load(self.checkpoint_path)
+		self.centroids = checkpoint['centroids']
+		self.counts = checkpoint['counts']
+		self.epoch, self.n_batches = [int(x) for x in checkpoint['progress']]
+		self.stream_shape = [int(x) for x in checkpoint['stream_shape']]
+		if not len(self.centroids) == self.n_clusters:
+			raise ValueError("Checkpoint %s has %d clusters, not %d" % (self.checkpoint_path, len(self.centroids), self.n_clusters))
+
+
+	def checkpoint(self):
+		"""
+			atomically saves centroids and progress to checkpoint_path
+		"""
+		if self.checkpoint_path is None:
+			return
+		tmp_path = self.checkpoint_path + '.tmp.npz'
+		np.savez(tmp_path, centroids=self.centroids, counts=self.counts, progress=np.array([self.epoch, self.n_batches]), stream_shape=np.array(self.stream_shape))
+		os.rename(tmp_path, self.checkpoint_path)
+
+
+
+
+	####################[ FITTING	]###############################################
+
+	def fit(self, stream, epochs=1, callback=None):
+		"""
+			fits centroids to stream, making epochs passes over it.
+			Resuming from a checkpoint skips the batches already done,
+			so it's refused if the stream's length or chunk_size differ
+			from the checkpointed ones. callback(kmeans), if given, is
+			called after each checkpoint.
+		"""
+		stream_shape = [len(stream), stream.chunk_size]
+		if not self.stream_shape is None and not self.stream_shape == stream_shape:
+			raise ValueError("Can't resume: fitted to a stream of length %d in chunks of %d, not %d in chunks of %d" % tuple(self.stream_shape + stream_shape))
+		self.stream_shape = stream_shape
+		pool = ThreadPool(self.workers)
+		try:
+			while self.epoch < epochs:
+				batch_index = 0
+				for chunk_index, (_, X) in enumerate(stream):
+					if self.centroids is None:
+						self.init_centroids(X)
+
+					#=====[ same batches when resumed	]=====
+					order = np.random.RandomState([self.seed, self.epoch, chunk_index]).permutation(len(X))
+					for start in xrange(0, len(X), self.batch_size):
+						batch_index += 1
+						if batch_index <= self.n_batches:
+							continue
+						self.update(X[order[start:start+self.batch_size]], pool)
+						self.n_batches = batch_index
+						if self.n_batches % self.checkpoint_every == 0:
+							self.checkpoint()
+							if not callback is None:
+								callback(self)
+				if self.centroids is None:
+					raise ValueError("Nothing to cluster: stream is empty")
+				self.epoch += 1
+				self.n_batches = 0
+				self.checkpoint()
+				if not callback is None:
+					callback(self)
+		finally:
+			pool.close()
+		return self
+
+
+	def init_centroids(self, X):
+		"""
+			centroids := random distinct rows of the first chunk
+		"""
+		if len(X) < self.n_clusters:
+			raise ValueError("First chunk has %d rows; need at least n_clusters (%d)" % (len(X), self.n_clusters))
+		self.centroids = X[np.random.RandomState(self.seed).choice(len(X), self.n_clusters, replace=False)].astype(np.float64)
+
+
+	def update(self, X, pool):
+		"""
+			moves each centroid towards the mean of its batch members,
+			with per-centroid learning rate 1/(points seen)
+		"""
+		labels = self.predict(X, pool)
+		batch_counts = np.bincount(labels, minlength=self.n_clusters).astype(np.float64)
+		sums = np.zeros_like(self.centroids)
+		np.add.at(sums, labels, X)
+		self.counts += batch_counts
+		updated = batch_counts > 0
+		self.centroids[updated] += (sums[updated] - batch_counts[updated, np.newaxis] * self.centroids[updated]) / self.counts[updated, np.newaxis]
+
+
+
+
+	####################[ ASSIGNMENT	]###########################################
+
+	def nearest(self, X):
+		distances = (self.centroids ** 2).sum(axis=1)[np.newaxis, :] - 2 * np.dot(X, self.centroids.T)
+		return np.argmin(distances, axis=1)
+
+
+	def predict(self, X, pool=None):
+		"""
+			returns index of the nearest centroid for each row of X
+		"""
+		if pool is None or len(X) < 2 * self.workers:
+			return self.nearest(X)
+		splits = np.array_split(X, self.workers)
+		return np.concatenate(pool.map(self.nearest, splits))
+
+
+	def predict_stream(self, stream):
+		"""
+			yields (keys, labels) for each chunk of stream
+		"""
+		pool = ThreadPool(self.workers)
+		try:
+			for keys, X in stream:
+				yield keys, self.predict(X, pool)
+		finally:
+			pool.close()
+
+
+
+
+################################################################################
+####################[ WRITING ASSIGNMENTS	]###################################
+################################################################################
+
+def write_assignments(client, datatype, item, out_item, kmeans, batch_size=1000, **stream_kwargs):
+	"""
+		sets memory item out_item of every object of datatype having
+		item to its cluster: an int for vector items, a list of ints
+		(one per row) for matrix items. Adds out_item to the schema if
+		needed; writes with one bulk_write per batch_size objects,
+		dropping derived items computed from out_item and notifying
+		the client's listeners after each. Returns the number of
+		objects written.
+	"""
+	if not out_item in client.get_schema(datatype).modes:
+		client.add_item(datatype, out_item, {'mode':'memory'})
+	table = client.get_schema(datatype)
+	collection = client.get_collection(datatype)
+	key = 'items.' + out_item
+	dependents = table.dependents.get(out_item, [])
+	disk_dependents = [d for d in dependents if table.modes[d] == 'disk']
+
+	def flush(assignments):
+		if len(assignments) == 0:
+			return 0
+		ids = [_id for _id, _ in assignments]
+
+		#=====[ derived disk items: remove their files	]=====
+		if len(disk_dependents) > 0:
+			projection = {'items.' + d:1 for d in disk_dependents}
+			for doc in collection.find({'_id':{'$in':ids}}, projection):
+				for path in doc.get('items', {}).values():
+					if not path is None and os.path.exists(path):
+						os.remove(path)
+
+		operations = []
+		for _id, label in assignments:
+			update = {'$set':{key:label}}
+			if len(dependents) > 0:
+				update['$unset'] = {'items.' + d:'' for d in dependents}
+			operations.append(UpdateOne({'_id':_id}, update))
+		collection.bulk_write(operations, ordered=False)
+		if len(client.listeners) > 0:
+			for doc in collection.find({'_id':{'$in':ids}}, {'items':1}):
+				client.notify('update', datatype, doc['_id'], doc['items'])
+		return len(assignments)
+
+	#=====[ rows of an object are contiguous; an object is done when the next starts	]=====
+	assignments, pending, written = [], {}, 0
+	for keys, labels in kmeans.predict_stream(FeatureStream(client, datatype, item, **stream_kwargs)):
+		for k, label in zip(keys, labels):
+			if type(k) == tuple:
+				_id, row = k
+				if row == 0 and len(pending) > 0:
+					assignments.extend(pending.items())
+					pending = {}
+				pending.setdefault(_id, []).append(int(label))
+			else:
+				assignments.append((k, int(label)))
+			if len(assignments) >= batch_size:
+				written += flush(assignments)
+				assignments = []
+	assignments.extend(pending.items())
+	return written + flush(assignments)
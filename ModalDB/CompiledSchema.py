@@ -0,0 +1,145 @@
+'''
+Module: CompiledSchema
+======================
+
+Description:
+------------
+
+	Immutable per-datatype lookup tables compiled once from a parsed
+	ModalSchema. DataObjects, ModalDicts and ModalClient read from
+	these rather than rescanning schema dicts on every call.
+
+
+Example Usage:
+--------------
+
+	table = schema.table(Frame)
+	table.items_by_mode['disk'] 	# frozenset(['image'])
+	table.load_funcs['image'] 		# <function>
+	table['image']['mode'] 			# 'disk'; tables index like schema dicts
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+
+
+class DatatypeTable(object):
+	"""
+		Class: DatatypeTable
+		====================
+
+		Immutable lookup tables for a single datatype:
+
+			- item_names: sorted tuple of item names
+			- item_set: frozenset of item names
+			- item_index: item name -> position in item_names
+			- modes: item name -> mode
+			- items_by_mode: mode -> frozenset of item names
+			- load_funcs/save_funcs/filenames: disk item name -> value
+			- derived: derived item name -> (func, input item names)
+			- dependents: item name -> frozenset of derived items computed
+				from it, directly or not
+			- childtypes: tuple of contained datatypes
+			- childtype_set: frozenset of contained datatypes
+			- is_root: True if no other datatype contains this one
+			- name: name of the datatype (None if compiled from a bare dict)
+
+		Indexing a table by item name (or 'contains') returns the same
+		thing indexing the parsed schema dict would.
+	"""
+	__slots__ = [	'items', 'item_names', 'item_set', 'item_index', 'modes', 'items_by_mode',
+					'load_funcs', 'save_funcs', 'filenames', 'derived', 'dependents', 'childtypes', 'childtype_set', 'is_root', 'name']
+
+	def __init__(self, obj_dict, is_root=True, name=None, data_modes=('memory', 'disk')):
+		"""
+			obj_dict: parsed schema dict for one datatype
+			is_root: whether this datatype is a root type
+			name: name of the datatype
+		"""
+		items = {k:v for k,v in obj_dict.items() if not k == 'contains'}
+		disk_items = [k for k,v in items.items() if v['mode'] == 'disk']
+		set_ = super(DatatypeTable, self).__setattr__
+
+		set_('items', items)
+		set_('item_names', tuple(sorted(items.keys())))
+		set_('item_set', frozenset(items.keys()))
+		set_('item_index', {k:i for i, k in enumerate(self.item_names)})
+		set_('modes', {k:v['mode'] for k,v in items.items()})
+		set_('items_by_mode', {m:frozenset([k for k,v in items.items() if v['mode'] == m]) for m in data_modes})
+		set_('load_funcs', {k:items[k]['load_func'] for k in disk_items})
+		set_('save_funcs', {k:items[k]['save_func'] for k in disk_items})
+		set_('filenames', {k:items[k]['filename'] for k in disk_items})
+		set_('derived', {k:(v['func'], tuple(v['inputs'])) for k,v in items.items() if v.get('kind') == 'derived'})
+		set_('dependents', derived_dependents(self.derived))
+		set_('childtypes', tuple(obj_dict.get('contains', [])))
+		set_('childtype_set', frozenset(self.childtypes))
+		set_('is_root', is_root)
+		set_('name', name)
+
+
+	def __setattr__(self, name, value):
+		raise AttributeError("DatatypeTable is immutable")
+
+
+	def __getitem__(self, key):
+		if key == 'contains':
+			return list(self.childtypes)
+		return self.items[key]
+
+
+	def __contains__(self, key):
+		return key == 'contains' or key in self.item_set
+
+
+	def keys(self):
+		return list(self.item_names) + ['contains']
+
+
+
+def derived_dependents(derived):
+	"""
+		returns {item name: frozenset of derived items depending on it,
+		transitively} given derived, {derived item: (func, inputs)}
+	"""
+	direct = {}
+	for name, (_, inputs) in derived.items():
+		for input_name in inputs:
+			direct.setdefault(input_name, set()).add(name)
+
+	dependents = {}
+	for item_name in direct:
+		found, frontier = set(), list(direct[item_name])
+		while len(frontier) > 0:
+			name = frontier.pop()
+			if not name in found:
+				found.add(name)
+				frontier.extend(direct.get(name, []))
+		dependents[item_name] = frozenset(found)
+	return dependents
+
+
+def as_table(schema):
+	"""
+		returns schema as a DatatypeTable, compiling it if it's a
+		plain (parsed) schema dict for one datatype
+	"""
+	if isinstance(schema, DatatypeTable):
+		return schema
+	return DatatypeTable(schema)
+
+
+def compile_schema(schema_dict):
+	"""
+		returns (tables, root_types) for a parsed schema dict, where
+		tables maps each datatype to its DatatypeTable
+	"""
+	contained = set()
+	for obj_dict in schema_dict.values():
+		contained.update(obj_dict.get('contains', []))
+	root_types = frozenset([d for d in schema_dict.keys() if not d in contained])
+	tables = {d:DatatypeTable(obj_dict, is_root=(d in root_types), name=d.__name__) for d, obj_dict in schema_dict.items()}
+	return tables, root_types
@@ -12,6 +12,8 @@ Description:
 	Key properties:
 		- abstracts away details of what items are stored where
 		- lazily loads items on disk
+		- lazily computes derived items, storing them; writing an
+			item drops those derived from it
 
 	Terminology:
 		- item: key, value pair
@@ -34,11 +36,52 @@ jhack@stanford.edu
 ##################
 '''
 import os
-import dill as pickle
+import weakref
 from copy import deepcopy
 
 from ModalDicts import DiskDict, MemoryDict
 from ChildContainer import ChildContainer
+from CompiledSchema import as_table
+
+
+#=====[ ModalClients alive in this process; used to rebind unpickled DataObjects	]=====
+registered_clients = weakref.WeakSet()
+
+def register_client(client):
+	registered_clients.add(client)
+
+
+def find_client(root, database_key=None):
+	"""
+		returns the ModalClient in this process with the longest root 
+		containing the path root (and, if given, serving the database 
+		identified by database_key; see ModalClient.database_key), or 
+		None. Raises if clients of different databases tie.
+	"""
+	candidates = []
+	for client in registered_clients:
+		client_root = os.path.join(os.path.abspath(client.root), '')
+		if os.path.abspath(root).startswith(client_root):
+			if database_key is None or client.database_key() == database_key:
+				candidates.append((len(client_root), client))
+	if len(candidates) == 0:
+		return None
+	longest = max(n for n, _ in candidates)
+	candidates = [c for n, c in candidates if n == longest]
+	if len(set(c.database_key() for c in candidates)) > 1:
+		raise Exception("Ambiguous ModalClient for %s: %d clients of different databases share its root" % (root, len(candidates)))
+	return candidates[0]
+
+
+def rebind_dataobject(datatype, _id, mongo_doc, database_key=None):
+	"""
+		unpickles a DataObject, binding it to this process's 
+		ModalClient for its root and database
+	"""
+	client = find_client(mongo_doc['root'], database_key)
+	if client is None:
+		raise Exception("No ModalClient in this process to bind %s %s to" % (datatype.__name__, _id))
+	return datatype(mongo_doc, client.get_schema(datatype), client)
 
 
 class DataObject(object):
@@ -74,18 +117,19 @@ class DataObject(object):
 			Args:
 			-----
 			- mongo_doc: dict containing root, in-memory items
-			- schema: dict containing schema for this object
+			- schema: DatatypeTable (or parsed schema dict) for this object
 			- client: reference to ModalClient object
 		"""
 		self._id = mongo_doc['_id']
 		self.root = mongo_doc['root']
-		self.schema = schema
+		self.schema = as_table(schema)
 		self.client = client
+		instrumentation = getattr(client, 'instrumentation', None)
 		self.items = {
-						'disk':DiskDict(mongo_doc, self.schema),
+						'disk':DiskDict(mongo_doc, self.schema, instrumentation),
 						'memory':MemoryDict(mongo_doc, self.schema)
 					}
-		self.children = ChildContainer(self._id, schema, mongo_doc)
+		self.children = ChildContainer(self._id, self.schema, mongo_doc)
 
 
 
@@ -96,7 +140,7 @@ class DataObject(object):
 	################################################################################
 
 	def __contains__(self, key):
-		return any([key in d for d in self.items.values()])
+		return key in self.schema.item_set
 
 
 	def detect_keyerror(self, key):
@@ -105,39 +149,129 @@ class DataObject(object):
 
 
 	def get_mode(self, key):
-		return self.schema[key]['mode']
+		return self.schema.modes[key]
 
 
-	def update_mongo_doc(self):
+	def get_item_dict(self):
 		"""
-			updates the mongodb representation 
-			of this DataObject 
+			returns the 'items' portion of this object's mongo_doc
 		"""
 		new_item_dict = {}
 		for k in self.items['disk'].present_items:
 			new_item_dict[k] = self.items['disk'].paths[k]
 		for k in self.items['memory'].present_items:
 			new_item_dict[k] = self.items['memory'].data[k]
-		self.client.update_mongo_doc(type(self), self._id, new_item_dict)
+		return new_item_dict
+
+
+	def to_mongo_doc(self):
+		return {
+					'_id':self._id,
+					'root':self.root,
+					'items':self.get_item_dict(),
+					'children':self.children.childtype_dicts
+				}
+
+
+	def update_mongo_doc(self):
+		"""
+			updates the mongodb representation 
+			of this DataObject 
+		"""
+		self.client.update_mongo_doc(type(self), self._id, self.get_item_dict())
+
+
+	def __reduce__(self):
+		"""
+			pickles as (datatype, _id, mongo_doc, database key); 
+			unpickling binds to the receiving process's ModalClient for 
+			the same root and database. Loaded disk items are not 
+			included.
+		"""
+		database_key = self.client.database_key() if not self.client is None else None
+		return (rebind_dataobject, (type(self), self._id, self.to_mongo_doc(), database_key))
 
 
 
 	def __getitem__(self, key):
 		self.detect_keyerror(key)
-		return self.items[self.get_mode(key)][key]
+		value = self.items[self.get_mode(key)][key]
+		if value is None and key in self.schema.derived:
+			value = self.compute_derived(key)
+			if not value is None:
+				self[key] = value
+		return value
+
+
+	def compute_derived(self, key):
+		"""
+			returns derived item key computed from its inputs, without
+			storing it; None if an input is absent
+		"""
+		func, inputs = self.schema.derived[key]
+		values = [self[k] for k in inputs]
+		if any([v is None for v in values]):
+			return None
+		return func(*values)
+
+
+	def invalidate_dependents(self, key):
+		"""
+			drops stored derived items computed from key (not from 
+			mongodb; callers update it). Returns True if any were present.
+		"""
+		invalidated = False
+		for dependent in self.schema.dependents.get(key, []):
+			items = self.items[self.get_mode(dependent)]
+			if items.item_present(dependent):
+				del items[dependent]
+				invalidated = True
+		return invalidated
 
 
 	def __setitem__(self, key, value):
 		self.detect_keyerror(key)
-		if self.items[self.get_mode(key)][key] is None:	
+		invalidated = self.invalidate_dependents(key)
+		writer = getattr(self.client, 'writer', None)
+		if not writer is None and self.get_mode(key) == 'disk':
+			self.set_item_deferred(key, value, writer)
+			if invalidated:
+				self.update_mongo_doc()
+		elif self.items[self.get_mode(key)][key] is None:	
 			self.items[self.get_mode(key)][key] = value
 			self.update_mongo_doc()
 		else:
 			self.items[self.get_mode(key)][key] = value
 
+			#=====[ disk overwrites keep their path: mongodb is unchanged	]=====
+			if invalidated or self.get_mode(key) == 'memory':
+				if not self.client is None:
+					self.update_mongo_doc()
+			else:
+				self.notify_update()
+
+
+	def notify_update(self):
+		"""
+			tells the client's listeners (if any) this object changed,
+			without writing to mongodb
+		"""
+		if not self.client is None and len(self.client.listeners) > 0:
+			self.client.notify('update', type(self), self._id, self.get_item_dict())
+
+
+	def set_item_deferred(self, key, value, writer):
+		"""
+			write-behind: queues the save of disk item key to writer; 
+			mongodb records a new item only once its file is durable,
+			and listeners hear of overwrites once they are
+		"""
+		self.items['disk'].set_item_deferred(key, value, writer, self.update_mongo_doc, self.notify_update)
+
 
 	def __delitem__(self, key):
 		self.detect_keyerror(key)
+		self.invalidate_dependents(key)
 		del self.items[self.get_mode(key)][key]
 		self.update_mongo_doc()
 
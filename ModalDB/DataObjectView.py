@@ -0,0 +1,159 @@
+'''
+Class: DataObjectView
+=====================
+
+Description:
+------------
+
+	Compact, read-mostly view of a DataObject for bulk scans.
+
+	A view holds only the raw mongo_doc and a reference to the
+	datatype's compiled DatatypeTable; reading an item goes straight
+	to the doc (memory items) or the item's load_func (disk items).
+	The full DataObject, with its ModalDicts and ChildContainer, is
+	only built on the first write or on access to anything else
+	(get_child, Frame.get_mask, ...).
+
+
+Example Usage:
+--------------
+
+	for frame in client.iter(Frame, view=True):
+		frame['subtitles']
+
+	# reuse a single view object across iteration steps
+	for frame in client.iter(Frame, view=True, flyweight=True):
+		...
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import time
+
+
+class DataObjectView(object):
+	"""
+		Class: DataObjectView
+		=====================
+
+		Slotted view over a mongo_doc of type datatype.
+
+		Disk items are not cached; reading one twice loads it twice.
+	"""
+	__slots__ = ['datatype', 'mongo_doc', 'schema', 'client', 'dataobject']
+
+	def __init__(self, datatype, mongo_doc, schema, client):
+		"""
+			Args:
+			-----
+			- datatype: DataObject subclass this is a view of
+			- mongo_doc: dict containing root, in-memory items
+			- schema: DatatypeTable for datatype
+			- client: reference to ModalClient object
+		"""
+		self.datatype = datatype
+		self.schema = schema
+		self.client = client
+		self.rebind(mongo_doc)
+
+
+	def rebind(self, mongo_doc):
+		"""
+			points this view at another mongo_doc, dropping any
+			DataObject built for the previous one
+		"""
+		self.mongo_doc = mongo_doc
+		self.dataobject = None
+
+
+	def promote(self):
+		"""
+			returns the full DataObject for this view, building it on
+			first call
+		"""
+		if self.dataobject is None:
+			self.dataobject = self.datatype(self.mongo_doc, self.schema, self.client)
+		return self.dataobject
+
+
+	@property
+	def _id(self):
+		return self.mongo_doc['_id']
+
+
+	@property
+	def root(self):
+		return self.mongo_doc['root']
+
+
+	def __getattr__(self, name):
+		if name in DataObjectView.__slots__:
+			raise AttributeError(name)
+		return getattr(self.promote(), name)
+
+
+	def __str__(self):
+		return str(self.promote())
+
+
+
+
+	################################################################################
+	####################[ ITEM ACCESS	]###########################################
+	################################################################################
+
+	def __contains__(self, key):
+		return key in self.schema.item_set
+
+
+	def detect_keyerror(self, key):
+		if not key in self:
+			raise KeyError("No such item: %s" % key)
+
+
+	def __getitem__(self, key):
+		if not self.dataobject is None:
+			return self.dataobject[key]
+
+		self.detect_keyerror(key)
+		items = self.mongo_doc['items']
+		if not key in items and key in self.schema.derived:
+			return self.promote()[key]
+		if not self.schema.modes[key] == 'disk':
+			return items.get(key)
+		if not key in items:
+			return None
+
+		path = os.path.join(self.root, self.schema.filenames[key])
+		instrumentation = getattr(self.client, 'instrumentation', None)
+		if instrumentation is None:
+			return self.schema.load_funcs[key](path)
+		start = time.time()
+		value = self.schema.load_funcs[key](path)
+		instrumentation.record('disk_load', '%s.%s' % (self.schema.name, key), time.time() - start, os.path.getsize(path))
+		return value
+
+
+	def __setitem__(self, key, value):
+		self.promote()[key] = value
+
+
+	def __delitem__(self, key):
+		del self.promote()[key]
+
+
+	@property
+	def present_items(self):
+		if not self.dataobject is None:
+			return self.dataobject.present_items
+		return set(self.schema.item_set.intersection(self.mongo_doc['items'].keys()))
+
+
+	@property
+	def absent_items(self):
+		return set(self.schema.item_set) - self.present_items
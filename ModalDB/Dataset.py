@@ -0,0 +1,242 @@
+'''
+Class: Dataset
+==============
+
+Description:
+------------
+
+	Indexable, batched view over a snapshot of the objects of one
+	datatype, for feeding training jobs.
+
+	Key properties:
+		- ids are snapshotted once; len() and integer indexing are O(1)
+		- per-epoch deterministic shuffling and sharding
+		- batches loaded by worker processes through a bounded
+			prefetch queue
+		- ndarray items collated into (batch_size, ...) arrays
+
+
+Example Usage:
+--------------
+
+	dataset = client.dataset(Frame, items=['image', 'subtitles'])
+	for epoch in range(10):
+		for batch in dataset.iter_batches(32, epoch=epoch, num_workers=4):
+			batch['image'] # (32, h, w, 3) ndarray
+			batch['subtitles'] # list of 32 strings
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import traceback
+import multiprocessing as mp
+from Queue import Empty
+import numpy as np
+
+
+class Dataset(object):
+	"""
+		Class: Dataset
+		==============
+
+		Indexable, batched view over a snapshot of the objects of one
+		datatype.
+
+		dataset[i] returns the i-th DataObject, or a dict of its items
+		if 'items' was specified.
+	"""
+
+	def __init__(self, client, datatype, items=None, filter=None):
+		"""
+			Args:
+			-----
+			- client: ModalClient to load objects through
+			- datatype: type of objects in the dataset
+			- items: (optional) names of items to load for each object
+			- filter: (optional) mongodb query selecting objects
+		"""
+		self.client = client
+		self.datatype = datatype
+		self.items = None if items is None else list(items)
+
+		if not self.items is None:
+			outside_items = set(self.items).difference(client.get_item_names(datatype))
+			if len(outside_items) > 0:
+				raise KeyError("Items don't exist for datatype %s: %s" % (datatype.__name__, str(outside_items)))
+
+		cursor = client.get_collection(datatype).find(filter or {}, {'_id':1})
+		self.ids = np.array(sorted([d['_id'] for d in cursor]), dtype=object)
+
+
+
+
+	################################################################################
+	####################[ INDEXING	]###############################################
+	################################################################################
+
+	def __len__(self):
+		return len(self.ids)
+
+
+	def __getitem__(self, ix):
+		return self.to_sample(self.client.get(self.datatype, self.ids[ix]))
+
+
+	def to_sample(self, dataobject):
+		if self.items is None:
+			return dataobject
+		return {k:dataobject[k] for k in self.items}
+
+
+	def load_batch(self, ixs):
+		"""
+			loads the objects at positions ixs with one query and
+			collates them
+		"""
+		dataobjects = self.client.get_many(self.datatype, list(self.ids[ixs]))
+		return self.collate([self.to_sample(d) for d in dataobjects])
+
+
+	def collate(self, samples):
+		"""
+			merges a list of samples into a batch: for each item,
+			ndarrays of identical shape and dtype are stacked into one
+			preallocated array; anything else is kept as a list.
+			Samples that are DataObjects are returned as a list.
+		"""
+		if self.items is None:
+			return samples
+
+		batch = {}
+		for k in self.items:
+			values = [s[k] for s in samples]
+			first = values[0]
+			if isinstance(first, np.ndarray) and all([isinstance(v, np.ndarray) and v.shape == first.shape and v.dtype == first.dtype for v in values]):
+				batch[k] = np.empty((len(values),) + first.shape, dtype=first.dtype)
+				for i, v in enumerate(values):
+					batch[k][i] = v
+			else:
+				batch[k] = values
+		return batch
+
+
+
+
+	################################################################################
+	####################[ BATCHING	]###############################################
+	################################################################################
+
+	def epoch_order(self, epoch=0, shuffle=True, seed=0, num_shards=1, shard_index=0):
+		"""
+			returns positions of this shard's objects for the given
+			epoch; shuffling is deterministic in (seed, epoch), so all
+			shards agree on the permutation
+		"""
+		if not 0 <= shard_index < num_shards:
+			raise ValueError("shard_index must be in [0, num_shards)")
+		order = np.arange(len(self))
+		if shuffle:
+			order = np.random.RandomState(seed + epoch).permutation(order)
+		return order[shard_index::num_shards]
+
+
+	def iter_batches(self, batch_size, epoch=0, shuffle=True, seed=0, drop_last=False,
+						num_workers=0, prefetch=2, num_shards=1, shard_index=0):
+		"""
+			yields collated batches of batch_size objects, in the order
+			given by epoch_order.
+
+			Args:
+			-----
+			- num_workers: number of worker processes loading batches;
+				0 loads them in this process
+			- prefetch: number of loaded batches buffered per worker
+			- num_shards/shard_index: restrict to one of num_shards
+				disjoint shards, i.e. one per training process
+		"""
+		order = self.epoch_order(epoch, shuffle, seed, num_shards, shard_index)
+		end = len(order) - len(order) % batch_size if drop_last else len(order)
+		batches = [order[i:i+batch_size] for i in xrange(0, end, batch_size)]
+
+		if num_workers == 0:
+			for ixs in batches:
+				yield self.load_batch(ixs)
+		else:
+			for batch in self.iter_parallel(batches, num_workers, prefetch):
+				yield batch
+
+
+	def iter_parallel(self, batches, num_workers, prefetch, poll_interval=1.0):
+		"""
+			loads batches in num_workers forked processes, yielding
+			them in order; tasks are fed prefetch * num_workers ahead of
+			the batch being yielded, bounding memory. Workers reconnect to mongodb on first use;
+			DataObjects they load are rebound to this process's client.
+
+			While waiting, workers are checked every poll_interval
+			seconds; raises if one died (i.e. killed by the OOM killer)
+			or all exited before delivering every batch.
+		"""
+		#=====[ at most window batches queued or loaded ahead of the one yielded	]=====
+		window = max(1, prefetch * num_workers)
+		task_queue = mp.Queue()
+		result_queue = mp.Queue(maxsize=window)
+		def enqueue(k):
+			if k < len(batches):
+				task_queue.put((k, batches[k]))
+			if k == len(batches) - 1:
+				for _ in range(num_workers):
+					task_queue.put(None)
+		for k in xrange(min(window, len(batches))):
+			enqueue(k)
+
+		workers = [mp.Process(target=self.worker_loop, args=(task_queue, result_queue)) for _ in range(num_workers)]
+		for w in workers:
+			w.daemon = True
+			w.start()
+
+		try:
+			pending = {}
+			for k in xrange(len(batches)):
+				while not k in pending:
+					try:
+						done_k, batch, error = result_queue.get(timeout=poll_interval)
+					except Empty:
+						self.check_workers(workers)
+						continue
+					if not error is None:
+						raise Exception("Error loading batch in worker:\n%s" % error)
+					pending[done_k] = batch
+				enqueue(k + window)
+				yield pending.pop(k)
+		finally:
+			for w in workers:
+				w.terminate()
+
+
+	def check_workers(self, workers):
+		"""
+			raises if a worker died, or if all exited, while batches
+			are still outstanding
+		"""
+		for w in workers:
+			if not w.exitcode in [None, 0]:
+				raise Exception("Worker process %d exited with code %d before delivering its batches" % (w.pid, w.exitcode))
+		if all(not w.is_alive() for w in workers):
+			raise Exception("All worker processes exited before delivering their batches")
+
+
+	def worker_loop(self, task_queue, result_queue):
+		"""
+			runs in worker processes: loads batches from task_queue
+			until it receives None
+		"""
+		for k, ixs in iter(task_queue.get, None):
+			try:
+				result_queue.put((k, self.load_batch(ixs), None))
+			except Exception:
+				result_queue.put((k, None, traceback.format_exc()))
@@ -0,0 +1,326 @@
+'''
+Class: FilesystemSync
+=====================
+
+Description:
+------------
+
+	Incrementally brings mongodb in line with the directory tree
+	under a ModalClient's root, i.e.
+
+		<root>/Video/<video>/Frame/<frame>/image.png
+
+	The tree is scanned level by level, object directories in
+	parallel (os.scandir where available). Each object's disk items
+	are fingerprinted by (size, mtime) and compared with the
+	fingerprints stored in its mongo_doc ('stat'); only the
+	differences are written, in bulk:
+
+		- new directories: docs inserted, linked into their parents
+		- changed/added/removed files: 'items' and 'stat' updated;
+			derived items computed from changed files are dropped
+		- objects inserted through the client or Ingestor (no 'stat'
+			yet) whose files match their 'items': only 'stat' is
+			recorded, as a baseline
+		- vanished directories: docs deleted, unlinked from parents
+
+	Directories starting with '.' (trash, temporary files) are ignored.
+
+
+Example Usage:
+--------------
+
+	client.sync()
+	# {'Video':{'inserted':0, 'updated':1, 'deleted':0, 'unchanged':41},
+	#  'Frame':{'inserted':3000, ...}, 'seconds':2.1}
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import time
+from multiprocessing.pool import ThreadPool
+from pymongo import InsertOne, UpdateOne, DeleteOne
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None
+
+
+def scan_dir(path):
+	"""
+		returns ({subdirectory names}, {file name: (size, mtime)}) for
+		path, skipping names starting with '.'; ({}, {}) if it doesn't
+		exist
+	"""
+	dirs, files = set(), {}
+	if not os.path.isdir(path):
+		return dirs, files
+	if not scandir is None:
+		for entry in scandir(path):
+			if entry.name.startswith('.'):
+				continue
+			if entry.is_dir():
+				dirs.add(entry.name)
+			else:
+				stat = entry.stat()
+				files[entry.name] = (stat.st_size, stat.st_mtime)
+	else:
+		for name in os.listdir(path):
+			if name.startswith('.'):
+				continue
+			full_path = os.path.join(path, name)
+			if os.path.isdir(full_path):
+				dirs.add(name)
+			else:
+				stat = os.stat(full_path)
+				files[name] = (stat.st_size, stat.st_mtime)
+	return dirs, files
+
+
+
+class FilesystemSync(object):
+	"""
+		Class: FilesystemSync
+		=====================
+
+		Syncs client's mongodb with the filesystem; see module docstring.
+	"""
+
+	def __init__(self, client, workers=16, batch_size=1000, callback=None):
+		"""
+			Args:
+			-----
+			- client: ModalClient to sync
+			- workers: threads scanning directories
+			- batch_size: operations per bulk_write
+			- callback: (optional) called with (datatype, counts) after
+				each datatype is synced
+		"""
+		self.client = client
+		self.workers = workers
+		self.batch_size = batch_size
+		self.callback = callback
+
+
+	def run(self):
+		"""
+			syncs; returns {datatype name: counts, 'seconds':...}
+		"""
+		start = time.time()
+		for datatype in self.client.get_root_types():
+			if not os.path.isdir(self.client.get_root_type_dir(datatype)):
+				raise Exception("No directory for %s at %s; refusing to sync (it would delete everything)" % (datatype.__name__, self.client.get_root_type_dir(datatype)))
+
+		pool = ThreadPool(self.workers)
+		try:
+			on_disk, order = self.scan(pool)
+		finally:
+			pool.close()
+
+		#=====[ parents before children, so inserts can link into them	]=====
+		stats = {}
+		order += [d for d in self.client.get_datatypes() if not d in order]
+		for datatype in order:
+			stats[datatype.__name__] = self.sync_datatype(datatype, on_disk.get(datatype, {}))
+			if not self.callback is None:
+				self.callback(datatype, stats[datatype.__name__])
+		stats['seconds'] = time.time() - start
+		return stats
+
+
+	def scan(self, pool):
+		"""
+			scans the tree level by level, object directories in 
+			parallel; returns ({datatype: {_id: (root, fingerprint)}}, 
+			datatypes in the order encountered)
+		"""
+		on_disk, order = {}, []
+		frontier = [(d, self.client.get_root_type_dir(d), None) for d in self.client.get_root_types()]
+		while len(frontier) > 0:
+			to_scan = []
+			for datatype, directory, parent_id in frontier:
+				object_names, _ = scan_dir(directory)
+				for name in object_names:
+					_id = name if parent_id is None else parent_id + '/' + name
+					root = os.path.abspath(os.path.join(directory, name)) if parent_id is None else os.path.join(directory, name)
+					to_scan.append((datatype, _id, root))
+
+			frontier = []
+			for datatype, _id, root, fingerprint in pool.map(self.scan_object, to_scan):
+				if not datatype in on_disk:
+					on_disk[datatype] = {}
+					order.append(datatype)
+				on_disk[datatype][_id] = (root, fingerprint)
+				frontier.extend([(c, os.path.join(root, c.__name__), _id) for c in self.client.get_childtypes(datatype)])
+		return on_disk, order
+
+
+	def scan_object(self, args):
+		"""
+			returns (datatype, _id, root, fingerprint) for an object 
+			directory, where fingerprint maps present disk items to 
+			[size, mtime]
+		"""
+		datatype, _id, root = args
+		_, files = scan_dir(root)
+		filenames = self.client.get_schema(datatype).filenames
+		return datatype, _id, root, {k:list(files[f]) for k, f in filenames.items() if f in files}
+
+
+	def sync_datatype(self, datatype, on_disk):
+		"""
+			syncs objects of datatype given on_disk, {_id: (root, 
+			fingerprint)}; returns counts of changes
+		"""
+		collection = self.client.get_collection(datatype)
+		table = self.client.get_schema(datatype)
+		filenames = table.filenames
+
+		#=====[ Step 1: fetch ids and fingerprints in mongodb	]=====
+		projection = dict([('_id', 1), ('stat', 1)] + [('items.' + k, 1) for k in filenames])
+		in_db = {d['_id']:d for d in collection.find({}, projection)}
+
+		#=====[ Step 2: diff	]=====
+		inserts, updates, baselines = [], [], []
+		for _id, (root, fingerprint) in on_disk.items():
+			if not _id in in_db:
+				item_data = {k:os.path.join(root, filenames[k]) for k in fingerprint}
+				mongo_doc = self.client.create_mongo_doc(datatype, _id, root, item_data, self.split_id(_id)[0])
+				mongo_doc['stat'] = fingerprint
+				inserts.append(mongo_doc)
+			elif not 'stat' in in_db[_id] and sorted(in_db[_id].get('items', {}).keys()) == sorted(fingerprint.keys()):
+				baselines.append((_id, fingerprint))
+			elif not in_db[_id].get('stat') == fingerprint:
+				fingerprint, invalidated = self.invalidate_derived(table, root, in_db[_id].get('stat', {}), fingerprint)
+				updates.append((_id, root, fingerprint, in_db[_id].get('items', {}), invalidated))
+		deletes = [_id for _id in in_db if not _id in on_disk]
+
+		#=====[ Step 3: apply in bulk	]=====
+		self.apply_inserts(datatype, inserts)
+		self.apply_updates(datatype, updates, filenames)
+		self.apply_deletes(datatype, deletes)
+		self.bulk_write(collection, [UpdateOne({'_id':_id}, {'$set':{'stat':fingerprint}}) for _id, fingerprint in baselines])
+		return {'inserted':len(inserts), 'updated':len(updates), 'deleted':len(deletes), 'unchanged':len(on_disk) - len(inserts) - len(updates)}
+
+
+	def invalidate_derived(self, table, root, old_fingerprint, fingerprint):
+		"""
+			returns (fingerprint, invalidated): derived items computed
+			from items whose files changed since the last sync are
+			invalidated, and their files removed.
+
+			Items without a previous fingerprint (never synced, i.e.
+			written through the client) are a baseline, not a change.
+			Derived disk items are kept if written after the changed
+			input; memory ones, having no timestamp, are dropped.
+		"""
+		invalidated = set()
+		for k, old in old_fingerprint.items():
+			if old == fingerprint.get(k):
+				continue
+			for dependent in table.dependents.get(k, []):
+				if dependent in fingerprint and k in fingerprint and fingerprint[dependent][1] >= fingerprint[k][1]:
+					continue
+				invalidated.add(dependent)
+		for k in invalidated:
+			if k in fingerprint:
+				os.remove(os.path.join(root, table.filenames[k]))
+		return {k:v for k,v in fingerprint.items() if not k in invalidated}, invalidated
+
+
+	def bulk_write(self, collection, operations):
+		if len(operations) == 0:
+			return
+		for i in xrange(0, len(operations), self.batch_size):
+			collection.bulk_write(operations[i:i+self.batch_size], ordered=False)
+
+
+	def parent_types(self, datatype):
+		return [d for d in self.client.get_datatypes() if datatype in self.client.get_childtypes(d)]
+
+
+	def split_id(self, _id):
+		"""
+			returns (parent_id, raw_id); parent_id is None for root objects
+		"""
+		if not '/' in _id:
+			return None, _id
+		return tuple(_id.rsplit('/', 1))
+
+
+	def apply_inserts(self, datatype, inserts):
+		if len(inserts) == 0:
+			return
+		self.bulk_write(self.client.get_collection(datatype), [InsertOne(d) for d in inserts])
+
+		#=====[ link into parents (only the actual parent's doc matches)	]=====
+		links = []
+		for mongo_doc in inserts:
+			parent_id, raw_id = self.split_id(mongo_doc['_id'])
+			if not parent_id is None:
+				links.append(UpdateOne({'_id':parent_id}, {'$set':{'children.%s.%s' % (datatype.__name__, raw_id):mongo_doc['_id']}}))
+		if len(links) > 0:
+			for parenttype in self.parent_types(datatype):
+				self.bulk_write(self.client.get_collection(parenttype), links)
+
+		#=====[ notify listeners	]=====
+		if len(self.client.listeners) > 0:
+			parents = {}
+			for mongo_doc in inserts:
+				parent_id, _ = self.split_id(mongo_doc['_id'])
+				if not parent_id is None and not parent_id in parents:
+					parents[parent_id] = self.find_parent(datatype, parent_id)
+				self.client.notify('insert', datatype, mongo_doc, parents.get(parent_id))
+
+
+	def find_parent(self, datatype, parent_id):
+		for parenttype in self.parent_types(datatype):
+			try:
+				return self.client.get(parenttype, parent_id)
+			except KeyError:
+				pass
+		return None
+
+
+	def apply_updates(self, datatype, updates, filenames):
+		if len(updates) == 0:
+			return
+		operations = []
+		for _id, root, fingerprint, items, invalidated in updates:
+			update = {'$set':dict([('stat', fingerprint)] + [('items.' + k, os.path.join(root, filenames[k])) for k in fingerprint])}
+			removed = [k for k in items if not k in fingerprint] + [k for k in invalidated if not k in filenames]
+			if len(removed) > 0:
+				update['$unset'] = {'items.' + k:'' for k in removed}
+			operations.append(UpdateOne({'_id':_id}, update))
+		self.bulk_write(self.client.get_collection(datatype), operations)
+		if len(self.client.listeners) > 0:
+			for _id, _, _, _, _ in updates:
+				self.client.notify('update', datatype, _id, self.client.get_collection(datatype).find_one({'_id':_id})['items'])
+
+
+	def apply_deletes(self, datatype, deletes):
+		if len(deletes) == 0:
+			return
+		self.bulk_write(self.client.get_collection(datatype), [DeleteOne({'_id':_id}) for _id in deletes])
+
+		#=====[ unlink from parents that still exist	]=====
+		unlinks = []
+		for _id in deletes:
+			parent_id, raw_id = self.split_id(_id)
+			if not parent_id is None:
+				unlinks.append(UpdateOne({'_id':parent_id}, {'$unset':{'children.%s.%s' % (datatype.__name__, raw_id):''}}))
+		if len(unlinks) > 0:
+			for parenttype in self.parent_types(datatype):
+				self.bulk_write(self.client.get_collection(parenttype), unlinks)
+
+		for _id in deletes:
+			self.client.notify('delete', datatype, _id)
@@ -0,0 +1,140 @@
+'''
+Module: Formats
+===============
+
+Description:
+------------
+
+	Registry of named file formats for disk items, plus resolution of
+	functions and datatypes by dotted name. Lets schemas describe
+	items declaratively, i.e.
+
+		'image':{'mode':'disk', 'filename':'image.png', 'format':'png'}
+		'pose':{'mode':'disk', 'load_func':'myproject.io.load_pose'}
+
+	so they can be saved as plain JSON instead of pickled closures.
+	Heavy libraries (scipy, etc.) are imported when a format is first
+	used, not when it is registered.
+
+
+Example Usage:
+--------------
+
+	register_format('txt', lambda p: open(p).read(), lambda x, p: open(p, 'w').write(x))
+	load_func, save_func = get_format('png')
+	resolve_name('ModalDB.Frame.Frame') # <class 'ModalDB.Frame.Frame'>
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import importlib
+
+
+#=====[ format name -> (load_func, save_func)	]=====
+formats = {}
+
+
+def register_format(name, load_func, save_func=None):
+	"""
+		registers a named format; load_func(path) returns the item,
+		save_func(item, path) writes it
+	"""
+	formats[name] = (load_func, save_func)
+
+
+def get_format(name):
+	"""
+		returns (load_func, save_func) for a registered format
+	"""
+	if not name in formats:
+		raise KeyError("Unknown format: %s (registered: %s)" % (name, ', '.join(sorted(formats.keys()))))
+	return formats[name]
+
+
+
+
+################################################################################
+####################[ DOTTED NAMES	]###########################################
+################################################################################
+
+def resolve_name(dotted_name):
+	"""
+		returns the object named by dotted_name, i.e.
+		'package.module.attribute'
+	"""
+	module_name, _, attr = dotted_name.rpartition('.')
+	if module_name == '':
+		raise TypeError("Not a dotted name: %s" % dotted_name)
+	try:
+		return getattr(importlib.import_module(module_name), attr)
+	except (ImportError, AttributeError) as e:
+		raise TypeError("Couldn't resolve %s: %s" % (dotted_name, e))
+
+
+def dotted_name(obj):
+	"""
+		returns a dotted name that resolves back to obj, or None if
+		there isn't one (lambdas, closures, __main__ objects, ...)
+	"""
+	module_name, name = getattr(obj, '__module__', None), getattr(obj, '__name__', None)
+	if module_name is None or name is None or module_name == '__main__' or name == '<lambda>':
+		return None
+	try:
+		if resolve_name(module_name + '.' + name) is obj:
+			return module_name + '.' + name
+	except TypeError:
+		pass
+	return None
+
+
+
+
+################################################################################
+####################[ BUILTIN FORMATS	]#######################################
+################################################################################
+
+def load_npy(path):
+	import numpy as np
+	return np.load(path)
+
+def save_npy(item, path):
+	import numpy as np
+	np.save(open(path, 'wb'), item)
+
+
+def load_image(path):
+	from scipy.misc import imread
+	return imread(path)
+
+def save_image(item, path):
+	from scipy.misc import imsave
+	imsave(path, item)
+
+
+def load_mat(path):
+	from scipy.io import loadmat
+	return loadmat(path)
+
+def save_mat(item, path):
+	from scipy.io import savemat
+	savemat(path, item)
+
+
+def load_pkl(path):
+	import cPickle
+	return cPickle.load(open(path, 'rb'))
+
+def save_pkl(item, path):
+	import cPickle
+	cPickle.dump(item, open(path, 'wb'), cPickle.HIGHEST_PROTOCOL)
+
+
+register_format('npy', load_npy, save_npy)
+register_format('png', load_image, save_image)
+register_format('jpg', load_image, save_image)
+register_format('mat', load_mat, save_mat)
+register_format('pkl', load_pkl, save_pkl)
@@ -15,13 +15,7 @@ Fall 2014
 jhack@stanford.edu
 ##################
 '''
-import os
-import cPickle
-from collections import defaultdict
 import numpy as np
-import scipy as sp
-from scipy.misc import imread
-from scipy.io import loadmat
 
 from DataObject import DataObject
 
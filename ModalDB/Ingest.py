@@ -0,0 +1,221 @@
+'''
+Class: Ingestor
+===============
+
+Description:
+------------
+
+	Journaled, resumable bulk ingestion through a ModalClient.
+
+	Every object successfully inserted is appended to a journal file
+	('<Datatype>\t<_id>' per line; fsynced every checkpoint_every
+	objects). Rerunning an ingest with the same journal skips objects
+	already done, so a crash costs at most the objects since the
+	last checkpoint - and those are detected (their directory
+	exists, and so does their doc in mongodb) and skipped as well,
+	relinking them to their parent if the crash came before that.
+	Nothing is ever dropped. Skipping a journaled object costs no
+	mongodb access at all: it's returned as a JournaledObject,
+	loaded only if used, i.e. as the parent of a new object.
+
+	Throughput (objects/s, inserted vs. skipped) is reported to an
+	optional callback every report_every objects.
+
+
+Example Usage:
+--------------
+
+	with Ingestor(client, '/data/.ModalDB_ingest_journal') as ingestor:
+		for video_name in video_names:
+			video = ingestor.ingest(Video, video_name, {})
+			for frame_name, frame_data in frames(video_name):
+				ingestor.ingest(Frame, frame_name, frame_data, parent=video)
+	ingestor.stats() # {'inserted':..., 'skipped':..., 'objects_per_s':...}
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import time
+
+
+class Ingestor(object):
+	"""
+		Class: Ingestor
+		===============
+
+		Inserts objects through client, journaling completed ones to
+		journal_path; see module docstring.
+	"""
+
+	def __init__(self, client, journal_path, method='cp', checkpoint_every=100, report_every=1000, callback=None):
+		"""
+			Args:
+			-----
+			- client: ModalClient to insert through
+			- journal_path: path of journal; appended to if it exists
+			- method: (cp or mv) passed to client.insert
+			- checkpoint_every: fsync the journal every this many objects
+			- report_every: call callback(stats) every this many objects
+		"""
+		self.client = client
+		self.journal_path = journal_path
+		self.method = method
+		self.checkpoint_every = checkpoint_every
+		self.report_every = report_every
+		self.callback = callback
+
+		self.completed = self.read_journal()
+		self.journal = open(journal_path, 'a')
+		self.unsynced = 0
+		self.inserted = 0
+		self.skipped = 0
+		self.start_time = time.time()
+
+
+	def read_journal(self):
+		"""
+			returns set of (datatype name, _id) in the journal
+		"""
+		completed = set()
+		if os.path.exists(self.journal_path):
+			with open(self.journal_path) as f:
+				for line in f:
+					if line.endswith('\n'):
+						completed.add(tuple(line[:-1].split('\t', 1)))
+		return completed
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
+
+
+	def close(self):
+		self.checkpoint()
+		self.journal.close()
+
+
+
+
+	################################################################################
+	####################[ INGESTION	]###############################################
+	################################################################################
+
+	def is_done(self, datatype, _id):
+		return (datatype.__name__, _id) in self.completed
+
+
+	def ingest(self, datatype, _id, item_data, parent=None):
+		"""
+			inserts an object (see ModalClient.insert) unless it was
+			already ingested; returns it either way. Journaled objects
+			are returned as JournaledObjects, loaded only when used.
+		"""
+		full_id = _id if parent is None else parent._id + '/' + _id
+
+		#=====[ Case: journaled; no mongodb access	]=====
+		if self.is_done(datatype, full_id):
+			self.skipped += 1
+			dataobject = JournaledObject(self.client, datatype, full_id)
+
+		else:
+			if isinstance(parent, JournaledObject):
+				parent = parent.resolve()
+
+			#=====[ Case: inserted, but crashed before journaling (its directory exists)	]=====
+			if os.path.exists(self.object_root(datatype, _id, parent)) and not self.client.get_collection(datatype).find_one({'_id':full_id}, {'_id':1}) is None:
+				if not parent is None and not _id in parent.children.get_childtype_dict(datatype):
+					parent.add_child(datatype, full_id)
+				self.skipped += 1
+				self.record(datatype, full_id)
+				dataobject = self.client.get(datatype, full_id)
+
+			#=====[ Case: new	]=====
+			else:
+				dataobject = self.client.insert(datatype, _id, item_data, parent=parent, method=self.method)
+				self.inserted += 1
+				self.record(datatype, full_id)
+
+		if not self.callback is None and (self.inserted + self.skipped) % self.report_every == 0:
+			self.callback(self.stats())
+		return dataobject
+
+
+	def object_root(self, datatype, _id, parent):
+		"""
+			directory client.insert creates for the object
+		"""
+		if parent is None:
+			return os.path.abspath(os.path.join(self.client.get_root_type_dir(datatype), _id))
+		return os.path.join(parent.get_child_dir(datatype), _id)
+
+
+	def record(self, datatype, _id):
+		self.journal.write('%s\t%s\n' % (datatype.__name__, _id))
+		self.completed.add((datatype.__name__, _id))
+		self.unsynced += 1
+		if self.unsynced >= self.checkpoint_every:
+			self.checkpoint()
+
+
+	def checkpoint(self):
+		"""
+			makes journaled objects durable
+		"""
+		self.journal.flush()
+		os.fsync(self.journal.fileno())
+		self.unsynced = 0
+
+
+	def stats(self):
+		seconds = time.time() - self.start_time
+		return {
+					'inserted':self.inserted,
+					'skipped':self.skipped,
+					'seconds':seconds,
+					'objects_per_s':(self.inserted + self.skipped) / seconds if seconds > 0 else 0.0
+				}
+
+
+
+class JournaledObject(object):
+	"""
+		Class: JournaledObject
+		======================
+
+		Stands in for an object Ingestor skipped because it's in the
+		journal: _id and datatype are known without mongodb; anything
+		else loads the DataObject (once) and defers to it.
+	"""
+
+	def __init__(self, client, datatype, _id):
+		self.client = client
+		self.datatype = datatype
+		self._id = _id
+		self.dataobject = None
+
+
+	def resolve(self):
+		if self.dataobject is None:
+			self.dataobject = self.client.get(self.datatype, self._id)
+		return self.dataobject
+
+
+	def __getattr__(self, name):
+		return getattr(self.resolve(), name)
+
+
+	def __getitem__(self, key):
+		return self.resolve()[key]
+
+
+	def __setitem__(self, key, value):
+		self.resolve()[key] = value
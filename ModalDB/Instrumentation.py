@@ -0,0 +1,235 @@
+'''
+Module: Instrumentation
+=======================
+
+Description:
+------------
+
+	Optional counters and latency histograms for a ModalClient:
+	mongodb round-trips per datatype and operation, and time and
+	bytes spent loading/saving disk items per datatype and item.
+
+	Disabled by default; when disabled the only cost is a
+	'client.instrumentation is None' check at each hook point.
+
+
+Example Usage:
+--------------
+
+	client.instrument()
+	for frame in video.iter_children():
+		frame['image']
+	client.stats()['disk_load']['Frame.image']['mean_s']
+	client.stats()['mongo.find_one']['Frame']['count']
+
+	# forward every event to a profiler
+	client.instrument(callback=lambda event, key, seconds, nbytes: ...)
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import math
+import time
+
+
+class LatencyHistogram(object):
+	"""
+		Class: LatencyHistogram
+		=======================
+
+		Running count/total plus a histogram of latencies over
+		power-of-two microsecond buckets.
+	"""
+	n_buckets = 32
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.nbytes = 0
+		self.buckets = [0] * self.n_buckets
+
+
+	def record(self, seconds, nbytes=0):
+		self.count += 1
+		self.total += seconds
+		self.nbytes += nbytes
+		exponent = math.frexp(seconds * 1e6)[1]
+		self.buckets[min(max(exponent, 0), self.n_buckets - 1)] += 1
+
+
+	def percentile(self, q):
+		"""
+			returns upper bound (in seconds) of the bucket containing
+			the q-th percentile
+		"""
+		target = q / 100. * self.count
+		seen = 0
+		for exponent, n in enumerate(self.buckets):
+			seen += n
+			if seen >= target and n > 0:
+				return 2 ** exponent / 1e6
+		return 0.0
+
+
+	def summary(self):
+		return {
+					'count':self.count,
+					'total_s':self.total,
+					'mean_s':self.total / self.count if self.count > 0 else 0.0,
+					'p50_s':self.percentile(50),
+					'p95_s':self.percentile(95),
+					'bytes':self.nbytes,
+					'histogram_us':{2 ** e:n for e, n in enumerate(self.buckets) if n > 0}
+				}
+
+
+
+class Instrumentation(object):
+	"""
+		Class: Instrumentation
+		======================
+
+		Records events as (event, key) -> LatencyHistogram, where key
+		is a datatype name or 'datatype.item'. Every event is also
+		passed to each callback as callback(event, key, seconds, nbytes).
+	"""
+
+	def __init__(self, callbacks=None):
+		self.callbacks = list(callbacks or [])
+		self.reset()
+
+
+	def reset(self):
+		self.histograms = {}
+
+
+	def add_callback(self, callback):
+		self.callbacks.append(callback)
+
+
+	def record(self, event, key, seconds, nbytes=0):
+		histogram = self.histograms.get((event, key))
+		if histogram is None:
+			histogram = self.histograms[(event, key)] = LatencyHistogram()
+		histogram.record(seconds, nbytes)
+		for callback in self.callbacks:
+			callback(event, key, seconds, nbytes)
+
+
+	def stats(self):
+		"""
+			returns {event: {key: summary}}
+		"""
+		stats = {}
+		for (event, key), histogram in self.histograms.items():
+			stats.setdefault(event, {})[key] = histogram.summary()
+		return stats
+
+
+
+class InstrumentedCollection(object):
+	"""
+		Class: InstrumentedCollection
+		=============================
+
+		Wraps a pymongo collection, recording each method call as a
+		'mongo.<method>' event keyed by the collection's name. Cursors
+		returned by find and aggregate are wrapped (InstrumentedCursor),
+		so their events include the time spent fetching results.
+	"""
+	cursor_methods = ['find', 'aggregate']
+
+	def __init__(self, collection, instrumentation):
+		self.collection = collection
+		self.instrumentation = instrumentation
+
+
+	def __getitem__(self, key):
+		return self.collection[key]
+
+
+	def __getattr__(self, name):
+		attr = getattr(self.collection, name)
+		if not callable(attr):
+			return attr
+
+		def timed(*args, **kwargs):
+			start = time.time()
+			if name in self.cursor_methods:
+				cursor = attr(*args, **kwargs)
+				return InstrumentedCursor(cursor, self.instrumentation, 'mongo.' + name, self.collection.name, time.time() - start)
+			try:
+				return attr(*args, **kwargs)
+			finally:
+				self.instrumentation.record('mongo.' + name, self.collection.name, time.time() - start)
+		return timed
+
+
+
+class InstrumentedCursor(object):
+	"""
+		Class: InstrumentedCursor
+		=========================
+
+		Wraps a cursor, adding the time spent iterating it to the time
+		spent creating it; recorded as one event once it's exhausted,
+		closed, or garbage collected.
+	"""
+
+	def __init__(self, cursor, instrumentation, event, key, seconds):
+		self.cursor = cursor
+		self.instrumentation = instrumentation
+		self.event = event
+		self.key = key
+		self.seconds = seconds
+		self.recorded = False
+
+
+	def __getattr__(self, name):
+		attr = getattr(self.cursor, name)
+		if not callable(attr):
+			return attr
+
+		#=====[ chained modifiers (sort, limit, ...) return the cursor	]=====
+		def chained(*args, **kwargs):
+			result = attr(*args, **kwargs)
+			return self if result is self.cursor else result
+		return chained
+
+
+	def __iter__(self):
+		return self
+
+
+	def next(self):
+		start = time.time()
+		try:
+			doc = next(self.cursor)
+		except StopIteration:
+			self.seconds += time.time() - start
+			self.record()
+			raise
+		self.seconds += time.time() - start
+		return doc
+
+	__next__ = next
+
+
+	def record(self):
+		if not self.recorded:
+			self.recorded = True
+			self.instrumentation.record(self.event, self.key, self.seconds)
+
+
+	def close(self):
+		self.record()
+		if hasattr(self.cursor, 'close'):
+			self.cursor.close()
+
+
+	def __del__(self):
+		self.record()
@@ -17,14 +17,45 @@ jhack@stanford.edu
 import os
 import shutil
 import random
-import dill as pickle
 from copy import copy, deepcopy
 from itertools import islice
 from pprint import pformat, pprint
 from pymongo import MongoClient
 
 from ModalSchema import ModalSchema
+from DataObject import register_client
 from Video import Video
+from Dataset import Dataset
+from Sampler import HierarchySampler
+from DataObjectView import DataObjectView
+from Instrumentation import Instrumentation, InstrumentedCollection
+from Snapshot import Snapshot, export_snapshot
+from BackgroundJobs import BackgroundDeleter, DiskWriter, PurgeItemJob, BackfillJob
+from Ingest import Ingestor
+from FilesystemSync import FilesystemSync
+from NearestNeighbors import FeatureIndex
+
+
+def descendant_id_range(_id):
+	"""
+		returns a mongodb query on _id matching exactly the ids of 
+		descendants of the object named _id, i.e. those prefixed by 
+		'_id/'; it's a range, so it uses the _id index
+	"""
+	return {'$gte':_id + '/', '$lt':_id + chr(ord('/') + 1)}
+
+
+def descendant_query(ancestors):
+	"""
+		returns a mongodb query matching descendants of ancestors, a
+		DataObject/_id or a list of them
+	"""
+	if not type(ancestors) in [list, tuple, set]:
+		ancestors = [ancestors]
+	ids = [a if type(a) in [str, unicode] else a._id for a in ancestors]
+	if len(ids) == 1:
+		return {'_id':descendant_id_range(ids[0])}
+	return {'$or':[{'_id':descendant_id_range(_id)} for _id in ids]}
 
 
 class ModalClient(object):
@@ -45,14 +76,32 @@ class ModalClient(object):
 			...
 	"""
 
-	def __init__(self, root, schema=None):
+	def __init__(self, root, schema=None, mongo_client=None, snapshot=None, **connection_kwargs):
 		"""
 			Connect to MongoDB, load schema, find root path
+
+			mongo_client: (optional) pymongo.MongoClient-compatible 
+				object to use instead of connecting to localhost, 
+				i.e. a mongomock.MongoClient
+			connection_kwargs: passed on to pymongo.MongoClient, i.e.
+				host='db.example.com', port=27017, maxPoolSize=50,
+				serverSelectionTimeoutMS=2000, socketTimeoutMS=10000,
+				readPreference='secondaryPreferred'
+			snapshot: (optional) Snapshot to serve metadata from,
+				read-only, instead of mongodb; see open_snapshot
 		"""
 		#=====[ Step 1: get root	]=====
 		if not os.path.exists(root):
 			raise Exception("Root not valid: %s", root)
 		self.root = root
+		self.listeners = []
+		self.instrumentation = None
+		self.injected_mongo_client = mongo_client
+		self.connection_kwargs = connection_kwargs
+		self.snapshot = snapshot
+		self.deleter = None
+		self.writer = None
+		register_client(self)
 
 
 		#=====[ Step 2: get schema	]=====
@@ -74,11 +123,9 @@ class ModalClient(object):
 			starts mongodb; ensures proper collections exist;
 		"""
 		#=====[ Step 1: Connect	]=====
-		try:
-			self.mongo_client = MongoClient()
-			self.db = self.mongo_client.ModalDB
-		except:
-			raise Exception("Turn on MongoDB.")
+		self.connect_mongodb()
+		if not self.snapshot is None:
+			return
 		
 		#=====[ Step 2: Ensure collections/dirs exist	]=====
 		for datatype in self.get_datatypes():
@@ -93,6 +140,58 @@ class ModalClient(object):
 
 
 
+	def connect_mongodb(self):
+		"""
+			(re)connects to mongodb with self.connection_kwargs
+		"""
+		self.pid = os.getpid()
+		if not self.snapshot is None:
+			self._mongo_client, self._db = None, self.snapshot
+			return
+		try:
+			self._mongo_client = self.injected_mongo_client or MongoClient(**self.connection_kwargs)
+			self._db = self._mongo_client.ModalDB
+		except:
+			raise Exception("Turn on MongoDB.")
+
+
+	def ensure_connected(self):
+		"""
+			reconnects if this process was forked from the one that 
+			connected, since pymongo connections can't be shared 
+			across a fork. (An injected mongo_client is reused as is.)
+		"""
+		if not self.pid == os.getpid():
+			self.connect_mongodb()
+
+
+	def database_key(self):
+		"""
+			identifies the database behind this client, so unpickled 
+			DataObjects bind to a client of the same one: (host, port, 
+			database name), the snapshot's path, or the injected 
+			mongo_client's id
+		"""
+		if not self.snapshot is None:
+			return ('snapshot', os.path.abspath(self.snapshot.path))
+		if not self.injected_mongo_client is None:
+			return ('injected', id(self.injected_mongo_client))
+		host = self.connection_kwargs.get('host') or 'localhost'
+		return (str(host), self.connection_kwargs.get('port') or 27017, 'ModalDB')
+
+
+	@property
+	def mongo_client(self):
+		self.ensure_connected()
+		return self._mongo_client
+
+
+	@property
+	def db(self):
+		self.ensure_connected()
+		return self._db
+
+
 	def clear_db(self):
 		"""
 			drops old database and creates a new one
@@ -100,7 +199,99 @@ class ModalClient(object):
 		for db_name in self.mongo_client.database_names():
 			if not db_name in ['admin', 'local']:
 				self.mongo_client.drop_database(db_name)
-		self.db = self.mongo_client.ModalDB
+		self._db = self.mongo_client.ModalDB
+
+
+
+
+
+
+	####################################################################################################
+	######################[ --- SNAPSHOTS --- ]#########################################################
+	####################################################################################################
+
+	def export_snapshot(self, path):
+		"""
+			writes all metadata (docs, children, memory items and an 
+			id index) to a single snapshot file at path
+		"""
+		export_snapshot(self, path)
+
+
+	@classmethod
+	def open_snapshot(cls, path, schema=None):
+		"""
+			returns a read-only ModalClient serving get, get_many, iter
+			and children lookups from the snapshot at path, without a 
+			mongod. schema defaults to the one saved in the snapshot's 
+			root.
+		"""
+		snapshot = Snapshot(path)
+		return cls(snapshot.root, schema=schema, snapshot=snapshot)
+
+
+
+
+
+
+	####################################################################################################
+	######################[ --- LISTENERS --- ]#########################################################
+	####################################################################################################
+
+	def add_listener(self, listener):
+		"""
+			registers listener to be notified of changes made through 
+			this client. Listeners may define any of:
+				- on_insert(datatype, mongo_doc, parent)
+				- on_update(datatype, _id, new_item_dict)
+				- on_delete(datatype, _id)
+		"""
+		self.listeners.append(listener)
+
+
+	def remove_listener(self, listener):
+		self.listeners.remove(listener)
+
+
+	def notify(self, event, *args):
+		for listener in self.listeners:
+			handler = getattr(listener, 'on_' + event, None)
+			if not handler is None:
+				handler(*args)
+
+
+
+
+
+
+	####################################################################################################
+	######################[ --- INSTRUMENTATION --- ]##################################################
+	####################################################################################################
+
+	def instrument(self, enabled=True, callback=None):
+		"""
+			turns instrumentation of mongodb round-trips and disk item
+			loads/saves on or off; callback(event, key, seconds, nbytes)
+			is called for every recorded event. Only affects objects 
+			retrieved after the call.
+		"""
+		if not enabled:
+			self.instrumentation = None
+			return
+		if self.instrumentation is None:
+			self.instrumentation = Instrumentation()
+		if not callback is None:
+			self.instrumentation.add_callback(callback)
+
+
+	def stats(self):
+		"""
+			returns recorded statistics as {event: {key: summary}}, 
+			where key is a datatype name or 'datatype.item'
+		"""
+		if self.instrumentation is None:
+			return {}
+		return self.instrumentation.stats()
 
 
 
@@ -116,7 +307,8 @@ class ModalClient(object):
 			sets self.schema
 			if schema is None, loads default one from disk.
 		"""
-		#=====[ Step 1: Set schema path	]=====
+		#=====[ Step 1: Set schema paths (declarative and pickled)	]=====
+		self.json_schema_path = os.path.join(self.root, '.ModalDB_schema.json')
 		self.schema_path = os.path.join(self.root, '.ModalDB_schema.pkl')
 
 		#=====[ Step 2: Load schema	]=====
@@ -131,35 +323,114 @@ class ModalClient(object):
 
 
 	def load_schema(self):
-		if not os.path.exists(self.schema_path):
+		"""
+			loads the most recently saved of the JSON and pickled schemas
+		"""
+		paths = [p for p in [self.json_schema_path, self.schema_path] if os.path.exists(p)]
+		if len(paths) == 0:
 			raise Exception("No schema exists or was specified")
-		return ModalSchema(self.schema_path)
+		return ModalSchema(max(paths, key=os.path.getmtime))
 
 
 	def save_schema(self):
-		self.schema.save(self.schema_path)
+		"""
+			saves the schema as JSON if it's declarative, otherwise as a
+			dill pickle; removes the other file so it can't go stale
+		"""
+		path, stale_path = self.json_schema_path, self.schema_path
+		if not self.schema.is_declarative():
+			path, stale_path = stale_path, path
+		self.schema.save(path)
+		if os.path.exists(stale_path):
+			os.remove(stale_path)
 
 
 	def print_schema(self):
 		pprint(self.schema.schema_dict)
 
 
-	def add_item(self, datatype, item_name, item_dict):
+	def add_item(self, datatype, item_name, item_dict, backfill=None, workers=8, now=True, callback=None):
 		"""
 			adds an item to the schema, overwriting old ones.
 			item_dict describes the schema of the item
+
+			if backfill is given, sets item := backfill(dataobject) for 
+			all existing objects of datatype (see BackfillJob) and 
+			returns the job. Objects are available with the item as 
+			soon as their batch is written.
+
+			Args:
+			-----
+			- backfill: (optional) function of a DataObject returning 
+				the item's value, or None to skip the object
+			- workers: number of threads computing items
+			- now: if True, backfills before returning; otherwise runs 
+				in the background (see job.progress(), job.wait())
+			- callback: called with the job after each batch
 		"""
 		self.schema.add_item(datatype, item_name, item_dict)
+		if backfill is None:
+			return None
+		job = BackfillJob(self, datatype, item_name, backfill, workers=workers, callback=callback)
+		if now:
+			job.run()
+			return job
+		return job.start()
 
 
-	def delete_item(self, datatype, item_name, now=True):
+	def delete_item(self, datatype, item_name, now=True, callback=None):
 		"""
-			deletes the named item from the database 
-			TODO: actually go through and delete them all
+			deletes the named item from the schema, then purges it from
+			every object of datatype (files and mongo_docs); see 
+			purge_item. Returns the PurgeItemJob.
 		"""
+		table = self.get_schema(datatype)
+		filename = table.filenames.get(item_name)
 		self.schema.delete_item(datatype, item_name)
-		for datatype in self.schema.datatypes():
-			pass
+		return self.purge_item(datatype, item_name, filename=filename, now=now, callback=callback)
+
+
+	def purge_item(self, datatype, item_name, filename=None, now=True, callback=None):
+		"""
+			removes item_name from every object of datatype: its file 
+			(for disk items, named filename) and its entry in 'items'.
+			Resumable: calling it again after an interruption finishes 
+			the job.
+
+			Args:
+			-----
+			- now: if True, purges before returning; otherwise runs in 
+				the background (see job.progress(), job.wait())
+			- callback: called with the job after each batch
+		"""
+		job = PurgeItemJob(self, datatype, item_name, filename=filename, callback=callback)
+		if now:
+			job.run()
+			return job
+		return job.start()
+
+
+	def precompute(self, datatype, item_name, workers=8, now=True, callback=None):
+		"""
+			computes and stores derived item item_name for every object 
+			of datatype that doesn't have it yet, on a thread pool (see
+			BackfillJob). Returns the job.
+
+			Args:
+			-----
+			- workers: number of threads computing items
+			- now: if True, computes before returning; otherwise runs in 
+				the background (see job.progress(), job.wait())
+			- callback: called with the job after each batch
+		"""
+		if not item_name in self.get_schema(datatype).derived:
+			raise KeyError("%s is not a derived item of %s" % (item_name, datatype.__name__))
+		compute = lambda dataobject: dataobject.compute_derived(item_name)
+		job = BackfillJob(self, datatype, item_name, compute, workers=workers, callback=callback)
+		if now:
+			job.run()
+			return job
+		return job.start()
 
 
 
@@ -170,45 +441,67 @@ class ModalClient(object):
 	####################################################################################################
 
 	def get_schema(self, datatype):
-		return self.schema[datatype]
+		"""
+			returns the compiled DatatypeTable for datatype
+		"""
+		return self.schema.table(datatype)
 
 	def get_datatypes(self):
-		return set(self.schema.keys())
+		return self.schema.datatype_set
 
 	def is_valid_datatype(self, datatype):
-		return datatype in self.get_datatypes()
+		return datatype in self.schema.tables
 
 	def get_collection(self, datatype):
 		assert self.is_valid_datatype(datatype)
-		return self.db[datatype.__name__]
+		if self.instrumentation is None:
+			return self.db[datatype.__name__]
+		return InstrumentedCollection(self.db[datatype.__name__], self.instrumentation)
 
 	def get_childtypes(self, datatype):
 		assert self.is_valid_datatype(datatype)
-		if not 'contains' in self.get_schema(datatype):
-			return set([])
-		else:
-			return set(self.schema[datatype]['contains'])
+		return self.get_schema(datatype).childtype_set
 
 	def get_item_names(self, datatype):
-		return set(self.get_schema(datatype).keys()).difference(set(['contains']))
+		return self.get_schema(datatype).item_set
 
 	def get_item_filename(self, datatype, key):
 		assert self.is_valid_datatype(datatype)
-		return self.get_schema(datatype)[key]['filename']
+		return self.get_schema(datatype).filenames[key]
 
 	def is_leaf_type(self, datatype):
 		return len(self.get_childtypes(datatype)) == 0
 
 	def get_root_types(self):
-		ds = self.get_datatypes()
-		return ds.difference(set.union(*[self.get_childtypes(d) for d in ds]))
+		return self.schema.root_types
 
 	def is_root_type(self, datatype):
-		return datatype in self.get_root_types()
+		return self.get_schema(datatype).is_root
 
 	def get_root_type_dir(self, datatype):
 		return os.path.join(self.root, datatype.__name__)
 
+	def get_descendant_types(self, datatype):
+		"""
+			returns set of all datatypes that can be nested (at any 
+			depth) under datatype
+		"""
+		descendant_types, frontier = set(), [datatype]
+		while len(frontier) > 0:
+			for childtype in self.get_childtypes(frontier.pop()):
+				if not childtype in descendant_types:
+					descendant_types.add(childtype)
+					frontier.append(childtype)
+		return descendant_types
+
+	def get_deleter(self):
+		"""
+			returns this process's BackgroundDeleter, starting it if needed
+		"""
+		if self.deleter is None or not self.deleter.pid == os.getpid():
+			self.deleter = BackgroundDeleter(os.path.join(self.root, '.ModalDB_trash'))
+		return self.deleter
+
 
 
 
@@ -224,6 +517,7 @@ class ModalClient(object):
 		"""
 		collection = self.get_collection(datatype)
 		collection.update({'_id':_id}, {'$set': {'items':new_item_dict}})
+		self.notify('update', datatype, _id, new_item_dict)
 
 
 	def mongo_doc_to_dataobject(self, datatype, mongo_doc):
@@ -241,26 +535,179 @@ class ModalClient(object):
 		return self.mongo_doc_to_dataobject(datatype, mongo_doc)
 
 
+	def get_many(self, datatype, _ids):
+		"""
+			returns list of objects of type datatype named in _ids, in
+			the same order, fetched with a single query
+		"""
+		cursor = self.get_collection(datatype).find({'_id':{'$in':list(_ids)}})
+		mongo_docs = {d['_id']:d for d in cursor}
+		missing = [_id for _id in _ids if not _id in mongo_docs]
+		if len(missing) > 0:
+			raise KeyError("No such objects in DB: %s" % str(missing))
+		return [self.mongo_doc_to_dataobject(datatype, mongo_docs[_id]) for _id in _ids]
+
+
 	def get_random(self, datatype):
 		"""
 			returns random object of type datatype
 		"""
 		collection = self.get_collection(datatype)
-		cursor = collection.find()
-		random_ix = random.randint(0, cursor.count())
-		mongo_doc = cursor.next()
-		for _ in range(random_ix):
-			mongo_doc = cursor.next()
+		random_ix = random.randint(0, collection.count_documents({}) - 1)
+		mongo_doc = next(iter(collection.find().skip(random_ix).limit(1)))
 		return self.mongo_doc_to_dataobject(datatype, mongo_doc)
 
 
-	def iter(self, datatype):
+	def count(self, datatype, where=None):
+		"""
+			returns number of objects of given datatype matching where,
+			a mongodb query (i.e. {'items.masks':{'$exists':True}}); 
+			counted server-side
+		"""
+		return self.get_collection(datatype).count_documents(where or {})
+
+
+	def coverage(self, datatype, where=None, by_parent=False):
+		"""
+			returns, for each item of datatype, how many objects have it 
+			(non-null) and how many don't, computed with one aggregation:
+
+				{'total':n, 'items':{name:{'present':p, 'absent':n-p}}}
+
+			with by_parent, returns {parent _id: the above} instead. 
+			Objects inserted before parents were recorded ('parent' 
+			field) are grouped under None.
+		"""
+		item_names = sorted(self.get_item_names(datatype))
+		group = {'_id':'$parent' if by_parent else None, 'total':{'$sum':1}}
+		for i, name in enumerate(item_names):
+			group['item_%d' % i] = {'$sum':{'$cond':[{'$gt':['$items.' + name, None]}, 1, 0]}}
+		pipeline = [{'$match':where or {}}, {'$group':group}]
+
+		coverage = {}
+		for result in self.get_collection(datatype).aggregate(pipeline):
+			present = [(name, result['item_%d' % i]) for i, name in enumerate(item_names)]
+			coverage[result['_id']] = {
+										'total':result['total'],
+										'items':{name:{'present':p, 'absent':result['total'] - p} for name, p in present}
+									}
+		if by_parent:
+			return coverage
+		return coverage.get(None, {'total':0, 'items':{name:{'present':0, 'absent':0} for name in item_names}})
+
+
+	def iter(self, datatype, view=False, flyweight=False):
 		"""
 			iterates through all objects of given datatype
+
+			Args:
+			-----
+			- view: yield lightweight DataObjectViews rather than 
+				DataObjects; see DataObjectView
+			- flyweight: (with view) yield the same DataObjectView 
+				each step, rebound to the next object. Don't hold on 
+				to it across steps.
+		"""
+		return self.iter_cursor(datatype, self.get_collection(datatype).find(), view, flyweight)
+
+
+	def iter_descendants(self, ancestors, datatype, view=False, flyweight=False):
+		"""
+			iterates through all objects of given datatype nested (at 
+			any depth) under ancestors, a DataObject/_id or a list of 
+			them, in _id order. One streamed range query on the _id 
+			index; see iter for view/flyweight.
+
+			ex: client.iter_descendants(video, Frame)
+		"""
+		cursor = self.get_collection(datatype).find(descendant_query(ancestors)).sort('_id', 1)
+		return self.iter_cursor(datatype, cursor, view, flyweight)
+
+
+	def count_descendants(self, ancestors, datatype):
+		"""
+			returns number of objects of given datatype nested under 
+			ancestors; see iter_descendants
+		"""
+		return self.get_collection(datatype).count_documents(descendant_query(ancestors))
+
+
+	def iter_cursor(self, datatype, cursor, view=False, flyweight=False):
+		"""
+			yields DataObjects (or DataObjectViews) for the mongo_docs 
+			from cursor
 		"""
-		cursor = self.get_collection(datatype).find()
-		for i in xrange(cursor.count()):
-			yield self.mongo_doc_to_dataobject(datatype, cursor.next())
+		if not view:
+			for mongo_doc in cursor:
+				yield self.mongo_doc_to_dataobject(datatype, mongo_doc)
+
+		elif flyweight:
+			dataobject_view = DataObjectView(datatype, None, self.get_schema(datatype), self)
+			for mongo_doc in cursor:
+				dataobject_view.rebind(mongo_doc)
+				yield dataobject_view
+
+		else:
+			schema = self.get_schema(datatype)
+			for mongo_doc in cursor:
+				yield DataObjectView(datatype, mongo_doc, schema, self)
+
+
+
+
+
+
+	def dataset(self, datatype, items=None, filter=None):
+		"""
+			returns a Dataset over a snapshot of the ids of all objects 
+			of type datatype matching filter (a mongodb query on the 
+			object's doc). See Dataset.
+		"""
+		return Dataset(self, datatype, items=items, filter=filter)
+
+
+	def sampler(self, parenttype, childtype, mode='uniform', weight=None, seed=None):
+		"""
+			returns a HierarchySampler drawing childtype objects across 
+			all parenttype objects; it is kept up to date with inserts, 
+			updates and deletes made through this client.
+		"""
+		sampler = HierarchySampler(self, parenttype, childtype, mode=mode, weight=weight, seed=seed)
+		self.add_listener(sampler)
+		return sampler
+
+
+	def ingestor(self, journal_path=None, **kwargs):
+		"""
+			returns an Ingestor inserting through this client; the 
+			journal defaults to .ModalDB_ingest_journal in root
+		"""
+		if journal_path is None:
+			journal_path = os.path.join(self.root, '.ModalDB_ingest_journal')
+		return Ingestor(self, journal_path, **kwargs)
+
+
+	def sync(self, workers=16, callback=None):
+		"""
+			incrementally syncs mongodb with the directory tree under 
+			root: inserts objects whose directories appeared, updates 
+			those whose disk items changed (by size/mtime) and deletes 
+			those whose directories vanished. Returns counts per 
+			datatype; see FilesystemSync.
+		"""
+		return FilesystemSync(self, workers=workers, callback=callback).run()
+
+
+	def feature_index(self, datatype, item, **kwargs):
+		"""
+			builds a k-nearest-neighbor index over item (a feature
+			vector, or one row per mask) of datatype and keeps it up to
+			date as objects change; see NearestNeighbors.FeatureIndex
+			for kwargs (metric, mode, ...)
+		"""
+		index = FeatureIndex(self, datatype, item, **kwargs)
+		self.add_listener(index)
+		return index
 
 
 
@@ -275,14 +722,16 @@ class ModalClient(object):
 		"""
 			returns portion of item_data describing disk items
 		"""
-		return {k:v for k,v in item_data.items() if self.get_schema(datatype)[k]['mode'] == 'disk'}
+		disk_items = self.get_schema(datatype).items_by_mode['disk']
+		return {k:v for k,v in item_data.items() if k in disk_items}
 
 
 	def get_memory_items(self, datatype, item_data):
 		"""
 			returns portion of item_data describing memory items 
 		"""
-		return {k:v for k,v in item_data.items() if self.get_schema(datatype)[k]['mode'] == 'memory'}
+		memory_items = self.get_schema(datatype).items_by_mode['memory']
+		return {k:v for k,v in item_data.items() if k in memory_items}
 
 
 	def sanitize_item_data(self, datatype, item_data):
@@ -354,7 +803,7 @@ class ModalClient(object):
 
 
 
-	def create_mongo_doc(self, datatype, _id, root, item_data):
+	def create_mongo_doc(self, datatype, _id, root, item_data, parent_id=None):
 		"""
 			returns doc that can be inserted into a mongodb collection
 			to represent this item.
@@ -363,6 +812,7 @@ class ModalClient(object):
 			{
 				'root':/path/to/datatype/directory,
 				'_id':/unique/id/for/datatype,
+				'parent':_id of parent (None for root types),
 				'items': {
 							'disk_item_1':/path/to/file, # denotes that disk_item_1 should be there
 							...
@@ -376,6 +826,7 @@ class ModalClient(object):
 		"""
 		return {
 					'_id':_id,
+					'parent':parent_id,
 					'root':root,
 					'items':copy(item_data),
 					'children':{c.__name__:{} for c in self.get_childtypes(datatype)}
@@ -428,26 +879,31 @@ class ModalClient(object):
 		self.create_object_dir(datatype, root, item_data, method)
 
 		#=====[ Step 5: create + insert mongo doc	]=====
-		mongo_doc = self.create_mongo_doc(datatype, _id, root, item_data)
+		mongo_doc = self.create_mongo_doc(datatype, _id, root, item_data, None if parent is None else parent._id)
 		self.get_collection(datatype).insert(mongo_doc)
 
 		#=====[ Step 6: add to parent, if necessary	]=====
 		if not parent is None:
 			parent.add_child(datatype, _id)
+		self.notify('insert', datatype, mongo_doc, parent)
 
 		#=====[ Step 7: create and return datatype	]=====
 		return datatype(mongo_doc, schema, self)
 
 
-	def delete(self, datatype, _id, parent=None):
+	def delete(self, datatype, _id, parent=None, background=True):
 		"""
-			deletes dataobject of specified datatype, _id, parent.
+			deletes dataobject of specified datatype, _id, parent, 
+			along with all of its descendants.
 
 			Args:
 			-----
 			- datatype: type of object to create
 			- _id: name of object to create 
 			- parent: parent object
+			- background: if True, the object's directory is renamed 
+				away immediately and removed on a background thread 
+				(see wait_for_deletes); otherwise removed before returning
 		"""
 		#=====[ Case: parent exists	]=====
 		if not parent is None:
@@ -459,11 +915,71 @@ class ModalClient(object):
 			dataobject = self.get(datatype, _id)
 
 		#=====[ Step 1: remove data on filesystem	]=====
-		shutil.rmtree(dataobject.root)
+		if os.path.exists(dataobject.root):
+			if background:
+				self.get_deleter().delete(dataobject.root)
+			else:
+				shutil.rmtree(dataobject.root)
+
+		#=====[ Step 2: remove descendants in mongodb, one range delete per type	]=====
+		query = descendant_query(dataobject)
+		for descendant_type in self.get_descendant_types(datatype):
+			collection = self.get_collection(descendant_type)
+			if len(self.listeners) == 0:
+				collection.delete_many(query)
+				continue
+
+			#=====[ listeners need the ids deleted	]=====
+			descendant_ids = [d['_id'] for d in collection.find(query, {'_id':1})]
+			if len(descendant_ids) > 0:
+				collection.delete_many(query)
+			for descendant_id in descendant_ids:
+				self.notify('delete', descendant_type, descendant_id)
 
-		#=====[ Step 2: remove data in mongodb	]=====
+		#=====[ Step 3: remove data in mongodb	]=====
 		collection = self.get_collection(datatype)
 		collection.remove({'_id':dataobject._id})
+		self.notify('delete', datatype, dataobject._id)
+
+
+	def write_behind(self, enabled=True, workers=4, max_pending=256):
+		"""
+			enables/disables write-behind for disk items: setting one 
+			queues its save to a pool of workers threads and returns 
+			immediately. Files are written to a temporary path, fsynced 
+			and renamed into place; new items are recorded in mongodb 
+			only after that. Call flush() to wait for queued writes.
+		"""
+		if not self.writer is None:
+			self.writer.close()
+		self.writer = DiskWriter(workers, max_pending) if enabled else None
+
+
+	def flush(self):
+		"""
+			blocks until queued disk writes are durable and recorded 
+			in mongodb; raises if any failed
+		"""
+		if not self.writer is None:
+			self.writer.flush()
+
+
+	def close(self):
+		"""
+			waits for queued writes and background deletes, then stops
+			the writer
+		"""
+		self.write_behind(enabled=False)
+		self.wait_for_deletes()
+
+
+	def wait_for_deletes(self):
+		"""
+			blocks until background directory removals have finished;
+			raises if any failed
+		"""
+		if not self.deleter is None:
+			self.deleter.wait()
 
 
 
@@ -22,8 +22,52 @@ jhack@stanford.edu
 ##################
 '''
 import os
+import time
+import uuid
+import threading
 from collections import defaultdict
 
+from CompiledSchema import as_table
+
+
+def save_durable(save_func, value, path):
+	"""
+		saves value to a temporary file next to path (with the same 
+		extension, for save_funcs that dispatch on it) and fsyncs it;
+		returns the temporary file's path
+	"""
+	directory, filename = os.path.split(path)
+	tmp_path = os.path.join(directory, '.tmp.%s.%s' % (uuid.uuid4().hex, filename))
+	try:
+		save_func(value, tmp_path)
+		with open(tmp_path, 'rb') as f:
+			os.fsync(f.fileno())
+	except:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+	return tmp_path
+
+
+def fsync_dir(directory):
+	"""
+		fsyncs directory, making renames into it durable
+	"""
+	fd = os.open(directory, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+def atomic_save(save_func, value, path):
+	"""
+		saves value to path such that path is always either the old or
+		the new file, never a torn one
+	"""
+	os.rename(save_durable(save_func, value, path), path)
+	fsync_dir(os.path.dirname(path) or '.')
+
 class ModalDict(object):
 	"""
 		Base class for DiskDict, MemoryDict, DynamicDict
@@ -32,9 +76,11 @@ class ModalDict(object):
 	def __init__(self, mongo_doc, datatype_schema):
 		"""
 			initializes self.keys, self.present, self.data
+			datatype_schema: DatatypeTable (or parsed schema dict)
 		"""
 		assert not self.mode is None
-		self.keys 		= set([k for k,v in datatype_schema.items() if not k == 'contains' and v['mode'] == self.mode])
+		self.table 		= as_table(datatype_schema)
+		self.keys 		= self.table.items_by_mode[self.mode]
 		self.present 	= defaultdict(lambda: False, {k:True for k in mongo_doc['items'].keys()})
 		self.data 		= defaultdict(lambda: None)
 
@@ -59,7 +105,7 @@ class ModalDict(object):
 		"""
 			returns set of items that are not present.
 		"""
-		return self.keys - self.present_items
+		return set(self.keys) - self.present_items
 
 
 	def __contains__(self, key):
@@ -150,17 +196,27 @@ class DiskDict(ModalDict):
 	"""
 	mode = 'disk'
 
-	def __init__(self, mongo_doc, datatype_schema):
+	def __init__(self, mongo_doc, datatype_schema, instrumentation=None):
+		"""
+			instrumentation: (optional) Instrumentation recording 
+				'disk_load'/'disk_save' events
+		"""
 		super(DiskDict, self).__init__(mongo_doc, datatype_schema)
 
 		self.root = mongo_doc['root']
-		items = datatype_schema
+		self.instrumentation = instrumentation
 
-		self.load_funcs = {k:items[k]['load_func'] for k in self.keys}
-		self.save_funcs = {k:items[k]['save_func'] for k in self.keys}
-		self.paths 		= {k:os.path.join(self.root, items[k]['filename']) for k in self.keys}
+		self.load_funcs = self.table.load_funcs
+		self.save_funcs = self.table.save_funcs
+		self.paths 		= {k:os.path.join(self.root, f) for k, f in self.table.filenames.items()}
 		self.data 		= {k:None for k in self.keys}
 
+		#=====[ write-behind: key -> generation of its latest queued save	]=====
+		self.pending 	= {}
+		self.generation = 0
+		self.unrecorded = set() # new items whose file isn't durable yet
+		self.lock 		= threading.Lock()
+
 		self.check_paths_exist()
 
 
@@ -178,16 +234,83 @@ class DiskDict(ModalDict):
 			loads the specified item 
 		"""
 		assert key in self
-		self.data[key] = self.load_funcs[key](self.paths[key])
+		if self.instrumentation is None:
+			self.data[key] = self.load_funcs[key](self.paths[key])
+		else:
+			start = time.time()
+			self.data[key] = self.load_funcs[key](self.paths[key])
+			self.record('disk_load', key, time.time() - start)
 
 
 	def save_item(self, key):
 		"""
-			saves the specified item 
+			saves the specified item (atomically)
 		"""
 		assert key in self
 		assert not self.save_funcs[key] is None
-		self.save_funcs[key](self.data[key], self.paths[key])
+		if self.instrumentation is None:
+			atomic_save(self.save_funcs[key], self.data[key], self.paths[key])
+		else:
+			start = time.time()
+			atomic_save(self.save_funcs[key], self.data[key], self.paths[key])
+			self.record('disk_save', key, time.time() - start)
+
+
+	def item_present(self, key):
+		"""
+			new items with a write queued aren't present until it's durable
+		"""
+		return self.present[key] and not key in self.unrecorded
+
+
+	def set_item_deferred(self, key, value, writer, on_recorded=None, on_overwritten=None):
+		"""
+			sets named item; queues the save to writer (a DiskWriter).
+			Once its file and the rename into place are durable,
+			on_recorded() is called if the item is new, otherwise
+			on_overwritten(). Of several queued
+			saves to one item, the latest wins. If the latest fails, the
+			item reverts to what is on disk (absent, if it was new).
+		"""
+		self.detect_keyerror(key)
+		assert not self.save_funcs[key] is None
+		with self.lock:
+			if not self.item_present(key):
+				self.unrecorded.add(key)
+			self.present[key] = True
+			self.data[key] = value
+			self.generation += 1
+			generation = self.pending[key] = self.generation
+
+		def write():
+			try:
+				tmp_path = save_durable(self.save_funcs[key], value, self.paths[key])
+			except:
+				with self.lock:
+					if self.pending.get(key) == generation:
+						del self.pending[key]
+						self.unrecorded.discard(key)
+						self.present[key] = os.path.exists(self.paths[key])
+						self.data[key] = None
+				raise
+			with self.lock:
+				if not self.pending.get(key) == generation:
+					os.remove(tmp_path)
+					return
+				os.rename(tmp_path, self.paths[key])
+				del self.pending[key]
+				is_new = key in self.unrecorded
+				self.unrecorded.discard(key)
+			fsync_dir(os.path.dirname(self.paths[key]) or '.')
+			callback = on_recorded if is_new else on_overwritten
+			if not callback is None:
+				callback()
+		writer.submit(write)
+
+
+	def record(self, event, key, seconds):
+		nbytes = os.path.getsize(self.paths[key]) if os.path.isfile(self.paths[key]) else 0
+		self.instrumentation.record(event, '%s.%s' % (self.table.name, key), seconds, nbytes)
 
 
 	def get_item(self, key):
@@ -213,7 +336,11 @@ class DiskDict(ModalDict):
 			from disk
 		"""
 		self.data[key] = None
-		os.remove(self.paths[key])
+		with self.lock:
+			self.pending.pop(key, None)
+			self.unrecorded.discard(key)
+			if os.path.exists(self.paths[key]):
+				os.remove(self.paths[key])
 
 
 
@@ -8,6 +8,14 @@ Description:
 	Contains functionality for dealing with and interpreting 
 	ModalDB schemas
 
+	Schemas whose datatypes and load/save functions can all be named
+	(registered formats or module-level functions) are saved as JSON
+	(or YAML); others fall back to dill pickles.
+
+	Items of kind 'derived' are computed from other items of the same
+	object by func(*inputs) on first access, then stored in their
+	mode like any other item; writing an input invalidates them.
+
 
 ##################
 Jay Hack
@@ -15,11 +23,40 @@ Fall 2014
 jhack@stanford.edu
 ##################
 '''
+import os
+import json
 import inspect
-import dill as pickle
 from pprint import pformat
 
 from DataObject import *
+from CompiledSchema import compile_schema
+from Formats import get_format, resolve_name, dotted_name
+
+
+#=====[ (path, mtime, size) -> parsed schema_dict, for declarative schemas	]=====
+parsed_cache = {}
+declarative_extensions = ['.json', '.yaml', '.yml']
+
+
+def to_str(x):
+	"""
+		converts unicode in decoded JSON/YAML to str, recursively
+	"""
+	if isinstance(x, unicode):
+		return x.encode('utf-8')
+	if isinstance(x, dict):
+		return {to_str(k):to_str(v) for k,v in x.items()}
+	if isinstance(x, list):
+		return [to_str(v) for v in x]
+	return x
+
+
+def copy_schema_dict(schema_dict):
+	"""
+		copies schema_dict down to item dicts; functions are shared
+	"""
+	return {datatype:{k:(list(v) if k == 'contains' else dict(v)) for k,v in obj_dict.items()} for datatype, obj_dict in schema_dict.items()}
+
 
 class ModalSchema(object):
 	"""
@@ -60,10 +97,28 @@ class ModalSchema(object):
 								}
 					})
 
+		# declarative equivalent; can be saved as JSON
+		ModalSchema({
+						'ModalDB.Frame.Frame': {
+									'image':{'mode':'disk', 'filename':'image.png', 'format':'png'},
+									'subs':{'mode':'memory'}
+								},
+						'ModalDB.Video.Video': {
+									'summary':{'mode':'memory'},
+									'thumbnail':{'mode':'disk', 'filename':'thumbnail.png', 'format':'png'},
+									'contains':['ModalDB.Frame.Frame']
+								}
+					})
+
+		# derived item: computed from 'image' on first access, then saved
+		'small':{'kind':'derived', 'func':'myproject.images.downsample', 'inputs':['image'], 
+					'mode':'disk', 'filename':'small.npy', 'format':'npy'}
+
 	"""
 
 	#==========[ Hard Constraints 	]==========
 	data_modes = ['memory', 'disk']
+	item_kinds = ['stored', 'derived']
 
 
 	def __init__(self, schema_path_or_dict=None):
@@ -79,6 +134,8 @@ class ModalSchema(object):
 		else:
 			raise Exception("Schema must be initialized with a dict or a path")
 
+		self.compile()
+
 
 
 
@@ -87,10 +144,102 @@ class ModalSchema(object):
 	################################################################################
 
 	def load(self, path):
-		self.schema_dict = self.parse_schema(pickle.load(open(path)))
+		"""
+			loads from JSON/YAML (by extension) or a dill pickle.
+			Declarative schemas are parsed once per version of the file.
+		"""
+		if not os.path.splitext(path)[1] in declarative_extensions:
+			import dill as pickle
+			self.schema_dict = self.parse_schema(pickle.load(open(path)))
+		else:
+			stat = os.stat(path)
+			key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+			if not key in parsed_cache:
+				parsed_cache[key] = self.parse_schema(self.read_declarative(path))
+			self.schema_dict = copy_schema_dict(parsed_cache[key])
+		self.compile()
 
 	def save(self, path):
-		pickle.dump(self.schema_dict, open(path, 'w'))
+		"""
+			saves as JSON/YAML (by extension) or a dill pickle; raises
+			TypeError when saving a non-declarative schema as JSON/YAML
+		"""
+		if not os.path.splitext(path)[1] in declarative_extensions:
+			import dill as pickle
+			pickle.dump(self.schema_dict, open(path, 'w'))
+			return
+
+		declarative = self.to_declarative()
+		if declarative is None:
+			raise TypeError("Schema has unnamed datatypes or load/save functions (i.e. lambdas); save it as a pickle")
+		with open(path, 'w') as f:
+			if path.endswith('.json'):
+				json.dump(declarative, f, indent=4, sort_keys=True)
+			else:
+				import yaml
+				yaml.safe_dump(declarative, f, default_flow_style=False)
+
+
+	def read_declarative(self, path):
+		with open(path) as f:
+			if path.endswith('.json'):
+				return to_str(json.load(f))
+			import yaml
+			return to_str(yaml.safe_load(f))
+
+
+
+
+	################################################################################
+	####################[ DECLARATIVE FORM	]#######################################
+	################################################################################
+
+	def is_declarative(self):
+		return not self.to_declarative() is None
+
+
+	def to_declarative(self):
+		"""
+			returns schema_dict with datatypes and load/save functions 
+			replaced by dotted names and registered formats, or None if 
+			some can't be named
+		"""
+		declarative = {}
+		for datatype, obj_dict in self.schema_dict.items():
+			obj_declarative = {'contains':[dotted_name(d) for d in obj_dict['contains']]}
+			for item_name, item_dict in [(k,v) for k,v in obj_dict.items() if not k == 'contains']:
+				obj_declarative[item_name] = self.item_to_declarative(item_dict)
+			if dotted_name(datatype) is None or None in obj_declarative['contains'] or None in obj_declarative.values():
+				return None
+			declarative[dotted_name(datatype)] = obj_declarative
+
+		try:
+			json.dumps(declarative)
+		except (TypeError, ValueError):
+			return None
+		return declarative
+
+
+	def item_to_declarative(self, item_dict):
+		"""
+			returns item_dict in declarative form, or None
+		"""
+		item_declarative = dict(item_dict)
+		if item_dict.get('kind') == 'derived':
+			item_declarative['func'] = dotted_name(item_dict['func'])
+			if item_declarative['func'] is None:
+				return None
+		if item_dict['mode'] == 'disk':
+			if 'format' in item_dict and get_format(item_dict['format']) == (item_dict['load_func'], item_dict['save_func']):
+				del item_declarative['load_func'], item_declarative['save_func']
+			else:
+				item_declarative.pop('format', None)
+				for key in ['load_func', 'save_func']:
+					if not item_dict[key] is None:
+						item_declarative[key] = dotted_name(item_dict[key])
+						if item_declarative[key] is None:
+							return None
+		return item_declarative
 
 
 
@@ -111,7 +260,28 @@ class ModalSchema(object):
 		for x in filter(lambda x: issubclass(DataObject, x), self.keys()):
 			yield x
 
-		
+
+
+
+	################################################################################
+	####################[ COMPILED TABLES	]#######################################
+	################################################################################
+
+	def compile(self):
+		"""
+			compiles schema_dict into per-datatype DatatypeTables; 
+			called whenever the schema changes
+		"""
+		self.tables, self.root_types = compile_schema(self.schema_dict)
+		self.datatype_set = frozenset(self.tables.keys())
+
+
+	def table(self, datatype):
+		"""
+			returns the compiled DatatypeTable for datatype
+		"""
+		return self.tables[datatype]
+
 
 
 	################################################################################
@@ -121,11 +291,13 @@ class ModalSchema(object):
 	def parse_schema(self, schema_dict):
 		"""
 			enforces constraints on schema_dict:
-			- Top-level keys must be DataObject subclasses
+			- Top-level keys must be DataObject subclasses (or their
+				dotted names)
 			- 'contains' must be a list of DataObject subclasses
 			returns it properly formatted
 		"""
 		#=====[ Step 1: Check types of top-level keys	]=====
+		schema_dict = {(resolve_name(k) if type(k) in [str, unicode] else k):v for k,v in schema_dict.items()}
 		if not all([issubclass(key, DataObject) for key in schema_dict.keys()]):
 			raise TypeError
 
@@ -147,6 +319,7 @@ class ModalSchema(object):
 		if 'contains' in obj_dict.keys():
 			if not type(obj_dict['contains']) == list:
 				raise TypeError
+			obj_dict['contains'] = [resolve_name(x) if type(x) in [str, unicode] else x for x in obj_dict['contains']]
 			if not all(issubclass(x, DataObject) for x in obj_dict['contains']):
 				raise TypeError("'contains' must consist of DataObject subclasses")
 		else:
@@ -162,9 +335,31 @@ class ModalSchema(object):
 		for item_name, item_dict in [(k,v) for k,v in obj_dict.items() if not k == 'contains']:
 			obj_dict[item_name] = self.parse_item(item_name, item_dict)
 
+		#=====[ Step 4: check derived items	]=====
+		self.check_derived_items(obj_dict)
+
 		return obj_dict
 
 
+	def check_derived_items(self, obj_dict):
+		"""
+			enforces that derived items' inputs are items of the same
+			datatype, and that none depends on itself
+		"""
+		derived = {k:v['inputs'] for k,v in obj_dict.items() if not k == 'contains' and v.get('kind') == 'derived'}
+		for item_name, inputs in derived.items():
+			if not all([i in obj_dict and not i == 'contains' for i in inputs]):
+				raise TypeError("Derived item %s has inputs that aren't items: %s" % (item_name, inputs))
+			seen, frontier = set(), list(inputs)
+			while len(frontier) > 0:
+				name = frontier.pop()
+				if name == item_name:
+					raise TypeError("Derived item %s depends on itself" % item_name)
+				if not name in seen:
+					seen.add(name)
+					frontier.extend(derived.get(name, []))
+
+
 	def parse_item(self, item_name, item_dict):
 		"""
 			enforces constraints on item_dicts
@@ -180,6 +375,15 @@ class ModalSchema(object):
 		#=====[ Step 2: Deal with disk items	]=====
 		if item_dict['mode'] == 'disk':
 
+			#=====[ format/dotted names -> functions	]=====
+			if 'format' in item_dict:
+				load_func, save_func = get_format(item_dict['format'])
+				item_dict.setdefault('load_func', load_func)
+				item_dict.setdefault('save_func', save_func)
+			for key in ['load_func', 'save_func']:
+				if type(item_dict.get(key)) in [str, unicode]:
+					item_dict[key] = resolve_name(item_dict[key])
+
 			#=====[ load_func	]=====
 			if not 'load_func' in item_dict:
 				raise TypeError
@@ -208,6 +412,18 @@ class ModalSchema(object):
 		if item_dict['mode'] == 'memory':
 			pass
 
+
+		#=====[ Step 4: deal with derived items	]=====
+		if not item_dict.get('kind', 'stored') in self.item_kinds:
+			raise TypeError
+		if item_dict.get('kind') == 'derived':
+			if type(item_dict.get('func')) in [str, unicode]:
+				item_dict['func'] = resolve_name(item_dict['func'])
+			if not callable(item_dict.get('func')):
+				raise TypeError("Derived item %s needs a func" % item_name)
+			if not type(item_dict.get('inputs')) == list or len(item_dict['inputs']) == 0 or not all([type(i) == str for i in item_dict['inputs']]):
+				raise TypeError("Derived item %s needs a list of input item names" % item_name)
+
 		return item_dict
 
 
@@ -224,6 +440,7 @@ class ModalSchema(object):
 		"""
 		object_dict = self.parse_data_object(object_dict)
 		self.schema_dict[object_type] = object_dict
+		self.compile()
 
 
 	def delete_data_object(self, datatype, object_dict):
@@ -232,6 +449,7 @@ class ModalSchema(object):
 		"""
 		object_dict = self.parse_data_object(object_dict)
 		self.schema_dict[object_type] = object_dict
+		self.compile()
 
 
 	def add_item(self, datatype, item_name, item_dict):
@@ -239,14 +457,19 @@ class ModalSchema(object):
 			adds an item to specified data_object 
 		"""
 		item_dict = self.parse_item(item_name, item_dict)
+		self.check_derived_items(dict(self.schema_dict[datatype], **{item_name:item_dict}))
 		self.schema_dict[datatype][item_name] = item_dict
+		self.compile()
 
 
 	def delete_item(self, datatype, item_name):
 		"""
-			deletes item from specified data object
+			deletes item from specified data object; raises TypeError if
+			derived items are computed from it
 		"""
+		self.check_derived_items({k:v for k,v in self.schema_dict[datatype].items() if not k == item_name})
 		del self.schema_dict[datatype][item_name]
+		self.compile()
 
 
 
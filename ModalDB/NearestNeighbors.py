@@ -0,0 +1,408 @@
+'''
+Module: NearestNeighbors
+========================
+
+Description:
+------------
+
+	k-nearest-neighbor search over a feature item of a datatype,
+	i.e. which frames (or object proposals) look most like this one.
+
+	Key properties:
+		- one entry per object for vector items, or one per row for
+			matrix items (i.e. per-mask features), keyed (_id, row)
+		- 'exact': brute force, batched into BLAS matrix products
+		- 'ivf': approximate; vectors bucketed by nearest k-means
+			centroid, queries scan only the n_probe closest buckets
+		- 'cosine' or 'l2' metric
+		- kept up to date incrementally as objects are inserted,
+			updated and deleted through the client
+
+
+Example Usage:
+--------------
+
+	index = client.feature_index(Frame, 'cnn_features', mode='ivf')
+	index.neighbors(frame, k=10) 				# [(('video_1/frame_3', 7), 0.93), ...]
+	index.neighbors(frame, k=10, mask_id=2, as_objects=True) 	# [((<Frame>, 7), 0.93), ...]
+	index.search(query_vectors, k=5) 			# one list of (key, score) per query
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+
+class FeatureIndex(object):
+	"""
+		Class: FeatureIndex
+		===================
+
+		k-NN index over item of datatype; see module docstring.
+		Scores are cosine similarities (descending) or euclidean
+		distances (ascending).
+	"""
+
+	def __init__(self, client, datatype, item, metric='cosine', mode='exact', n_lists=64, n_probe=8,
+					block_size=65536, workers=8, seed=0):
+		"""
+			Args:
+			-----
+			- client: ModalClient to index through
+			- datatype/item: feature item to index
+			- metric: 'cosine' or 'l2'
+			- mode: 'exact' or 'ivf'
+			- n_lists/n_probe: (ivf) number of buckets, and number
+				scanned per query
+			- block_size: rows scored per matrix product in exact search
+			- workers: threads loading features while building
+		"""
+		if not metric in ['cosine', 'l2']:
+			raise ValueError("metric must be 'cosine' or 'l2'")
+		if not mode in ['exact', 'ivf']:
+			raise ValueError("mode must be 'exact' or 'ivf'")
+		self.client = client
+		self.datatype = datatype
+		self.item = item
+		self.metric = metric
+		self.mode = mode
+		self.n_lists = n_lists
+		self.n_probe = n_probe
+		self.block_size = block_size
+		self.workers = workers
+		self.rng = np.random.RandomState(seed)
+		self.lock = threading.RLock()
+
+		table = client.get_schema(datatype)
+		self.is_disk_item = table.modes[item] == 'disk'
+		self.load_func = table.load_funcs.get(item)
+		self.build()
+
+
+	def reset(self):
+		self.n = 0
+		self.vectors = None 		# (capacity, d) float32; first n rows used
+		self.keys = [] 				# position -> _id or (_id, row)
+		self.key_pos = {} 			# key -> position
+		self.doc_keys = {} 			# _id -> keys
+		self.mtimes = {} 			# _id -> mtime of disk item when loaded
+		self.centroids = None 		# (ivf) (n_lists, d)
+		self.assignments = None 	# (ivf) position -> bucket
+		self.lists = None 			# (ivf) bucket -> positions in it
+		self.list_pos = None 		# (ivf) position -> index in its bucket's list
+
+
+
+
+	################################################################################
+	####################[ BUILDING	]###############################################
+	################################################################################
+
+	def load(self, _id, items):
+		"""
+			returns (_id, feature, mtime) given the object's 'items';
+			mtime is that of the feature's file, for disk items
+		"""
+		value = items.get(self.item)
+		if value is None or not self.is_disk_item:
+			return _id, value, None
+		return _id, self.load_func(value), os.path.getmtime(value)
+
+
+	def build(self):
+		"""
+			(re)builds the index from mongodb; trains ivf buckets
+		"""
+		with self.lock:
+			self.reset()
+			key = 'items.' + self.item
+			cursor = self.client.get_collection(self.datatype).find({key:{'$exists':True}}, {key:1})
+			pool = ThreadPool(self.workers)
+			try:
+				for _id, feature, mtime in pool.imap(lambda d: self.load(d['_id'], d['items']), cursor, chunksize=16):
+					self.add(_id, feature, mtime)
+			finally:
+				pool.close()
+			if self.mode == 'ivf':
+				self.train()
+
+
+	def prepare(self, vectors):
+		vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+		if self.metric == 'cosine':
+			norms = np.sqrt((vectors ** 2).sum(axis=1))
+			vectors = vectors / np.maximum(norms, 1e-12)[:, np.newaxis]
+		return vectors
+
+
+	def add(self, _id, feature, mtime=None):
+		"""
+			adds _id's feature: a vector, or a matrix with one row per
+			entry (i.e. per mask). Replaces any existing entries.
+		"""
+		if feature is None:
+			return
+		with self.lock:
+			self.remove(_id)
+			feature = np.asarray(feature)
+			keys = [_id] if feature.ndim == 1 else [(_id, row) for row in range(len(feature))]
+			vectors = self.prepare(feature.reshape(len(keys), -1))
+
+			#=====[ grow storage	]=====
+			if self.vectors is None:
+				self.vectors = np.empty((max(1024, len(keys)), vectors.shape[1]), dtype=np.float32)
+				if self.mode == 'ivf':
+					self.assignments = np.empty(len(self.vectors), dtype=np.int64)
+					self.list_pos = np.empty(len(self.vectors), dtype=np.int64)
+			while self.n + len(keys) > len(self.vectors):
+				self.vectors = np.resize(self.vectors, (2 * len(self.vectors), self.vectors.shape[1]))
+				if not self.assignments is None:
+					self.assignments = np.resize(self.assignments, len(self.vectors))
+					self.list_pos = np.resize(self.list_pos, len(self.vectors))
+
+			self.vectors[self.n:self.n+len(keys)] = vectors
+			if not self.centroids is None:
+				for pos, bucket in enumerate(self.nearest_centroids(vectors), self.n):
+					self.assign(pos, bucket)
+			for key in keys:
+				self.key_pos[key] = self.n
+				self.keys.append(key)
+				self.n += 1
+			self.doc_keys[_id] = keys
+			if not mtime is None:
+				self.mtimes[_id] = mtime
+
+
+	def remove(self, _id):
+		"""
+			removes _id's entries, moving the last entries into their
+			positions
+		"""
+		with self.lock:
+			for key in self.doc_keys.pop(_id, []):
+				pos, last = self.key_pos.pop(key), self.n - 1
+				if not self.centroids is None:
+					self.unassign(pos)
+				if pos < last:
+					last_key = self.keys[last]
+					self.vectors[pos] = self.vectors[last]
+					if not self.centroids is None:
+						self.move(last, pos)
+					self.keys[pos] = last_key
+					self.key_pos[last_key] = pos
+				self.keys.pop()
+				self.n -= 1
+			self.mtimes.pop(_id, None)
+
+
+	def __len__(self):
+		return self.n
+
+
+
+
+	################################################################################
+	####################[ IVF	]###################################################
+	################################################################################
+
+	def train(self, iterations=10, sample_size=100000):
+		"""
+			(ivf) fits n_lists centroids by k-means on a sample of the
+			indexed vectors and buckets all vectors; until trained (or
+			with fewer than n_lists vectors), search is exact
+		"""
+		with self.lock:
+			if self.n < self.n_lists:
+				self.centroids = None
+				return
+			sample = self.vectors[self.rng.choice(self.n, min(self.n, sample_size), replace=False)]
+			centroids = sample[self.rng.choice(len(sample), self.n_lists, replace=False)].copy()
+			for _ in range(iterations):
+				assignments = self.nearest_centroids(sample, centroids)
+				for c in range(self.n_lists):
+					members = sample[assignments == c]
+					if len(members) > 0:
+						centroids[c] = members.mean(axis=0)
+				if self.metric == 'cosine':
+					centroids = self.prepare(centroids)
+			self.centroids = centroids
+			self.assignments = np.empty(len(self.vectors), dtype=np.int64)
+			self.list_pos = np.empty(len(self.vectors), dtype=np.int64)
+			self.lists = [[] for _ in range(self.n_lists)]
+			for start in xrange(0, self.n, self.block_size):
+				stop = min(self.n, start + self.block_size)
+				for pos, bucket in enumerate(self.nearest_centroids(self.vectors[start:stop]), start):
+					self.assign(pos, bucket)
+
+
+	def assign(self, pos, bucket):
+		self.assignments[pos] = bucket
+		self.list_pos[pos] = len(self.lists[bucket])
+		self.lists[bucket].append(pos)
+
+
+	def unassign(self, pos):
+		"""
+			O(1) removal of pos from its bucket's list
+		"""
+		bucket_list = self.lists[self.assignments[pos]]
+		ix, last = self.list_pos[pos], bucket_list.pop()
+		if not last == pos:
+			bucket_list[ix] = last
+			self.list_pos[last] = ix
+
+
+	def move(self, old, new):
+		"""
+			renames position old to new in its bucket's list
+		"""
+		self.assignments[new] = self.assignments[old]
+		self.list_pos[new] = self.list_pos[old]
+		self.lists[self.assignments[new]][self.list_pos[new]] = new
+
+
+	def nearest_centroids(self, vectors, centroids=None):
+		centroids = self.centroids if centroids is None else centroids
+		return np.argmax(self.similarities(vectors, centroids), axis=1)
+
+
+	def similarities(self, queries, vectors):
+		"""
+			(len(queries), len(vectors)) matrix; higher is closer. For
+			l2, this is -(squared distance) up to a per-query constant.
+		"""
+		products = np.dot(queries, vectors.T)
+		if self.metric == 'cosine':
+			return products
+		return 2 * products - (vectors ** 2).sum(axis=1)[np.newaxis, :]
+
+
+
+
+	################################################################################
+	####################[ SEARCH	]###############################################
+	################################################################################
+
+	def top_k(self, similarities, positions, k):
+		"""
+			returns (positions, similarities) of the k best, best first
+		"""
+		if len(positions) > k:
+			best = np.argpartition(-similarities, k - 1)[:k]
+			similarities, positions = similarities[best], positions[best]
+		order = np.argsort(-similarities, kind='mergesort')
+		return positions[order], similarities[order]
+
+
+	def search_positions(self, queries, k):
+		"""
+			returns one (positions, similarities) pair per query
+		"""
+		with self.lock:
+			if self.centroids is None:
+				results = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+				for start in xrange(0, self.n, self.block_size):
+					stop = min(self.n, start + self.block_size)
+					block = self.similarities(queries, self.vectors[start:stop])
+					positions = np.arange(start, stop)
+					for i in range(len(queries)):
+						merged = (np.concatenate([results[i][0], positions]), np.concatenate([results[i][1], block[i]]))
+						results[i] = self.top_k(merged[1], merged[0], k)
+				return results
+
+			probes = np.argsort(-self.similarities(queries, self.centroids), axis=1)[:, :self.n_probe]
+			results = []
+			for i in range(len(queries)):
+				candidates = np.array([pos for c in probes[i] for pos in self.lists[c]], dtype=np.int64)
+				similarities = self.similarities(queries[i:i+1], self.vectors[candidates])[0]
+				results.append(self.top_k(similarities, candidates, k))
+			return results
+
+
+	def to_score(self, query, similarity):
+		if self.metric == 'cosine':
+			return float(similarity)
+		return float(np.sqrt(max((query ** 2).sum() - similarity, 0.0)))
+
+
+	def search(self, queries, k=10):
+		"""
+			returns, for each query vector, a list of up to k (key,
+			score), closest first; key is _id, or (_id, row)
+		"""
+		queries = self.prepare(queries)
+		with self.lock:
+			return [[(self.keys[p], self.to_score(q, s)) for p, s in zip(positions, similarities)]
+						for q, (positions, similarities) in zip(queries, self.search_positions(queries, k))]
+
+
+	def neighbors(self, query, k=10, mask_id=None, as_objects=False):
+		"""
+			returns k (key, score) closest to query, excluding query
+			itself.
+
+			Args:
+			-----
+			- query: DataObject, _id or (_id, row) key
+			- mask_id: (matrix items) row of query's feature to use
+			- as_objects: return DataObjects in place of _ids, i.e.
+				(DataObject, score) or ((DataObject, row), score)
+		"""
+		#=====[ Step 1: get query vector	]=====
+		_id = query if type(query) in [str, unicode, tuple] else query._id
+		key = (_id, mask_id) if not mask_id is None and not type(_id) == tuple else _id
+		with self.lock:
+			if key in self.key_pos:
+				vector = self.vectors[self.key_pos[key]].copy()
+			elif type(query) in [str, unicode, tuple]:
+				if mask_id is None and (_id, 0) in self.key_pos:
+					raise ValueError("Query has one feature per row; specify mask_id")
+				raise KeyError("Not in the index: %s" % str(key))
+			else:
+				feature = np.asarray(query[self.item])
+				vector = feature if mask_id is None else feature[mask_id]
+		if vector.ndim > 1:
+			raise ValueError("Query has one feature per row; specify mask_id")
+
+		#=====[ Step 2: search, dropping the query	]=====
+		results = [(k_, s) for k_, s in self.search(vector, k + 1)[0] if not k_ == key][:k]
+		if not as_objects:
+			return results
+
+		#=====[ Step 3: load objects in one query	]=====
+		ids = list(set([k_[0] if type(k_) == tuple else k_ for k_, _ in results]))
+		dataobjects = dict(zip(ids, self.client.get_many(self.datatype, ids)))
+		return [(((dataobjects[k_[0]], k_[1]) if type(k_) == tuple else dataobjects[k_]), s) for k_, s in results]
+
+
+
+
+	################################################################################
+	####################[ CLIENT EVENTS	]###########################################
+	################################################################################
+
+	def on_insert(self, datatype, mongo_doc, parent):
+		if datatype == self.datatype and self.item in mongo_doc['items']:
+			self.add(*self.load(mongo_doc['_id'], mongo_doc['items']))
+
+
+	def on_delete(self, datatype, _id):
+		if datatype == self.datatype:
+			self.remove(_id)
+
+
+	def on_update(self, datatype, _id, new_item_dict):
+		if not datatype == self.datatype:
+			return
+		value = new_item_dict.get(self.item)
+		if value is None or (self.is_disk_item and not os.path.exists(value)):
+			self.remove(_id)
+		elif not self.is_disk_item or not self.mtimes.get(_id) == os.path.getmtime(value):
+			self.add(*self.load(_id, new_item_dict))
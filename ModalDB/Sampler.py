@@ -0,0 +1,372 @@
+'''
+Module: Sampler
+===============
+
+Description:
+------------
+
+	Random sampling of objects across a level of the hierarchy,
+	i.e. frames across all videos, with precomputed tables that
+	make each draw O(1).
+
+	Key properties:
+		- 'uniform': every child equally likely, regardless of parent
+		- 'stratified': parent first, then a child within it
+		- weighted by a memory item of the child (i.e. 'score') via
+			an alias table
+		- kept up to date incrementally as objects are inserted,
+			updated and deleted through the client
+
+
+Example Usage:
+--------------
+
+	sampler = client.sampler(Video, Frame)
+	frame = sampler.draw()
+	frames = sampler.draw_many(32, replace=False)
+
+	sampler = client.sampler(Video, Frame, mode='stratified')
+	sampler = client.sampler(Video, Frame, weight='score')
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import numpy as np
+
+
+class AliasTable(object):
+	"""
+		Class: AliasTable
+		=================
+
+		Walker's alias method: O(n) construction, O(1) draws from a
+		discrete distribution proportional to weights.
+	"""
+
+	def __init__(self, weights):
+		weights = np.asarray(weights, dtype=np.float64)
+		if len(weights) == 0 or np.any(weights < 0) or not weights.sum() > 0:
+			raise ValueError("weights must be nonnegative with a positive sum")
+
+		n = len(weights)
+		scaled = weights * (n / weights.sum())
+		self.prob = np.ones(n, dtype=np.float64)
+		self.alias = np.arange(n, dtype=np.int64)
+
+		small = list(np.flatnonzero(scaled < 1.0))
+		large = list(np.flatnonzero(scaled >= 1.0))
+		while len(small) > 0 and len(large) > 0:
+			s, l = small.pop(), large.pop()
+			self.prob[s] = scaled[s]
+			self.alias[s] = l
+			scaled[l] = (scaled[l] + scaled[s]) - 1.0
+			if scaled[l] < 1.0:
+				small.append(l)
+			else:
+				large.append(l)
+
+
+	def __len__(self):
+		return len(self.prob)
+
+
+	def draw(self, rng, size):
+		"""
+			returns size indices drawn with replacement
+		"""
+		columns = rng.randint(0, len(self.prob), size=size)
+		keep = rng.random_sample(size) < self.prob[columns]
+		return np.where(keep, columns, self.alias[columns])
+
+
+
+class PartialShuffle(object):
+	"""
+		Class: PartialShuffle
+		=====================
+
+		Fisher-Yates shuffle of range(n), performed lazily: next()
+		returns the next element of a uniform random permutation in
+		O(1), storing only the swapped positions.
+	"""
+
+	def __init__(self, n):
+		self.n = n
+		self.i = 0
+		self.swapped = {}
+
+
+	def remaining(self):
+		return self.n - self.i
+
+
+	def next(self, rng):
+		if self.i == self.n:
+			raise StopIteration
+		j = rng.randint(self.i, self.n)
+		value = self.swapped.get(j, j)
+		self.swapped[j] = self.swapped.get(self.i, self.i)
+		self.swapped.pop(self.i, None)
+		self.i += 1
+		return value
+
+
+
+class HierarchySampler(object):
+	"""
+		Class: HierarchySampler
+		=======================
+
+		Samples objects of childtype across all parents of parenttype.
+
+		Children are tracked in a flat list (for 'uniform' and weighted
+		draws) and in per-parent lists (for 'stratified' draws); both
+		support O(1) insertion and swap-removal. Weighted draws use an
+		AliasTable that is rebuilt lazily on the first draw after a
+		change.
+	"""
+	modes = ['uniform', 'stratified']
+
+	def __init__(self, client, parenttype, childtype, mode='uniform', weight=None, seed=None):
+		"""
+			Args:
+			-----
+			- client: ModalClient to build from and draw through
+			- parenttype/childtype: i.e. Video, Frame
+			- mode: 'uniform' or 'stratified'
+			- weight: (optional, 'uniform' only) name of a memory item
+				of childtype holding each child's nonnegative weight
+			- seed: seed for this sampler's random state
+		"""
+		if not childtype in client.get_childtypes(parenttype):
+			raise TypeError("%s doesn't contain %s" % (parenttype.__name__, childtype.__name__))
+		if not mode in self.modes:
+			raise ValueError("mode must be one of %s" % str(self.modes))
+		if not weight is None and not mode == 'uniform':
+			raise ValueError("weights are only supported in 'uniform' mode")
+
+		self.client = client
+		self.parenttype = parenttype
+		self.childtype = childtype
+		self.mode = mode
+		self.weight = weight
+		self.rng = np.random.RandomState(seed)
+		self.build()
+
+
+
+
+	################################################################################
+	####################[ BUILDING	]###############################################
+	################################################################################
+
+	def build(self):
+		"""
+			builds all tables from the database
+		"""
+		self.flat 		= []	# child ids
+		self.flat_pos 	= {}	# child id -> position in flat
+		self.weights 	= []	# aligned with flat
+		self.parents 	= []	# ids of parents with at least one child
+		self.parent_pos = {}	# parent id -> position in parents
+		self.children 	= {}	# parent id -> list of child ids
+		self.child_pos 	= {}	# child id -> position in its parent's list
+		self.child_parent = {}	# child id -> parent id
+		self.alias_table = None
+
+		weights = {}
+		if not self.weight is None:
+			cursor = self.client.get_collection(self.childtype).find({}, {'items.%s' % self.weight:1})
+			weights = {d['_id']:self.get_weight(d['items']) for d in cursor}
+
+		name = self.childtype.__name__
+		cursor = self.client.get_collection(self.parenttype).find({}, {'children.%s' % name:1})
+		for doc in cursor:
+			for child_id in doc['children'].get(name, {}).values():
+				self.add_child(doc['_id'], child_id, weights.get(child_id, 0.0))
+
+
+	def get_weight(self, items):
+		value = items.get(self.weight)
+		return 0.0 if value is None else float(value)
+
+
+	def add_child(self, parent_id, child_id, weight=0.0):
+		if child_id in self.flat_pos:
+			return
+		self.flat_pos[child_id] = len(self.flat)
+		self.flat.append(child_id)
+		self.weights.append(weight)
+
+		if not parent_id in self.children:
+			self.parent_pos[parent_id] = len(self.parents)
+			self.parents.append(parent_id)
+			self.children[parent_id] = []
+		self.child_pos[child_id] = len(self.children[parent_id])
+		self.children[parent_id].append(child_id)
+		self.child_parent[child_id] = parent_id
+		self.alias_table = None
+
+
+	def swap_remove(self, items, positions, item):
+		"""
+			O(1) removal of item from list items, where positions maps
+			each element to its index in items
+		"""
+		ix = positions.pop(item)
+		last = items.pop()
+		if not last == item:
+			items[ix] = last
+			positions[last] = ix
+		return ix
+
+
+	def remove_child(self, child_id):
+		if not child_id in self.flat_pos:
+			return
+		ix = self.swap_remove(self.flat, self.flat_pos, child_id)
+		last_weight = self.weights.pop()
+		if ix < len(self.weights):
+			self.weights[ix] = last_weight
+
+		parent_id = self.child_parent.pop(child_id)
+		self.swap_remove(self.children[parent_id], self.child_pos, child_id)
+		if len(self.children[parent_id]) == 0:
+			del self.children[parent_id]
+			self.swap_remove(self.parents, self.parent_pos, parent_id)
+		self.alias_table = None
+
+
+	def set_weight(self, child_id, weight):
+		if child_id in self.flat_pos:
+			self.weights[self.flat_pos[child_id]] = weight
+			self.alias_table = None
+
+
+
+
+	################################################################################
+	####################[ CLIENT EVENTS	]###########################################
+	################################################################################
+
+	def on_insert(self, datatype, mongo_doc, parent):
+		if datatype == self.childtype and type(parent) == self.parenttype:
+			weight = 0.0 if self.weight is None else self.get_weight(mongo_doc['items'])
+			self.add_child(parent._id, mongo_doc['_id'], weight)
+
+
+	def on_delete(self, datatype, _id):
+		if datatype == self.childtype:
+			self.remove_child(_id)
+		elif datatype == self.parenttype:
+			for child_id in list(self.children.get(_id, [])):
+				self.remove_child(child_id)
+
+
+	def on_update(self, datatype, _id, new_item_dict):
+		if datatype == self.childtype and not self.weight is None:
+			self.set_weight(_id, self.get_weight(new_item_dict))
+
+
+
+
+	################################################################################
+	####################[ DRAWING	]###############################################
+	################################################################################
+
+	def __len__(self):
+		return len(self.flat)
+
+
+	def draw_positions(self, size):
+		"""
+			returns size positions in self.flat, drawn with replacement
+		"""
+		if len(self.flat) == 0:
+			raise KeyError("No %s objects to sample from" % self.childtype.__name__)
+
+		#=====[ Case: weighted	]=====
+		if not self.weight is None:
+			if self.alias_table is None:
+				self.alias_table = AliasTable(self.weights)
+			return self.alias_table.draw(self.rng, size)
+
+		#=====[ Case: stratified	]=====
+		if self.mode == 'stratified':
+			parent_ixs = self.rng.randint(0, len(self.parents), size=size)
+			positions = []
+			for p in parent_ixs:
+				children = self.children[self.parents[p]]
+				positions.append(self.flat_pos[children[self.rng.randint(len(children))]])
+			return np.array(positions, dtype=np.int64)
+
+		#=====[ Case: uniform	]=====
+		return self.rng.randint(0, len(self.flat), size=size)
+
+
+	def sample_ids(self, n, replace=True):
+		"""
+			returns ids of n children. Without replacement, each draw
+			is made as if the children already drawn were removed:
+			'uniform' is a partial Fisher-Yates shuffle, 'stratified'
+			picks among parents with children left, and weighted draws
+			use Efraimidis-Spirakis keys, u ** (1 / weight).
+		"""
+		if replace:
+			return [self.flat[p] for p in self.draw_positions(n)]
+
+		if len(self.flat) == 0:
+			raise KeyError("No %s objects to sample from" % self.childtype.__name__)
+		if n > len(self.flat):
+			raise ValueError("Cannot draw %d of %d objects without replacement" % (n, len(self.flat)))
+		if not self.weight is None and n > np.count_nonzero(self.weights):
+			raise ValueError("Cannot draw %d objects without replacement; too few have nonzero weight" % n)
+
+		#=====[ Case: weighted; the n largest log(u) / weight	]=====
+		if not self.weight is None:
+			weights = np.asarray(self.weights, dtype=np.float64)
+			keys = np.full(len(weights), -np.inf)
+			nonzero = weights > 0
+			keys[nonzero] = np.log(self.rng.random_sample(np.count_nonzero(nonzero))) / weights[nonzero]
+			positions = np.argpartition(-keys, n - 1)[:n] if n > 0 else []
+			return [self.flat[p] for p in positions]
+
+		#=====[ Case: stratified	]=====
+		if self.mode == 'stratified':
+			live = range(len(self.parents))
+			shuffles = {}
+			ids = []
+			while len(ids) < n:
+				k = self.rng.randint(len(live))
+				parent_id = self.parents[live[k]]
+				if not parent_id in shuffles:
+					shuffles[parent_id] = PartialShuffle(len(self.children[parent_id]))
+				shuffle = shuffles[parent_id]
+				ids.append(self.children[parent_id][shuffle.next(self.rng)])
+				if shuffle.remaining() == 0:
+					live[k] = live[-1]
+					live.pop()
+			return ids
+
+		#=====[ Case: uniform	]=====
+		shuffle = PartialShuffle(len(self.flat))
+		return [self.flat[shuffle.next(self.rng)] for _ in xrange(n)]
+
+
+	def draw(self):
+		"""
+			returns one randomly drawn child object
+		"""
+		return self.client.get(self.childtype, self.sample_ids(1)[0])
+
+
+	def draw_many(self, n, replace=True):
+		"""
+			returns list of n randomly drawn child objects, fetched
+			with a single query
+		"""
+		return self.client.get_many(self.childtype, self.sample_ids(n, replace))
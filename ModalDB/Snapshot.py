@@ -0,0 +1,290 @@
+'''
+Module: Snapshot
+================
+
+Description:
+------------
+
+	Read-only, single-file snapshots of a ModalDB's metadata, for
+	serving get/iter/children lookups without a mongod (i.e. on
+	compute nodes during training, when the data is static).
+
+	File layout:
+		- magic string
+		- for each datatype:
+			- blob: concatenated BSON-encoded mongo_docs
+			- ids: sorted fixed-width byte strings (numpy, mmappable)
+			- spans: (n, 2) int64 array of (start, length) in blob,
+				aligned with ids (numpy, mmappable)
+		- JSON footer describing where each section lives
+		- 8-byte footer length
+
+	Opening a snapshot reads only the footer and mmaps the rest, so
+	startup is a few milliseconds regardless of size; ids are
+	resolved by binary search and docs decoded on demand.
+
+
+Example Usage:
+--------------
+
+	client.export_snapshot('/data/modaldb.snapshot')
+	...
+	client = ModalClient.open_snapshot('/data/modaldb.snapshot')
+	frame = client.get(Frame, 'video_1/frame_1')
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import json
+import mmap
+import struct
+import bson
+import numpy as np
+
+
+magic = 'MODALDB-SNAPSHOT-1\n'
+
+
+class ReadOnlyError(Exception):
+	pass
+
+
+def align(f, boundary=8):
+	"""
+		pads file f with zeros to a multiple of boundary
+	"""
+	padding = -f.tell() % boundary
+	f.write('\0' * padding)
+
+
+def encode_id(_id):
+	return _id.encode('utf-8') if isinstance(_id, unicode) else str(_id)
+
+
+def export_snapshot(client, path):
+	"""
+		writes all metadata reachable through client to a snapshot
+		file at path, streaming one datatype at a time
+	"""
+	footer = {'root':os.path.abspath(client.root), 'datatypes':{}}
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(magic)
+		for datatype in client.get_datatypes():
+
+			#=====[ Step 1: stream docs into blob	]=====
+			align(f)
+			blob_offset = f.tell()
+			ids, spans = [], []
+			for mongo_doc in client.get_collection(datatype).find():
+				encoded = bson.BSON.encode(mongo_doc)
+				ids.append(encode_id(mongo_doc['_id']))
+				spans.append((f.tell() - blob_offset, len(encoded)))
+				f.write(encoded)
+
+			#=====[ Step 2: sorted ids and their spans	]=====
+			ids = np.array(ids, dtype='S%d' % max([1] + [len(i) for i in ids]))
+			spans = np.array(spans, dtype=np.int64).reshape((-1, 2))
+			order = np.argsort(ids, kind='mergesort')
+			sections = {'blob_offset':blob_offset, 'count':len(ids), 'id_dtype':ids.dtype.str}
+			for name, array in [('ids', ids[order]), ('spans', spans[order])]:
+				align(f)
+				sections[name + '_offset'] = f.tell()
+				f.write(array.tostring())
+			footer['datatypes'][datatype.__name__] = sections
+
+		#=====[ Step 3: footer	]=====
+		encoded_footer = json.dumps(footer)
+		f.write(encoded_footer)
+		f.write(struct.pack('<Q', len(encoded_footer)))
+	os.rename(tmp_path, path)
+
+
+
+class Snapshot(object):
+	"""
+		Class: Snapshot
+		===============
+
+		Read-only stand-in for a pymongo database, backed by a
+		snapshot file; snapshot[name] returns a SnapshotCollection.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as f:
+			if not f.read(len(magic)) == magic:
+				raise ValueError("Not a ModalDB snapshot: %s" % path)
+			f.seek(-8, os.SEEK_END)
+			footer_length = struct.unpack('<Q', f.read(8))[0]
+			f.seek(-8 - footer_length, os.SEEK_END)
+			self.footer = json.loads(f.read(footer_length))
+			self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		self.root = self.footer['root']
+		self.collections = {name:SnapshotCollection(self, name, sections) for name, sections in self.footer['datatypes'].items()}
+
+
+	def __getitem__(self, name):
+		return self.collections[name]
+
+
+	def collection_names(self):
+		return self.collections.keys()
+
+
+	def __getattr__(self, name):
+		raise ReadOnlyError("Snapshots are read-only (%s)" % name)
+
+
+
+class SnapshotCollection(object):
+	"""
+		Class: SnapshotCollection
+		=========================
+
+		Read-only stand-in for a pymongo collection. Supports the
+		queries ModalClient issues: find/find_one by _id, find with
+		{'_id':{'$in':[...]}} or an _id range ({'$gte':..., '$lt':...};
+		binary search), '$or's of those, and unfiltered find.
+	"""
+
+	def __init__(self, snapshot, name, sections):
+		self.snapshot = snapshot
+		self.name = name
+		self.n = sections['count']
+		self.blob_offset = sections['blob_offset']
+		self.ids = np.ndarray((self.n,), dtype=np.dtype(str(sections['id_dtype'])), buffer=snapshot.buffer, offset=sections['ids_offset'])
+		self.spans = np.ndarray((self.n, 2), dtype=np.int64, buffer=snapshot.buffer, offset=sections['spans_offset'])
+
+
+	def __len__(self):
+		return self.n
+
+
+	def position(self, _id):
+		key = encode_id(_id)
+		ix = int(np.searchsorted(self.ids, key))
+		if ix < self.n and self.ids[ix] == key:
+			return ix
+		return None
+
+
+	def doc_at(self, ix):
+		start, length = self.spans[ix]
+		start += self.blob_offset
+		return bson.BSON(self.snapshot.buffer[start:start+length]).decode()
+
+
+	def matching_positions(self, query):
+		if not query:
+			return xrange(self.n)
+		if query.keys() == ['$or']:
+			return sorted(set().union(*[self.matching_positions(q) for q in query['$or']]))
+		if not query.keys() == ['_id']:
+			raise ReadOnlyError("Snapshots only support queries on _id: %s" % str(query))
+		if isinstance(query['_id'], dict):
+			if sorted(query['_id'].keys()) == ['$gte', '$lt']:
+				start = int(np.searchsorted(self.ids, encode_id(query['_id']['$gte']), side='left'))
+				stop = int(np.searchsorted(self.ids, encode_id(query['_id']['$lt']), side='left'))
+				return xrange(start, stop)
+			if not query['_id'].keys() == ['$in']:
+				raise ReadOnlyError("Snapshots only support $in and range queries on _id: %s" % str(query))
+			ids = query['_id']['$in']
+		else:
+			ids = [query['_id']]
+		return [ix for ix in [self.position(i) for i in ids] if not ix is None]
+
+
+	def find(self, query=None, projection=None):
+		"""
+			returns a SnapshotCursor; projection is ignored
+		"""
+		return SnapshotCursor(self, self.matching_positions(query))
+
+
+	def find_one(self, query=None, projection=None):
+		positions = self.matching_positions(query)
+		if len(positions) == 0:
+			return None
+		return self.doc_at(positions[0])
+
+
+	def count_documents(self, query):
+		return len(self.matching_positions(query))
+
+
+	def __getattr__(self, name):
+		raise ReadOnlyError("Snapshots are read-only (%s)" % name)
+
+
+
+class SnapshotCursor(object):
+	"""
+		Class: SnapshotCursor
+		=====================
+
+		Iterator over docs at the given positions; mirrors the parts
+		of pymongo's Cursor that ModalClient uses.
+	"""
+
+	def __init__(self, collection, positions):
+		self.collection = collection
+		self.positions = positions
+		self.docs = (collection.doc_at(ix) for ix in positions)
+
+
+	def count(self):
+		return len(self.positions)
+
+
+	def skip(self, n):
+		return self.slice(n, None)
+
+
+	def limit(self, n):
+		return self.slice(0, n if n > 0 else None)
+
+
+	def slice(self, start, stop):
+		"""
+			restricts to positions[start:stop]; ranges stay ranges, so
+			skip/limit on an unfiltered find are O(1)
+		"""
+		if isinstance(self.positions, xrange):
+			start, stop, _ = slice(start, stop).indices(len(self.positions))
+			step = self.positions[1] - self.positions[0] if len(self.positions) > 1 else 1
+			self.positions = xrange(self.positions[start], self.positions[start] + (stop - start) * step, step) if start < stop else xrange(0)
+		else:
+			self.positions = self.positions[start:stop]
+		self.docs = (self.collection.doc_at(ix) for ix in self.positions)
+		return self
+
+
+	def sort(self, key, direction=1):
+		"""
+			only sorting by _id is supported; positions follow the 
+			sorted ids, so this sorts positions
+		"""
+		if not key == '_id':
+			raise ReadOnlyError("Snapshots can only sort by _id")
+		if not isinstance(self.positions, xrange):
+			self.positions = sorted(self.positions, reverse=direction < 0)
+		elif len(self.positions) > 1 and (self.positions[1] > self.positions[0]) == (direction < 0):
+			step = self.positions[1] - self.positions[0]
+			self.positions = xrange(self.positions[-1], self.positions[0] - step, -step)
+		self.docs = (self.collection.doc_at(ix) for ix in self.positions)
+		return self
+
+
+	def __iter__(self):
+		return self.docs
+
+
+	def next(self):
+		return next(self.docs)
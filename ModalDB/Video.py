@@ -15,14 +15,122 @@ jhack@stanford.edu
 ##################
 '''
 import os
-from itertools import islice
+import re
 import random
+from multiprocessing.pool import ThreadPool
 import numpy as np
-import pandas as pd
 
 from DataObject import DataObject
 from Frame import Frame
 
+
+class FrameIndex(object):
+	"""
+		Class: FrameIndex
+		=================
+
+		Numerically sorted index over a video's frames, backed by numpy 
+		arrays of frame numbers and full child ids. A frame's number is 
+		the integer its raw id ends with, i.e. 'frame_12' -> 12.
+
+		When frame numbers are contiguous, lookups are pure arithmetic;
+		otherwise they go through a dict from number to position.
+	"""
+	number_regex = re.compile(r'(\d+)$')
+
+	def __init__(self, childtype_dict):
+		"""
+			childtype_dict: maps raw ids of frames to their full ids
+		"""
+		raw_ids = childtype_dict.keys()
+		numbers = np.array([self.to_number(r) for r in raw_ids], dtype=np.int64)
+		order = np.argsort(numbers, kind='mergesort')
+
+		self.numbers 	= numbers[order]
+		self.ids 		= np.array([childtype_dict[r] for r in raw_ids], dtype=object)[order]
+		self.dense 		= bool(np.all(np.diff(self.numbers) == 1))
+		self.first 		= int(self.numbers[0]) if len(self.numbers) > 0 else 0
+		self.positions 	= None if self.dense else {n:i for i, n in enumerate(self.numbers.tolist())}
+
+
+	def to_number(self, raw_id):
+		match = self.number_regex.search(raw_id)
+		if match is None:
+			raise ValueError("Frame id has no frame number: %s" % raw_id)
+		return int(match.group(1))
+
+
+	def __len__(self):
+		return len(self.numbers)
+
+
+	def position(self, t):
+		"""
+			returns position of frame number t in the index, 
+			or None if there is no such frame
+		"""
+		if self.dense:
+			ix = int(t) - self.first
+			return ix if 0 <= ix < len(self.numbers) else None
+		return self.positions.get(int(t))
+
+
+	def range_positions(self, start=None, stop=None):
+		"""
+			returns (begin, end) positions covering frame numbers
+			in [start, stop)
+		"""
+		begin = 0 if start is None else int(np.searchsorted(self.numbers, start, side='left'))
+		end = len(self.numbers) if stop is None else int(np.searchsorted(self.numbers, stop, side='left'))
+		return begin, max(begin, end)
+
+
+
+class FrameSequence(object):
+	"""
+		Class: FrameSequence
+		====================
+
+		Sequence-like view over a video's frames, keyed by frame number.
+
+		Example Usage:
+		--------------
+
+			frame = video.frames[12]		# frame number 12
+			clip = video.frames[10:20]		# frames numbered 10 through 19
+			sparse = video.frames[::5]		# every fifth frame
+	"""
+
+	def __init__(self, video):
+		self.video = video
+
+
+	def __len__(self):
+		return len(self.video)
+
+
+	def __iter__(self):
+		return self.video.iter_frames()
+
+
+	def __getitem__(self, key):
+		"""
+			integer keys are frame numbers; slices take start/stop as 
+			frame numbers and step as a stride over present frames
+		"""
+		if isinstance(key, slice):
+			index = self.video.frame_index
+			begin, end = index.range_positions(key.start, key.stop)
+			ids = index.ids[begin:end:key.step or 1]
+			return self.video.client.get_many(Frame, list(ids))
+
+		frame = self.video.get_frame(key)
+		if frame is None:
+			raise KeyError("No such frame: %s" % str(key))
+		return frame
+
+
+
 class Video(DataObject):
 	"""
 		Ideal Usage:
@@ -33,7 +141,17 @@ class Video(DataObject):
 		frame = video.get_frame(0)
 		for frame in video.iter_frames():
 			...
+
+		# Ranges of frames, by frame number
+		clip = video.frames[100:200:2]
+
+		# Stacked item arrays for ranges of frames
+		images = video.load_window('image', 100, 116) 	# (16, h, w, 3)
+		for window in video.iter_windows('cnn_features', 16, stride=8):
+			...
 	"""
+	iter_batch_size = 256
+	pad_modes = [None, 'edge', 'zero']
 
 	def __init__(self, mongo_doc, schema, client):
 		"""
@@ -42,6 +160,7 @@ class Video(DataObject):
 			frames: list of frames
 		"""
 		super(Video, self).__init__(mongo_doc, schema, client)
+		self._frame_index = None
 
 
 
@@ -50,60 +169,190 @@ class Video(DataObject):
 	####################[ Frame Data	]###########################################
 	################################################################################
 
-	def get_frames_df(self, mongo_doc):
+	@property
+	def frame_index(self):
 		"""
-			sets self.frames_df to be a more complete index of 
-			which frames, including which has what items already
-
+			sorted FrameIndex over this video's frames; built on first
+			access and dropped whenever frames are added or removed
 		"""
-		rows = []
-		for frame_dict in mongo_doc['frames'].values():
-			frame = Frame(self.db, frame_dict, frame_dict['root_dir'])
-			d = {k:frame.item_exists(k) for k in frame.keys() if not k == '_id'}
-			d['_id'] = frame_dict['_id']
-			d['root'] = frame_dict['root_dir']
-			rows.append(d)
-		df = pd.DataFrame(rows)
-		df.index = df['_id'].astype(int)
-		df.drop('_id', axis=1, inplace=True)
-		df.sort(inplace=True)
-		return df
+		if self._frame_index is None:
+			self._frame_index = FrameIndex(self.children.get_childtype_dict(Frame))
+		return self._frame_index
+
+
+	@property
+	def frames(self):
+		return FrameSequence(self)
+
+
+	def add_child(self, *args):
+		super(Video, self).add_child(*args)
+		self._frame_index = None
+
+
+	def delete_child(self, *args):
+		super(Video, self).delete_child(*args)
+		self._frame_index = None
 
 
 	def __len__(self):
-		return len(self.frames_df)
+		return len(self.frame_index)
 
 
 	def get_frame(self, t):
 		"""
-			returns frame with '_id' = t
+			returns frame with frame number t, or None if absent
 		"""
-		if not t in self.frames_df.index:
+		ix = self.frame_index.position(t)
+		if ix is None:
 			return None
-		else:
-			mongo_doc = self.mongo_doc['frames'][str(t)]
-			return Frame(self.db, mongo_doc, mongo_doc['root_dir'])
+		return self.client.get(Frame, self.frame_index.ids[ix])
 
 
 	def get_random_frame(self):
 		"""
-			returns random Frame object from this video, with the 
-			requirement that it's 'processed'
+			returns random Frame object from this video
 		"""
-		return self.get_frame(random.choice(self.frames_df.index))
+		ids = self.frame_index.ids
+		return self.client.get(Frame, ids[random.randrange(len(ids))])
 
 
 	def iter_frames(self, verbose=False, subsample_rate=1):
 		"""
-			iterates over all frames
-			stepsize: describes how to subsample frames.
+			iterates over all frames in order of frame number
+			subsample_rate: describes how to subsample frames.
 				i.e. subsample_rate=2 means every other frame is returned 
 		"""
-		for i in islice(self.frames_df.index, 0, None, subsample_rate):
-			f = self.get_frame(i)
-			if verbose:
-				print '	', f
-			yield f
+		ids = self.frame_index.ids[::subsample_rate]
+		for i in xrange(0, len(ids), self.iter_batch_size):
+			for f in self.client.get_many(Frame, list(ids[i:i+self.iter_batch_size])):
+				if verbose:
+					print '	', f
+				yield f
+
+
+
+	################################################################################
+	####################[ Windows	]###############################################
+	################################################################################
+
+	def window_positions(self, numbers, pad=None):
+		"""
+			maps frame numbers to positions in the frame index; 
+			numbers with no frame are handled according to pad:
+				None: raise KeyError
+				'edge': use the nearest earlier frame (or the first)
+				'zero': position -1, filled with zeros
+		"""
+		if not pad in self.pad_modes:
+			raise ValueError("pad must be one of %s" % str(self.pad_modes))
+
+		index = self.frame_index
+		positions = np.empty(len(numbers), dtype=np.int64)
+		for i, t in enumerate(numbers):
+			ix = index.position(t)
+			if ix is None:
+				if pad is None or len(index) == 0:
+					raise KeyError("No such frame: %s" % str(t))
+				elif pad == 'edge':
+					ix = max(int(np.searchsorted(index.numbers, t, side='right')) - 1, 0)
+				else:
+					ix = -1
+			positions[i] = ix
+		return positions
+
+
+	def map_frames(self, func, positions, workers, frames=None):
+		"""
+			fetches the frames at the given index positions with one 
+			query (unless given, aligned with positions) and applies 
+			func(position, frame) to each on a pool of worker threads
+		"""
+		if frames is None:
+			frames = self.client.get_many(Frame, list(self.frame_index.ids[positions]))
+		jobs = zip(positions, frames)
+		if workers <= 1 or len(jobs) <= 1:
+			return [func(p, f) for p, f in jobs]
+		pool = ThreadPool(min(workers, len(jobs)))
+		try:
+			return pool.map(lambda job: func(*job), jobs)
+		finally:
+			pool.close()
+
+
+	def load_item(self, frame, item):
+		value = frame[item]
+		if value is None:
+			raise ValueError("Item %s not present for %s" % (item, frame._id))
+		return np.asarray(value)
+
+
+	def load_window(self, item, start, stop, step=1, pad=None, workers=8):
+		"""
+			returns an (N, ...) array containing item for frame numbers 
+			range(start, stop, step), fetched with one get_many query 
+			and loaded in parallel directly into a preallocated array. 
+			See window_positions for pad.
+		"""
+		positions = self.window_positions(range(start, stop, step), pad)
+		present = sorted(set(positions[positions >= 0].tolist()))
+		if len(present) == 0:
+			raise KeyError("No frames in window [%d, %d)" % (start, stop))
+		frames = self.client.get_many(Frame, list(self.frame_index.ids[present]))
+
+		#=====[ Step 1: allocate from the first frame's item	]=====
+		first = self.load_item(frames[0], item)
+		out = np.zeros((len(positions),) + first.shape, dtype=first.dtype)
+		slots = {p:np.flatnonzero(positions == p) for p in present}
+
+		#=====[ Step 2: fill remaining frames in parallel	]=====
+		def fill(p, frame):
+			value = first if p == present[0] else self.load_item(frame, item)
+			if not value.shape == first.shape:
+				raise ValueError("Item %s has shape %s for %s; expected %s" % (item, value.shape, frame._id, first.shape))
+			out[slots[p]] = value
+
+		fill(present[0], frames[0])
+		self.map_frames(fill, present[1:], workers, frames[1:])
+		return out
+
+
+	def iter_windows(self, item, size, stride=1, step=1, start=None, stop=None, pad=None, workers=8):
+		"""
+			yields (size, ...) arrays of item over sliding windows of 
+			frame numbers; window k covers 
+				range(start + k*stride*step, ..., step)[:size]
+			Frames shared by consecutive windows are loaded only once.
+			With pad='zero', windows with no frames at all are yielded 
+			as zeros, shaped like the video's first frame's item.
+		"""
+		index = self.frame_index
+		if len(index) == 0:
+			return
+		start = int(index.numbers[0]) if start is None else start
+		stop = int(index.numbers[-1]) + 1 if stop is None else stop
+
+		cache, template = {}, None
+		for window_start in xrange(start, stop - (size - 1) * step, stride * step):
+			positions = self.window_positions(range(window_start, window_start + size * step, step), pad)
+
+			#=====[ Step 1: evict frames behind the window, load new ones	]=====
+			lowest = positions[positions >= 0].min() if np.any(positions >= 0) else None
+			for p in [p for p in cache if lowest is None or p < lowest]:
+				del cache[p]
+			new = sorted(set(positions[positions >= 0].tolist()).difference(cache))
+			cache.update(zip(new, self.map_frames(lambda p, f: self.load_item(f, item), new, workers)))
+			if len(cache) > 0:
+				template = next(iter(cache.values()))
+			elif template is None:
+				template = self.load_item(self.client.get(Frame, index.ids[0]), item)
+
+			#=====[ Step 2: assemble window	]=====
+			out = np.zeros((size,) + template.shape, dtype=template.dtype)
+			for i, p in enumerate(positions):
+				if p >= 0:
+					out[i] = cache[p]
+			yield out
 
 
 
@@ -1,5 +1,8 @@
-__all__ = ['ModalClient', 'ModalSchema', 'Video', 'Frame']
+__all__ = ['ModalClient', 'AsyncModalClient', 'ModalSchema', 'Video', 'Frame', 'Ingestor', 'register_format']
 from ModalClient import ModalClient
+from AsyncModalClient import AsyncModalClient
 from ModalSchema import ModalSchema
 from Video import Video
 from Frame import Frame
+from Ingest import Ingestor
+from Formats import register_format
@@ -1,11 +1,11 @@
 import os
+import uuid
+import hashlib
 from random import sample
+from multiprocessing.pool import ThreadPool
 import numpy as np
-import scipy as sp
-import pandas as pd
-import matplotlib.pyplot as plt
 
-from RecipeWatchRelated import *
+from Formats import get_format
 
 def load_cluster_data(data_dir):
 	"""
@@ -15,6 +15,7 @@ def load_cluster_data(data_dir):
 			- frame_id
 			- mask_id
 	"""
+	import pandas as pd
 	return pd.DataFrame({
         'cluster_id': np.load(os.path.join(data_dir, 'cluster_ids.npy')),
         'video_id':np.load(os.path.join(data_dir, 'video_ids.npy')),
@@ -26,41 +27,205 @@ def load_cluster_data(data_dir):
 def sample_cluster(df, cluster_id, samples=9):
 	"""
 		returns a sampled df from the named cluster of size 'samples'
+		(or the whole cluster, if smaller)
 	"""
-	cluster_df = df.ix[df['cluster_id'] == cluster_id]
-	random_ixs = sample(cluster_df.index, samples)
-	return df.ix[random_ixs]
+	cluster_df = df.loc[df['cluster_id'] == cluster_id]
+	random_ixs = sample(list(cluster_df.index), min(samples, len(cluster_df)))
+	return df.loc[random_ixs]
 
 
-def visualize_cluster_sample(sd, df, cluster_id):
+def sample_to_proposals(samples):
 	"""
-		plots a sample of object proposals in a given 
-		cluster 
+		returns [(frame _id, mask_id)...] for rows of a sampled df
 	"""
-	samples = sample_cluster(df, cluster_id)
-	for i in range(9):
-		sample_row = samples.iloc[i]
-		video = sd.get_video(sample_row['video_id'])
-		frame = video.get_frame(sample_row['frame_id'])
+	return [('%s/%s' % (r['video_id'], r['frame_id']), int(r['mask_id'])) for _, r in samples.iterrows()]
 
-		plt.subplot(3, 3, i)
-		plt.gca().set_xticks([])
-		plt.gca().set_yticks([])
-		plt.imshow(frame.visualize_mask(sample_row['mask_id']))
 
-	plt.show()
 
 
+################################################################################
+####################[ THUMBNAILS	]###########################################
+################################################################################
 
+def fit_thumbnail(image, size):
+	"""
+		scales image (nearest neighbor) to fit in a size x size box,
+		keeping aspect ratio, and centers it on black
+	"""
+	if image.ndim == 2:
+		image = np.dstack([image] * 3)
+	thumbnail = np.zeros((size, size, image.shape[2]), dtype=np.uint8)
+	if image.shape[0] == 0 or image.shape[1] == 0:
+		return thumbnail
+	scale = float(size) / max(image.shape[:2])
+	h, w = max(1, int(image.shape[0] * scale)), max(1, int(image.shape[1] * scale))
+	rows = (np.arange(h) / scale).astype(np.int64).clip(0, image.shape[0] - 1)
+	cols = (np.arange(w) / scale).astype(np.int64).clip(0, image.shape[1] - 1)
+	top, left = (size - h) // 2, (size - w) // 2
+	thumbnail[top:top+h, left:left+w] = image[rows][:, cols]
+	return thumbnail
+
+
+def proposal_thumbnails(frame, mask_ids, size=96, black=False):
+	"""
+		returns {mask_id: thumbnail} of frame's object proposals,
+		loading the frame's image and masks once
+	"""
+	thumbnails = {}
+	for mask_id in mask_ids:
+		mask = frame.get_mask(mask_id)
+		if not mask.any():
+			thumbnails[mask_id] = fit_thumbnail(np.zeros((0, 0, 3), dtype=np.uint8), size)
+		else:
+			thumbnails[mask_id] = fit_thumbnail(frame.crop_object(mask, black=black), size)
+	return thumbnails
 
 
-if __name__ == '__main__':
 
-	sd = StorageDelegate()
-	df = load_cluster_data('./data')
+def source_fingerprints(client, datatype, frame_ids, source_items=('image', 'masks')):
+	"""
+		returns {frame _id: [size, mtime] of each of its source disk
+		items' files}, from one metadata query; thumbnails cached
+		under a fingerprint go stale when a source file changes
+	"""
+	table = client.get_schema(datatype)
+	source_items = [k for k in source_items if table.modes.get(k) == 'disk']
+	projection = {'items.' + k:1 for k in source_items}
+	fingerprints = {}
+	for doc in client.get_collection(datatype).find({'_id':{'$in':list(frame_ids)}}, projection):
+		fingerprint = []
+		for k in source_items:
+			path = doc.get('items', {}).get(k)
+			if not path is None and os.path.exists(path):
+				stat = os.stat(path)
+				fingerprint.append([stat.st_size, stat.st_mtime])
+			else:
+				fingerprint.append(None)
+		fingerprints[doc['_id']] = fingerprint
+	return fingerprints
+
+
+class ThumbnailCache(object):
+	"""
+		Class: ThumbnailCache
+		=====================
+
+		On-disk cache of proposal thumbnails, one .npy per (frame _id,
+		mask_id, size, black, fingerprint of the frame's source files);
+		written atomically, so concurrent renderers can share it.
+	"""
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		if not os.path.exists(cache_dir):
+			os.makedirs(cache_dir)
+
+
+	def path(self, frame_id, mask_id, size, black, fingerprint):
+		if isinstance(frame_id, unicode):
+			frame_id = frame_id.encode('utf-8')
+		key = hashlib.sha1('%s\t%d\t%d\t%d\t%r' % (frame_id, mask_id, size, black, fingerprint)).hexdigest()
+		return os.path.join(self.cache_dir, key + '.npy')
+
+
+	def get(self, frame_id, mask_id, size, black, fingerprint):
+		"""
+			returns the cached thumbnail, or None
+		"""
+		path = self.path(frame_id, mask_id, size, black, fingerprint)
+		return np.load(path) if os.path.exists(path) else None
+
+
+	def put(self, frame_id, mask_id, size, black, fingerprint, thumbnail):
+		path = self.path(frame_id, mask_id, size, black, fingerprint)
+		tmp_path = os.path.join(self.cache_dir, '.tmp.%s.npy' % uuid.uuid4().hex)
+		np.save(tmp_path, thumbnail)
+		os.rename(tmp_path, path)
 
-	visualize_cluster_sample(sd, df, 1)
 
 
 
+################################################################################
+####################[ CONTACT SHEETS	]#######################################
+################################################################################
+
+def render_contact_sheet(client, proposals, columns=None, size=96, black=False, cache_dir=None, workers=8, datatype=None):
+	"""
+		returns a grid image (numpy uint8) of the object proposals
+		[(frame _id, mask_id)...], in order, row by row.
+
+		Thumbnails come from cache_dir (see ThumbnailCache) when
+		given, keyed by the fingerprints of the frames' files; the
+		remaining frames are fetched with one query and
+		decoded/cropped on a thread pool.
+	"""
+	if datatype is None:
+		from Frame import Frame
+		datatype = Frame
+	cache = ThumbnailCache(cache_dir) if not cache_dir is None else None
+	fingerprints = source_fingerprints(client, datatype, set(f for f, _ in proposals)) if not cache is None else {}
+
+	#=====[ Step 1: cached thumbnails	]=====
+	thumbnails, missing = {}, {}
+	for frame_id, mask_id in proposals:
+		thumbnail = cache.get(frame_id, mask_id, size, black, fingerprints.get(frame_id)) if not cache is None else None
+		if not thumbnail is None:
+			thumbnails[(frame_id, mask_id)] = thumbnail
+		else:
+			missing.setdefault(frame_id, set()).add(mask_id)
+
+	#=====[ Step 2: fetch, decode and crop the rest	]=====
+	if len(missing) > 0:
+		frames = client.get_many(datatype, sorted(missing.keys()))
+		render = lambda frame: (frame._id, proposal_thumbnails(frame, missing[frame._id], size=size, black=black))
+		pool = ThreadPool(workers)
+		try:
+			for frame_id, frame_thumbnails in pool.imap_unordered(render, frames):
+				for mask_id, thumbnail in frame_thumbnails.items():
+					thumbnails[(frame_id, mask_id)] = thumbnail
+					if not cache is None:
+						cache.put(frame_id, mask_id, size, black, fingerprints.get(frame_id), thumbnail)
+		finally:
+			pool.close()
+
+	#=====[ Step 3: assemble grid	]=====
+	columns = columns or max(1, int(np.ceil(np.sqrt(len(proposals)))))
+	n_rows = max(1, int(np.ceil(len(proposals) / float(columns))))
+	channels = max([t.shape[2] for t in thumbnails.values()] or [3])
+	grid = np.zeros((n_rows * size, columns * size, channels), dtype=np.uint8)
+	for i, proposal in enumerate(proposals):
+		r, c = divmod(i, columns)
+		grid[r*size:(r+1)*size, c*size:(c+1)*size, :thumbnails[proposal].shape[2]] = thumbnails[proposal]
+	return grid
+
+
+def save_contact_sheet(client, proposals, outpath, **kwargs):
+	"""
+		renders a contact sheet (see render_contact_sheet) and writes
+		it to outpath; format from its extension (i.e. .png, .jpg).
+		Needs no display.
+	"""
+	grid = render_contact_sheet(client, proposals, **kwargs)
+	_, save_func = get_format(os.path.splitext(outpath)[1].lstrip('.').lower())
+	save_func(grid, outpath)
+	return grid
+
+
+def visualize_cluster_sample(client, df, cluster_id, outpath, samples=9, **kwargs):
+	"""
+		writes a contact sheet of a sample of object proposals
+		in a given cluster to outpath
+	"""
+	return save_contact_sheet(client, sample_to_proposals(sample_cluster(df, cluster_id, samples)), outpath, **kwargs)
+
+
+
+
+
+if __name__ == '__main__':
+	from ModalClient import ModalClient
+
+	client = ModalClient(root='./data')
+	df = load_cluster_data('./data')
 
+	visualize_cluster_sample(client, df, 1, 'cluster_1.png', cache_dir='./data/.ModalDB_thumbnails')
@@ -0,0 +1,100 @@
+'''
+Script: bench_import.py
+=======================
+
+Description:
+------------
+
+	Measures the wall-clock time of 'import ModalDB' in fresh
+	interpreters and checks that no heavy optional dependency
+	(scipy, pandas, matplotlib, sklearn, dill) is loaded by it.
+	Exits nonzero if a heavy module is loaded or the median import
+	time exceeds --max_seconds, so it can guard against regressions.
+
+
+Args:
+-----
+
+	--repeat: number of fresh interpreters to time
+	--max_seconds: (optional) fail if the median import time exceeds this
+	--outpath: path to write JSON results to
+
+
+Usage:
+------
+
+	python benchmarks/bench_import.py --repeat 10 --max_seconds 0.5
+
+
+##############
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##############
+'''
+import sys
+import json
+import platform
+import subprocess
+import click
+import numpy as np
+
+
+heavy_modules = ['scipy', 'pandas', 'matplotlib', 'sklearn', 'dill']
+
+probe = """
+import sys, time, json
+start = time.time()
+import ModalDB
+seconds = time.time() - start
+print json.dumps({'seconds':seconds, 'loaded':[m for m in %r if m in sys.modules]})
+""" % heavy_modules
+
+
+def time_import():
+	"""
+		imports ModalDB in a fresh interpreter; returns (seconds, list of
+		heavy modules loaded)
+	"""
+	result = json.loads(subprocess.check_output([sys.executable, '-c', probe]).strip().split('\n')[-1])
+	return result['seconds'], result['loaded']
+
+
+@click.command()
+@click.option('--repeat', 		help='number of fresh interpreters to time', type=int, default=10)
+@click.option('--max_seconds', 	help='fail if median import time exceeds this', type=float, default=None)
+@click.option('--outpath', 		help='path to write JSON results to (default: stdout)', default=None)
+def main(repeat, max_seconds, outpath):
+	"""
+		Times 'import ModalDB' and checks for heavy imports
+	"""
+	latencies, loaded = [], set()
+	for _ in range(repeat):
+		seconds, heavy = time_import()
+		latencies.append(seconds)
+		loaded.update(heavy)
+
+	results = {
+				'config':{'repeat':repeat, 'max_seconds':max_seconds},
+				'environment':{'python':platform.python_version(), 'platform':platform.platform()},
+				'results':{
+							'median_s':float(np.median(latencies)),
+							'max_s':float(np.max(latencies)),
+							'heavy_modules_loaded':sorted(loaded)
+						}
+			}
+	output = json.dumps(results, indent=2, sort_keys=True)
+	if outpath is None:
+		click.echo(output)
+	else:
+		with open(outpath, 'w') as f:
+			f.write(output)
+
+	if len(loaded) > 0:
+		raise click.ClickException("import ModalDB loaded heavy modules: %s" % ', '.join(sorted(loaded)))
+	if not max_seconds is None and results['results']['median_s'] > max_seconds:
+		raise click.ClickException("median import time %.3fs exceeds %.3fs" % (results['results']['median_s'], max_seconds))
+
+
+if __name__ == '__main__':
+	main()
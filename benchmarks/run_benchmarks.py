@@ -0,0 +1,189 @@
+'''
+Script: run_benchmarks.py
+=========================
+
+Description:
+------------
+
+	Measures throughput and latency of core ModalDB operations on a
+	synthetic dataset (see synthetic.py) and writes the results as
+	JSON for regression tracking.
+
+	Runs against mongomock by default, so it works offline; pass
+	--backend mongodb to run against a local mongod instead (this
+	drops the ModalDB database).
+
+
+Args:
+-----
+
+	--n_videos/--n_frames: size of the synthetic dataset
+	--image_size: side length of the synthetic (square, RGB) images
+	--repeat: number of calls timed per operation
+	--backend: mongomock or mongodb
+	--outpath: path to write JSON results to
+
+
+Usage:
+------
+
+	python benchmarks/run_benchmarks.py --n_videos 10 --n_frames 100 --outpath bench.json
+
+
+##############
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##############
+'''
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import click
+import numpy as np
+from ModalDB import *
+
+from synthetic import synthetic_schema, generate, make_image
+
+
+def summarize(latencies):
+	"""
+		returns dict of summary statistics for a list of per-call
+		latencies, in seconds
+	"""
+	latencies = np.array(latencies)
+	return {
+				'calls':len(latencies),
+				'total_s':float(latencies.sum()),
+				'mean_s':float(latencies.mean()),
+				'median_s':float(np.median(latencies)),
+				'p95_s':float(np.percentile(latencies, 95)),
+				'ops_per_s':float(len(latencies) / latencies.sum()) if latencies.sum() > 0 else None
+			}
+
+
+def time_calls(func, repeat):
+	"""
+		calls func() repeat times, returns list of latencies
+	"""
+	latencies = []
+	for _ in range(repeat):
+		start = time.time()
+		func()
+		latencies.append(time.time() - start)
+	return latencies
+
+
+def time_iteration(iterator):
+	"""
+		exhausts iterator, returns list of per-step latencies
+	"""
+	latencies = []
+	start = time.time()
+	for _ in iterator:
+		now = time.time()
+		latencies.append(now - start)
+		start = now
+	return latencies
+
+
+def make_client(root, backend):
+	if backend == 'mongomock':
+		try:
+			import mongomock
+		except ImportError:
+			raise click.UsageError("--backend mongomock requires the mongomock package")
+		return ModalClient(root, schema=synthetic_schema(), mongo_client=mongomock.MongoClient())
+	client = ModalClient(root, schema=synthetic_schema())
+	client.clear_db()
+	return client
+
+
+def run_benchmarks(client, staging_dir, n_videos, n_frames, image_size, repeat):
+	"""
+		returns dict mapping benchmark name to summary statistics
+	"""
+	results = {}
+	image_shape = (image_size, image_size, 3)
+
+	#=====[ insert	]=====
+	results['insert'] = summarize(time_iteration(generate(client, staging_dir, n_videos, n_frames, image_shape)))
+
+	frame_ids = ['video_%d/frame_%d' % (v, f) for v in range(n_videos) for f in range(n_frames)]
+	random_frame_id = lambda: random.choice(frame_ids)
+
+	#=====[ get/get_random	]=====
+	results['get'] = summarize(time_calls(lambda: client.get(Frame, random_frame_id()), repeat))
+	results['get_many'] = summarize(time_calls(lambda: client.get_many(Frame, random.sample(frame_ids, min(32, len(frame_ids)))), repeat))
+	results['get_random'] = summarize(time_calls(lambda: client.get_random(Frame), repeat))
+
+	#=====[ iter	]=====
+	results['iter'] = summarize(time_iteration(client.iter(Frame)))
+	results['iter_view'] = summarize(time_iteration(client.iter(Frame, view=True)))
+	video = client.get(Video, 'video_0')
+	results['iter_children'] = summarize(time_iteration(video.iter_children()))
+
+	#=====[ disk items	]=====
+	results['disk_load'] = summarize(time_calls(lambda: client.get(Frame, random_frame_id())['image'], repeat))
+	image = make_image(image_shape, 1)
+	def save():
+		client.get(Frame, random_frame_id())['image'] = image
+	results['disk_save'] = summarize(time_calls(save, repeat))
+
+	#=====[ update_mongo_doc	]=====
+	frame = client.get(Frame, frame_ids[0])
+	results['update_mongo_doc'] = summarize(time_calls(frame.update_mongo_doc, repeat))
+
+	return results
+
+
+@click.command()
+@click.option('--n_videos', 	help='number of synthetic videos', type=int, default=10)
+@click.option('--n_frames', 	help='number of frames per video', type=int, default=100)
+@click.option('--image_size', 	help='side length of synthetic images', type=int, default=64)
+@click.option('--repeat', 		help='number of calls timed per operation', type=int, default=200)
+@click.option('--backend', 		help='mongomock or mongodb', type=click.Choice(['mongomock', 'mongodb']), default='mongomock')
+@click.option('--outpath', 		help='path to write JSON results to (default: stdout)', default=None)
+def main(n_videos, n_frames, image_size, repeat, backend, outpath):
+	"""
+		Runs all benchmarks on a fresh synthetic dataset
+	"""
+	root = tempfile.mkdtemp(prefix='ModalDB_bench_')
+	staging_dir = tempfile.mkdtemp(prefix='ModalDB_staging_')
+	try:
+		click.echo('---> Running benchmarks (%s backend) in %s' % (backend, root), err=True)
+		client = make_client(root, backend)
+		results = {
+					'config':{
+								'n_videos':n_videos,
+								'n_frames':n_frames,
+								'image_size':image_size,
+								'repeat':repeat,
+								'backend':backend
+							},
+					'environment':{
+								'python':platform.python_version(),
+								'platform':platform.platform(),
+								'timestamp':time.time()
+							},
+					'results':run_benchmarks(client, staging_dir, n_videos, n_frames, image_size, repeat)
+				}
+	finally:
+		shutil.rmtree(root)
+		shutil.rmtree(staging_dir)
+
+	output = json.dumps(results, indent=2, sort_keys=True)
+	if outpath is None:
+		click.echo(output)
+	else:
+		with open(outpath, 'w') as f:
+			f.write(output)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,89 @@
+'''
+Module: synthetic.py
+====================
+
+Description:
+------------
+
+	Generates synthetic ModalDB roots for benchmarking: n_videos
+	Videos, each containing n_frames Frames with an image of
+	configurable size stored on disk (as .npy) and subtitles/scores
+	stored in memory.
+
+
+Usage:
+------
+
+	client = ModalClient(root, schema=synthetic_schema(), mongo_client=mongomock.MongoClient())
+	for obj in generate(client, staging_dir, n_videos=10, n_frames=100):
+		...
+
+
+##############
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##############
+'''
+import os
+import numpy as np
+from ModalDB import *
+
+
+def synthetic_schema():
+	"""
+		returns schema dict for synthetic data
+	"""
+	return {
+				Frame: {
+							'image':{
+										'mode':'disk',
+										'filename':'image.npy',
+										'load_func':lambda p: np.load(p),
+										'save_func':lambda x, p: np.save(p, x)
+									},
+							'subtitles':{
+										'mode':'memory'
+									},
+							'score':{
+										'mode':'memory'
+									},
+							'contains':[]
+						},
+				Video: {
+							'summary':{
+										'mode':'memory'
+									},
+							'contains':[Frame]
+						}
+			}
+
+
+def make_image(shape, seed):
+	return np.random.RandomState(seed).randint(0, 256, size=shape).astype(np.uint8)
+
+
+def generate(client, staging_dir, n_videos=10, n_frames=100, image_shape=(64, 64, 3), seed=0):
+	"""
+		inserts n_videos Videos with n_frames Frames each through
+		client; yields every object as soon as it is inserted, so
+		callers can time insertion.
+
+		staging_dir: scratch directory for images prior to insertion
+	"""
+	rng = np.random.RandomState(seed)
+	image = make_image(image_shape, seed)
+	staging_path = os.path.join(staging_dir, 'image.npy')
+
+	for v in range(n_videos):
+		video = client.insert(Video, 'video_%d' % v, {'summary':'synthetic video %d' % v})
+		yield video
+
+		for f in range(n_frames):
+			np.save(staging_path, image)
+			frame_data = {
+							'image':staging_path,
+							'subtitles':'synthetic frame %d' % f,
+							'score':float(rng.rand())
+						}
+			yield client.insert(Frame, 'frame_%d' % f, frame_data, parent=video, method='mv')
@@ -4,24 +4,36 @@ Script: cluster_features.py
 
 Description:
 ------------
-	
-	Input: numpy matrix containing features 
-	Output: cluster IDs for each featurized object
+
+	Input: feature item in ModalDB, or numpy matrix containing features
+	Output: cluster IDs for each featurized object, written back as
+		a memory item (ModalDB) or saved as a numpy array (matrix)
+
+	Features are streamed in chunks and clustered with mini-batch
+	KMeans, so they never need to fit in memory; see ModalDB.Clustering.
 
 
 Args:
 -----
-	
-	--inpath: path to file containing feature matrix 
-	--outpath: path to location to save resulting cluster ids
-	--n_clusters: number of clusters to use in KMeans 
+
+	--root: ModalDB root; cluster --datatype's --item, writing
+		cluster ids to memory item --assign_item
+	--inpath: path to (.npy) file containing feature matrix; cluster
+		its rows, saving cluster ids to --outpath
+	--n_clusters: number of clusters to use in KMeans
 	--normalize/--no-normalize: boolean flag for L2 normalizing before clustering
+	--epochs, --batch_size, --chunk_size, --workers: see MiniBatchKMeans
+	--checkpoint: path to save centroids to while clustering; rerunning
+		with the same checkpoint resumes
 
 Usage:
 ------
 
+	python cluster_features.py --root /data --datatype Frame --item cnn_features ...
+				--assign_item cluster_id --n_clusters 1000 --checkpoint /data/kmeans.npz
+
 	python cluster_features.py --inpath ./data/features.npy --outpath cluster_ids.npy ...
-				--n_clusters 50 
+				--n_clusters 50
 
 
 ##############
@@ -33,36 +45,60 @@ jhack@stanford.edu
 import click
 import os
 import numpy as np
-from sklearn import preprocessing, cluster
 from ModalDB import *
+from ModalDB.Clustering import MiniBatchKMeans, FeatureStream, MatrixStream, write_assignments
 
 @click.command()
+@click.option('--root', 					help='ModalDB root, to cluster a feature item')
+@click.option('--datatype', 				help='datatype holding the feature item (default Frame)', default='Frame')
+@click.option('--item', 					help='name of the feature item')
+@click.option('--assign_item', 				help='memory item to write cluster ids to (default cluster_id)', default='cluster_id')
 @click.option('--inpath', 					help='path to file containing feature vectors')
 @click.option('--outpath', 					help='path to save cluster ids to')
 @click.option('--n_clusters', 				help='number of centroids to cluster (default 50)', type=int, default=50, )
 @click.option('--normalize/--no-normalize', help='Normalize features?', default=True)
-def cluster_features(inpath, outpath, n_clusters, normalize):
+@click.option('--epochs', 					help='passes over the features (default 1)', type=int, default=1)
+@click.option('--batch_size', 				help='features per centroid update (default 1000)', type=int, default=1000)
+@click.option('--chunk_size', 				help='features streamed at a time (default 100000)', type=int, default=100000)
+@click.option('--workers', 					help='threads loading features/computing assignments (default 8)', type=int, default=8)
+@click.option('--checkpoint', 				help='path to checkpoint centroids to; resumes if it exists')
+def cluster_features(root, datatype, item, assign_item, inpath, outpath, n_clusters, normalize, epochs, batch_size, chunk_size, workers, checkpoint):
 	"""
-		Clusters a feature matrix and outputs resulting 
+		Clusters a feature item/matrix and outputs resulting
 		cluster ids
 	"""
-	#=====[ Step 1: Sanitize input	]=====
-	if not os.path.exists(inpath):
-		raise Exception("specified infile path nonexistent")
-
-	#=====[ Step 2: Load/normalize input	]=====
-	click.echo('---> Loading/normalizing input feature matrix')
-	X = np.load(inpath)
-	if normalize:
-		X = preprocessing.normalize(X, norm='l2')
+	#=====[ Step 1: Sanitize input, open stream	]=====
+	if not root is None:
+		if item is None:
+			raise Exception("specify the feature --item to cluster")
+		client = ModalClient(root=root)
+		datatypes = {d.__name__:d for d in client.get_datatypes()}
+		if not datatype in datatypes:
+			raise Exception("unknown datatype %s (have %s)" % (datatype, ', '.join(datatypes.keys())))
+		datatype = datatypes[datatype]
+		stream_kwargs = {'chunk_size':chunk_size, 'workers':workers, 'normalize':normalize}
+		stream = FeatureStream(client, datatype, item, **stream_kwargs)
+	else:
+		if inpath is None or not os.path.exists(inpath):
+			raise Exception("specified infile path nonexistent")
+		if outpath is None:
+			raise Exception("specify --outpath to save cluster ids to")
+		stream = MatrixStream(inpath, chunk_size=chunk_size, normalize=normalize)
 
-	#=====[ Step 3: Perform clustering ]=====
-	click.echo('---> Performing KMeans clustering')
-	cluster_ids = cluster.KMeans(n_clusters=n_clusters, verbose=1, n_jobs=1).fit_predict(X)
+	#=====[ Step 2: Perform clustering ]=====
+	click.echo('---> Performing mini-batch KMeans clustering')
+	kmeans = MiniBatchKMeans(n_clusters, batch_size=batch_size, workers=workers, checkpoint_path=checkpoint)
+	report = lambda k: click.echo('	epoch %d, batch %d' % (k.epoch, k.n_batches))
+	kmeans.fit(stream, epochs=epochs, callback=report)
 
-	#=====[ Step 4: Save output	]=====
+	#=====[ Step 3: Save output	]=====
 	click.echo('---> Saving cluster IDs')
-	np.save(outpath, cluster_ids)
+	if not root is None:
+		n = write_assignments(client, datatype, item, assign_item, kmeans, **stream_kwargs)
+		client.save_schema()
+		click.echo('	wrote %s to %d objects' % (assign_item, n))
+	else:
+		np.save(outpath, np.concatenate([labels for _, labels in kmeans.predict_stream(stream)]))
 
 
 if __name__ == '__main__':
@@ -13,11 +13,14 @@ Description:
 Usage: 
 ------
 
-	python configure_mongodb.py --dbpath [path to data directory] --schema_dict [path to file containing schema]
+	python configure_mongodb.py --dbpath [path to data directory] --schema_file [module containing schema]
 
 	i.e.
 
-	python make_mongod_database.py --dbpath ./data --schema_dict schema.Schema
+	python configure_mongodb.py --dbpath ./data --schema_file schema
+
+	Ingestion is journaled (see ModalDB.Ingest); rerunning after a crash
+	resumes where it stopped. The database is only dropped with --clear.
 
 
 Args:
@@ -25,6 +28,10 @@ Args:
 
 	--dbpath: path to directory containing data
 	--schema_file: import location of python dict containing schema. Ex: myproject.schema
+	--journal: path to ingestion journal (default: [dbpath]/.ModalDB_ingest_journal)
+	--clear: drop the database (and journal) first, starting from scratch
+	--sync: instead of ingesting, incrementally sync the database with 
+		the directory tree (only new, changed and removed objects)
 
 ##############
 Jay Hack
@@ -34,61 +41,64 @@ jhack@stanford.edu
 '''
 import click
 import os
-import shutil
-import sys
-import argparse
-from pprint import pprint
-from scipy.io import loadmat
-import numpy as np
-from pymongo import MongoClient
 
 from ModalDB import *
 
 @click.command()
 @click.option('--dbpath', help='path to directory containing data')
 @click.option('--schema_file', help='import location of python dict containing schema. Ex: myproject.schema', default=None)
-def configure_mongodb(dbpath, schema_file):
+@click.option('--journal', help='path to ingestion journal (default: [dbpath]/.ModalDB_ingest_journal)', default=None)
+@click.option('--clear/--no-clear', help='drop the database and journal first?', default=False)
+@click.option('--sync', is_flag=True, help='incrementally sync the database with the filesystem', default=False)
+def configure_mongodb(dbpath, schema_file, journal, clear, sync):
 	"""
 		Configures/initializes the mongodb database
 	"""
 	schema = __import__(schema_file).Schema
 	client = ModalClient(root=dbpath, schema=schema)
-
-	#=====[ Step 1: Erase old tables	]=====
-	click.echo("---> Clearing MongoDB")
-	client.clear_db()
-
-	#=====[ Step 2: Add Videos	]=====
-	click.echo("---> Adding videos")
-	videos_dir = os.path.join(dbpath, 'Video')
-	for video_name in [v for v in os.listdir(videos_dir) if not v.startswith('.')]:
-
-		#=====[ Step 2.1: add video (no item_data)	]=====
-		click.echo("	---> Adding video: %s" % video_name)
-		video_data = {}
-		video = client.insert_object(Video, video_name, video_data, parent=None, method='cp')
-		
-		#=====[ Step 2.2: add Frames as children	]=====
-		frames_dir = os.path.join(video.root, 'Frame')
-		for frame_name in [d for d in os.listdir(frames_dir) if not d.startswith('.')]:
-
-			frame_data = {
-							'image':os.path.join(frames_dir, frame_name, 'image.png'),
-							'masks':os.path.join(frames_dir, frame_name, 'masks_and_scores.mat'),
-							'scores':os.path.join(frames_dir, frame_name, 'masks_and_scores.mat'),
-							'cnn_features':os.path.join(frames_dir, frame_name, 'features.npy')
-			}
-			client.insert_object(Frame, frame_name, frame_data, parent=video, method='cp')
+	journal = journal or os.path.join(dbpath, '.ModalDB_ingest_journal')
+
+	#=====[ Step 1: Erase old tables, only if asked	]=====
+	if clear:
+		click.echo("---> Clearing MongoDB")
+		client.clear_db()
+		if os.path.exists(journal):
+			os.remove(journal)
+
+	#=====[ Case: sync	]=====
+	if sync:
+		click.echo("---> Syncing with filesystem")
+		report = lambda datatype, counts: click.echo("	---> %s: %s" % (datatype.__name__, counts))
+		stats = client.sync(callback=report)
+		click.echo("---> Done in %.1fs" % stats['seconds'])
+		return
+
+	report = lambda stats: click.echo("	---> %(inserted)d inserted, %(skipped)d skipped (%(objects_per_s).1f objects/s)" % stats)
+	with client.ingestor(journal, report_every=1000, callback=report) as ingestor:
+
+		#=====[ Step 2: Add Videos	]=====
+		click.echo("---> Adding videos")
+		videos_dir = os.path.join(dbpath, 'Video')
+		for video_name in sorted([v for v in os.listdir(videos_dir) if not v.startswith('.')]):
+
+			#=====[ Step 2.1: add video (no item_data)	]=====
+			click.echo("	---> Adding video: %s" % video_name)
+			video = ingestor.ingest(Video, video_name, {})
+
+			#=====[ Step 2.2: add Frames as children	]=====
+			frames_dir = os.path.join(video.root, 'Frame')
+			for frame_name in sorted([d for d in os.listdir(frames_dir) if not d.startswith('.')]):
+
+				frame_data = {
+								'image':os.path.join(frames_dir, frame_name, 'image.png'),
+								'masks':os.path.join(frames_dir, frame_name, 'masks_and_scores.mat'),
+								'scores':os.path.join(frames_dir, frame_name, 'masks_and_scores.mat'),
+								'cnn_features':os.path.join(frames_dir, frame_name, 'features.npy')
+				}
+				ingestor.ingest(Frame, frame_name, frame_data, parent=video)
+
+	click.echo("---> Done: %(inserted)d inserted, %(skipped)d skipped in %(seconds).1fs" % ingestor.stats())
 
 
 if __name__ == '__main__':
 	configure_mongodb()
-
-
-
-
-
-
-
-
-
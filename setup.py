@@ -17,6 +17,7 @@ setup(
 			'click',
 			'nose',
 			'scikit-learn',
-			'dill'
+			'dill',
+			'futures; python_version < "3"'
 		]
 )
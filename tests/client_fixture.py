@@ -0,0 +1,73 @@
+'''
+Module: client_fixture
+======================
+
+Description:
+------------
+
+	Base TestCase for tests that need a fresh ModalClient over
+	data_dir: restores the example images, empties the Video
+	directory and clears the database before each test
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import shutil
+import unittest
+from copy import deepcopy
+
+from ModalDB import *
+
+from schema_example import schema_ex
+from dataobject_example import data_dir
+
+class ClientFixture(unittest.TestCase):
+	"""
+		Class: ClientFixture
+		====================
+
+		setUp leaves self.client, a ModalClient over an empty data_dir
+		with the schema returned by self.schema(); subclasses call it
+		through super before inserting their objects
+	"""
+	thumbnail_backup_path = os.path.join(data_dir, 'thumbnail.backup.png')
+	thumbnail_path = os.path.join(data_dir, 'thumbnail.png')
+	image_backup_path = os.path.join(data_dir, 'image.backup.png')
+	image_path = os.path.join(data_dir, 'image.png')
+	video_dir = os.path.join(data_dir, 'Video')
+
+	def reset(self):
+		"""
+			restores the example images and empties the Video directory
+		"""
+		shutil.copy(self.thumbnail_backup_path, self.thumbnail_path)
+		shutil.copy(self.image_backup_path, self.image_path)
+		if os.path.exists(self.video_dir):
+			shutil.rmtree(self.video_dir)
+		os.mkdir(self.video_dir)
+
+
+	def schema(self):
+		"""
+			schema dict for self.client; override to add items
+		"""
+		return deepcopy(schema_ex)
+
+
+	def make_client(self):
+		"""
+			returns a ModalClient over data_dir with an empty database
+		"""
+		client = ModalClient(root=data_dir, schema=ModalSchema(self.schema()))
+		client.clear_db()
+		return client
+
+
+	def setUp(self):
+		self.reset()
+		self.client = self.make_client()
@@ -0,0 +1,112 @@
+'''
+Test: AsyncModalClient
+======================
+
+Description:
+------------
+
+	Tests the future-returning ModalClient front-end
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import threading
+import numpy as np
+import nose
+from nose.tools import *
+
+from ModalDB import *
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_AsyncModalClient(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	def setUp(self):
+		super(Test_AsyncModalClient, self).setUp()
+		self.aclient = AsyncModalClient(self.client, metadata_workers=2, decode_workers=2)
+
+
+	def tearDown(self):
+		self.aclient.close()
+
+
+
+
+	################################################################################
+	####################[ TESTS	]###################################################
+	################################################################################
+
+	def test_insert_get(self):
+		"""
+			AsyncModalClient: INSERT AND GET
+			--------------------------------
+			inserts and gets resolve to wrapped objects; items load on
+			the decode pool
+		"""
+		video = self.aclient.insert(Video, 'video_1', video_data, method='cp').result()
+		frames = [self.aclient.insert(Frame, 'frame_%d' % t, frame_data, parent=video, method='cp') for t in range(3)]
+		self.assertEqual(sorted(f.result()._id for f in frames), ['video_1/frame_0', 'video_1/frame_1', 'video_1/frame_2'])
+
+		frame = self.aclient.get(Frame, 'video_1/frame_1').result()
+		self.assertEqual(frame._id, 'video_1/frame_1')
+		image, subtitles = frame.get_items(['image', 'subtitles']).result()
+		self.assertEqual(image.shape, (512, 512, 3))
+		self.assertEqual(subtitles, 'hello, world!')
+
+		frame.set_item('subtitles', 'bye').result()
+		self.assertEqual(self.client.get(Frame, 'video_1/frame_1')['subtitles'], 'bye')
+
+		frames = self.aclient.get_many(Frame, ['video_1/frame_2', 'video_1/frame_0']).result()
+		self.assertEqual([f._id for f in frames], ['video_1/frame_2', 'video_1/frame_0'])
+		assert_raises(KeyError, self.aclient.get(Frame, 'video_1/frame_9').result)
+
+
+	def test_derived_on_decode_pool(self):
+		"""
+			AsyncModalClient: DERIVED ITEMS
+			-------------------------------
+			derived items are computed on the decode pool
+		"""
+		threads = []
+		def side(image):
+			threads.append(threading.current_thread())
+			return image.shape[0]
+		self.client.add_item(Frame, 'side', {'kind':'derived', 'func':side, 'inputs':['image']})
+		video = self.client.insert(Video, 'video_1', video_data, method='cp')
+		self.client.insert(Frame, 'frame_0', frame_data, parent=video, method='cp')
+
+		frame = self.aclient.get(Frame, 'video_1/frame_0').result()
+		self.assertEqual(frame.get_item('side').result(), 512)
+		self.assertEqual(len(threads), 1)
+		self.assertFalse(threads[0] is threading.current_thread())
+
+
+	def test_iter(self):
+		"""
+			AsyncModalClient: BATCHED ITERATION
+			-----------------------------------
+			next_batch resolves to batches until exhausted
+		"""
+		video = self.client.insert(Video, 'video_1', video_data, method='cp')
+		for t in range(5):
+			self.client.insert(Frame, 'frame_%d' % t, frame_data, parent=video, method='cp')
+
+		cursor = self.aclient.iter(Frame, batch_size=2)
+		sizes, ids = [], []
+		batch = cursor.next_batch().result()
+		while len(batch) > 0:
+			sizes.append(len(batch))
+			ids.extend([f._id for f in batch])
+			batch = cursor.next_batch().result()
+		self.assertEqual(sizes, [2, 2, 1])
+		self.assertEqual(sorted(ids), ['video_1/frame_%d' % t for t in range(5)])
@@ -0,0 +1,165 @@
+'''
+Test: Clustering
+================
+
+Description:
+------------
+
+	Tests streamed mini-batch k-means and writing assignments back
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import shutil
+import tempfile
+import numpy as np
+import nose
+from nose.tools import *
+
+from ModalDB import *
+from ModalDB.Clustering import MiniBatchKMeans, FeatureStream, MatrixStream, write_assignments
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_Clustering(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	blobs = np.array([[10.0, 0.0], [0.0, 10.0], [-10.0, -10.0]])
+
+	def schema(self):
+		schema = super(Test_Clustering, self).schema()
+		schema[Frame]['features'] = {'mode':'disk', 'filename':'features.npy', 'format':'npy'}
+		schema[Frame]['mask_features'] = {'mode':'memory'}
+		return schema
+
+
+	def setUp(self):
+		"""
+			inserts video_1 with 12 frames; frame_t's features lie near
+			blob t % 3, its two mask features near blobs t % 3 and
+			(t + 1) % 3
+		"""
+		super(Test_Clustering, self).setUp()
+		self.tmp_dir = tempfile.mkdtemp()
+		video = self.client.insert(Video, 'video_1', video_data, method='cp')
+		rng = np.random.RandomState(0)
+		for t in range(12):
+			frame = self.client.insert(Frame, 'frame_%02d' % t, frame_data, parent=video, method='cp')
+			frame['features'] = self.blobs[t % 3] + rng.randn(2) * 0.1
+			frame['mask_features'] = (self.blobs[[t % 3, (t + 1) % 3]] + rng.randn(2, 2) * 0.1).tolist()
+
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+
+	def same_partition(self, labels, truth):
+		"""
+			labels partition rows the same way truth does, up to renaming
+		"""
+		return len(set(zip(labels, truth))) == len(set(truth)) == len(set(labels))
+
+
+
+
+	################################################################################
+	####################[ CLUSTERING	]###########################################
+	################################################################################
+
+	def test_feature_stream(self):
+		"""
+			Clustering: FEATURE STREAM
+			--------------------------
+			streams rows in chunks, one per object or per mask
+		"""
+		chunks = list(FeatureStream(self.client, Frame, 'features', chunk_size=5))
+		self.assertEqual([len(keys) for keys, _ in chunks], [5, 5, 2])
+		self.assertEqual(chunks[0][0][0], 'video_1/frame_00')
+		self.assertEqual(chunks[2][1].shape, (2, 2))
+
+		keys, X = next(iter(FeatureStream(self.client, Frame, 'mask_features')))
+		self.assertEqual(keys[:2], [('video_1/frame_00', 0), ('video_1/frame_00', 1)])
+		self.assertEqual(X.shape, (24, 2))
+
+
+	def test_fit_and_assign(self):
+		"""
+			Clustering: FIT AND WRITE ASSIGNMENTS
+			-------------------------------------
+			recovers the blobs; assignments are written as memory items
+		"""
+		kmeans = MiniBatchKMeans(3, batch_size=4, workers=2, seed=1)
+		kmeans.fit(FeatureStream(self.client, Frame, 'features', chunk_size=6), epochs=5)
+		keys, labels = zip(*[(k, l) for keys, labels in kmeans.predict_stream(FeatureStream(self.client, Frame, 'features')) for k, l in zip(keys, labels)])
+		self.assertTrue(self.same_partition(labels, [t % 3 for t in range(12)]))
+
+		self.assertEqual(write_assignments(self.client, Frame, 'features', 'cluster_id', kmeans, batch_size=5), 12)
+		self.assertEqual(self.client.get(Frame, 'video_1/frame_04')['cluster_id'], labels[4])
+
+		self.assertEqual(write_assignments(self.client, Frame, 'mask_features', 'mask_cluster_ids', kmeans, chunk_size=5), 12)
+		mask_labels = self.client.get(Frame, 'video_1/frame_04')['mask_cluster_ids']
+		self.assertEqual(mask_labels, [labels[1], labels[2]])
+
+		#=====[ rewriting drops derived items and notifies listeners	]=====
+		self.client.add_item(Frame, 'cluster_name', {'kind':'derived', 'func':lambda c: 'cluster_%d' % c, 'inputs':['cluster_id']})
+		self.client.add_item(Frame, 'cluster_array', {'kind':'derived', 'func':lambda c: np.array([c]), 'inputs':['cluster_id'], 'mode':'disk', 'filename':'cluster.npy', 'format':'npy'})
+		frame = self.client.get(Frame, 'video_1/frame_04')
+		self.assertEqual(frame['cluster_name'], 'cluster_%d' % labels[4])
+		self.assertEqual(frame['cluster_array'][0], labels[4])
+		array_path = os.path.join(frame.root, 'cluster.npy')
+		self.assertTrue(os.path.exists(array_path))
+
+		class Listener(object):
+			updates = []
+			def on_update(self, datatype, _id, new_item_dict):
+				self.updates.append((_id, new_item_dict))
+		listener = Listener()
+		self.client.add_listener(listener)
+		self.assertEqual(write_assignments(self.client, Frame, 'features', 'cluster_id', kmeans, batch_size=5), 12)
+		self.assertEqual(len(listener.updates), 12)
+		self.assertEqual(dict(listener.updates)['video_1/frame_04']['cluster_id'], labels[4])
+		self.assertFalse(os.path.exists(array_path))
+		self.assertFalse('cluster_name' in self.client.get(Frame, 'video_1/frame_04').present_items)
+
+
+	def test_matrix_stream_and_checkpoint(self):
+		"""
+			Clustering: MEMMAP STREAM AND CHECKPOINTS
+			-----------------------------------------
+			clusters a .npy matrix; an interrupted fit resumes from its
+			checkpoint and ends where an uninterrupted one does, but
+			not from one of a differently chunked stream
+		"""
+		rng = np.random.RandomState(0)
+		truth = np.arange(300) % 3
+		path = os.path.join(self.tmp_dir, 'features.npy')
+		np.save(path, self.blobs[truth] + rng.randn(300, 2))
+		checkpoint_path = os.path.join(self.tmp_dir, 'kmeans.npz')
+
+		full = MiniBatchKMeans(3, batch_size=10).fit(MatrixStream(path, chunk_size=50), epochs=2)
+
+		class Interrupt(Exception):
+			pass
+		def interrupt(kmeans):
+			if kmeans.epoch == 1 and kmeans.n_batches == 20:
+				raise Interrupt()
+		kmeans = MiniBatchKMeans(3, batch_size=10, checkpoint_path=checkpoint_path, checkpoint_every=10)
+		assert_raises(Interrupt, kmeans.fit, MatrixStream(path, chunk_size=50), 2, interrupt)
+
+		resumed = MiniBatchKMeans(3, batch_size=10, checkpoint_path=checkpoint_path)
+		self.assertEqual((resumed.epoch, resumed.n_batches), (1, 20))
+		assert_raises(ValueError, resumed.fit, MatrixStream(path, chunk_size=60), 2)
+		resumed.fit(MatrixStream(path, chunk_size=50), epochs=2)
+		self.assertTrue(np.allclose(resumed.centroids, full.centroids))
+
+		labels = np.concatenate([l for _, l in resumed.predict_stream(MatrixStream(path))])
+		self.assertTrue(self.same_partition(labels, truth))
@@ -0,0 +1,89 @@
+'''
+Test: DataObjectView
+====================
+
+Description:
+------------
+	
+	Makes sure views read items like DataObjects do, and build 
+	the full DataObject only when written to
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import shutil
+import unittest
+import nose
+from copy import copy, deepcopy
+from nose.tools import *
+
+from ModalDB import Video, Frame
+from ModalDB.DataObjectView import DataObjectView
+from ModalDB.CompiledSchema import as_table
+
+from schema_example import schema_ex
+
+class Test_DataObjectView(unittest.TestCase):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	root = os.path.join(os.path.split(__file__)[0], 'data_ModalDicts')
+	image_path = os.path.join(root, 'image.png')
+	image_backup_path = os.path.join(root, 'image.backup.png')
+
+	def setUp(self):
+		shutil.copy(self.image_backup_path, self.image_path)
+		self.table = as_table(schema_ex[Frame])
+		self.mongo_doc = {	
+							'_id':'12345',
+							'root':self.root,
+							'items':{
+										'image':self.image_path,
+										'subtitles':'hello, world!'
+									},
+							'children':{}
+						}
+
+
+
+
+	################################################################################
+	####################[ ITEM ACCESS TESTS	]#######################################
+	################################################################################
+
+	def test_getitem(self):
+		"""
+			DataObjectView: GETITEM
+			-----------------------
+			reads disk and memory items without building a DataObject
+		"""
+		v = DataObjectView(Frame, deepcopy(self.mongo_doc), self.table, None)
+		self.assertEqual(v._id, '12345')
+		self.assertEqual(v['image'].shape, (512, 512, 3))
+		self.assertEqual(v['subtitles'], 'hello, world!')
+		self.assertEqual(v.present_items, set(['image', 'subtitles']))
+		self.assertTrue(v.dataobject is None)
+		assert_raises(KeyError, v.__getitem__, 'skeleton')
+
+
+	def test_setitem_promotes(self):
+		"""
+			DataObjectView: SETITEM
+			-----------------------
+			writing builds the full DataObject and goes through it
+		"""
+		v = DataObjectView(Frame, deepcopy(self.mongo_doc), self.table, None)
+		v['subtitles'] = 'konnichiwa, sekai!'
+		self.assertEqual(type(v.dataobject), Frame)
+		self.assertEqual(v['subtitles'], 'konnichiwa, sekai!')
+
+		v.rebind(deepcopy(self.mongo_doc))
+		self.assertTrue(v.dataobject is None)
+		self.assertEqual(v['subtitles'], 'hello, world!')
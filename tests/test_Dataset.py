@@ -0,0 +1,152 @@
+'''
+Test: Dataset
+=============
+
+Description:
+------------
+	
+	Tests indexing, shuffling, sharding and batching of Datasets
+	built through a ModalClient
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import time
+import tempfile
+import nose
+from nose.tools import *
+import numpy as np
+
+from ModalDB import *
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_Dataset(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	def setUp(self):
+		super(Test_Dataset, self).setUp()
+		video = self.client.insert(Video, 'video_1', video_data, method='cp')
+		for t in range(5):
+			self.client.insert(Frame, 'frame_%d' % t, frame_data, parent=video, method='cp')
+
+
+
+
+	################################################################################
+	####################[ Indexing	]###############################################
+	################################################################################
+
+	def test_indexing(self):
+		"""
+			Dataset: LENGTH AND INDEXING
+			----------------------------
+			indexes objects and items over a snapshot of ids
+		"""
+		dataset = self.client.dataset(Frame)
+		self.assertEqual(len(dataset), 5)
+		self.assertEqual(type(dataset[0]), Frame)
+		self.assertEqual(dataset[4]._id, 'video_1/frame_4')
+
+		dataset = self.client.dataset(Frame, items=['subtitles'], filter={'_id':'video_1/frame_2'})
+		self.assertEqual(len(dataset), 1)
+		self.assertEqual(dataset[0], {'subtitles':'hello, world!'})
+
+
+	def test_epoch_order(self):
+		"""
+			Dataset: EPOCH ORDER
+			--------------------
+			shuffles deterministically per epoch; shards are disjoint
+		"""
+		dataset = self.client.dataset(Frame)
+		self.assertEqual(list(dataset.epoch_order(3)), list(dataset.epoch_order(3)))
+		self.assertEqual(sorted(dataset.epoch_order(3)), range(5))
+		shards = [set(dataset.epoch_order(1, num_shards=2, shard_index=i)) for i in range(2)]
+		self.assertEqual(shards[0].union(shards[1]), set(range(5)))
+		self.assertEqual(len(shards[0].intersection(shards[1])), 0)
+
+
+
+
+	################################################################################
+	####################[ Batching	]###############################################
+	################################################################################
+
+	def test_iter_batches(self):
+		"""
+			Dataset: ITER BATCHES
+			---------------------
+			collates ndarray items into arrays, others into lists
+		"""
+		dataset = self.client.dataset(Frame, items=['image', 'subtitles'])
+		batches = list(dataset.iter_batches(2))
+		self.assertEqual(len(batches), 3)
+		self.assertEqual(batches[0]['image'].shape, (2, 512, 512, 3))
+		self.assertEqual(batches[0]['subtitles'], ['hello, world!'] * 2)
+		self.assertEqual(len(list(dataset.iter_batches(2, drop_last=True))), 2)
+
+
+	def test_iter_batches_workers(self):
+		"""
+			Dataset: ITER BATCHES WITH WORKERS
+			----------------------------------
+			worker processes yield the same batches, in order
+		"""
+		dataset = self.client.dataset(Frame, items=['subtitles', 'image'])
+		serial = list(dataset.iter_batches(2, epoch=1))
+		parallel = list(dataset.iter_batches(2, epoch=1, num_workers=2))
+		self.assertEqual(len(serial), len(parallel))
+		for a, b in zip(serial, parallel):
+			self.assertTrue((a['image'] == b['image']).all())
+
+		dataset = self.client.dataset(Frame)
+		frames = [f for batch in dataset.iter_batches(2, num_workers=2) for f in batch]
+		self.assertEqual(sorted([f._id for f in frames]), list(dataset.ids))
+		self.assertEqual(frames[0]['subtitles'], 'hello, world!')
+
+
+	def test_dead_worker(self):
+		"""
+			Dataset: DEAD WORKER
+			--------------------
+			a worker dying mid-epoch raises instead of blocking forever
+		"""
+		dataset = self.client.dataset(Frame)
+		dataset.load_batch = lambda ixs: os._exit(1)
+		batches = dataset.iter_parallel([[0], [1]], 1, 1, poll_interval=0.1)
+		assert_raises(Exception, list, batches)
+
+
+	def test_prefetch_bound(self):
+		"""
+			Dataset: PREFETCH BOUND
+			-----------------------
+			while one batch is slow, workers run at most
+			prefetch * num_workers batches ahead of it
+		"""
+		log_path = tempfile.mktemp()
+		def load_batch(ixs):
+			with open(log_path, 'a') as f:
+				f.write('%d\n' % ixs[0])
+			if ixs[0] == 0:
+				time.sleep(0.5)
+			return ixs[0]
+		dataset = self.client.dataset(Frame)
+		dataset.load_batch = load_batch
+		try:
+			batches = dataset.iter_parallel([[k] for k in range(10)], 2, 1)
+			self.assertEqual(next(batches), 0)
+			self.assertTrue(len(open(log_path).read().split()) <= 3)
+			self.assertEqual(list(batches), range(1, 10))
+		finally:
+			os.remove(log_path)
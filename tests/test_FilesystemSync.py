@@ -0,0 +1,158 @@
+'''
+Test: FilesystemSync
+====================
+
+Description:
+------------
+	
+	Tests incremental syncing of mongodb with the filesystem
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import time
+import shutil
+import nose
+from nose.tools import *
+
+from ModalDB import *
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_FilesystemSync(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	def setUp(self):
+		"""
+			inserts video_1 with 3 frames, then syncs once
+		"""
+		super(Test_FilesystemSync, self).setUp()
+		self.video = self.client.insert(Video, 'video_1', video_data, method='cp')
+		for t in range(3):
+			self.client.insert(Frame, 'frame_%d' % t, frame_data, parent=self.video, method='cp')
+		self.frames_dir = self.video.get_child_dir(Frame)
+		self.client.sync()
+
+
+
+
+	################################################################################
+	####################[ SYNC	]###################################################
+	################################################################################
+
+	def test_sync_unchanged(self):
+		"""
+			FilesystemSync: UNCHANGED
+			-------------------------
+			a second sync changes nothing
+		"""
+		stats = self.client.sync()
+		self.assertEqual(stats['Frame'], {'inserted':0, 'updated':0, 'deleted':0, 'unchanged':3})
+		self.assertEqual(stats['Video'], {'inserted':0, 'updated':0, 'deleted':0, 'unchanged':1})
+
+
+	def test_sync_changes(self):
+		"""
+			FilesystemSync: INSERTS, UPDATES AND DELETES
+			--------------------------------------------
+			applies only the differences
+		"""
+		shutil.copytree(os.path.join(self.frames_dir, 'frame_0'), os.path.join(self.frames_dir, 'frame_3'))
+		shutil.rmtree(os.path.join(self.frames_dir, 'frame_1'))
+		os.remove(os.path.join(self.frames_dir, 'frame_2', 'image.png'))
+
+		stats = self.client.sync(workers=2)
+		self.assertEqual(stats['Frame'], {'inserted':1, 'updated':1, 'deleted':1, 'unchanged':1})
+
+		video = self.client.get(Video, 'video_1')
+		self.assertEqual(sorted(video.children.get_childtype_dict(Frame).keys()), ['frame_0', 'frame_2', 'frame_3'])
+		self.assertEqual(video.get_child('frame_3')['image'].shape, (512, 512, 3))
+		self.assertFalse('image' in video.get_child('frame_2').present_items)
+		assert_raises(KeyError, self.client.get, Frame, 'video_1/frame_1')
+
+
+	def test_sync_new_video(self):
+		"""
+			FilesystemSync: NEW VIDEO
+			-------------------------
+			a new video directory is inserted with its frames
+		"""
+		shutil.copytree(self.video.root, os.path.join(data_dir, 'Video', 'video_2'))
+		stats = self.client.sync()
+		self.assertEqual(stats['Video']['inserted'], 1)
+		self.assertEqual(stats['Frame']['inserted'], 3)
+		self.assertEqual(len(self.client.get(Video, 'video_2').children.get_childtype_dict(Frame)), 3)
+
+
+	def test_sync_invalidates_derived(self):
+		"""
+			FilesystemSync: DERIVED ITEMS
+			-----------------------------
+			derived items of changed files are dropped
+		"""
+		self.client.add_item(Frame, 'side', {'kind':'derived', 'func':lambda image: image.shape[0], 'inputs':['image']})
+		self.client.add_item(Frame, 'first_row', {'kind':'derived', 'func':lambda image: image[0], 'inputs':['image'], 'mode':'disk', 'filename':'first_row.npy', 'format':'npy'})
+		for t in range(2):
+			frame = self.client.get(Frame, 'video_1/frame_%d' % t)
+			self.assertEqual(frame['side'], 512)
+			self.assertEqual(frame['first_row'].shape, (512, 3))
+		self.client.sync()
+
+		image_path = os.path.join(self.frames_dir, 'frame_0', 'image.png')
+		os.utime(image_path, (time.time() + 10, time.time() + 10))
+		stats = self.client.sync()
+		self.assertEqual(stats['Frame']['updated'], 1)
+		self.assertEqual(self.client.get(Frame, 'video_1/frame_0').present_items, set(['image', 'subtitles']))
+		self.assertFalse(os.path.exists(os.path.join(self.frames_dir, 'frame_0', 'first_row.npy')))
+		self.assertTrue('side' in self.client.get(Frame, 'video_1/frame_1').present_items)
+
+
+	def test_sync_keeps_fresh_derived(self):
+		"""
+			FilesystemSync: FRESH DERIVED ITEMS
+			-----------------------------------
+			derived files computed on never-synced objects, or after
+			their inputs were rewritten through the client, are kept
+		"""
+		self.client.add_item(Frame, 'first_row', {'kind':'derived', 'func':lambda image: image[0], 'inputs':['image'], 'mode':'disk', 'filename':'first_row.npy', 'format':'npy'})
+		frame = self.client.insert(Frame, 'frame_new', frame_data, parent=self.video, method='cp')
+		self.assertEqual(frame['first_row'].shape, (512, 3))
+		first_row_path = os.path.join(frame.root, 'first_row.npy')
+
+		self.client.sync()
+		self.assertTrue(os.path.exists(first_row_path))
+		self.assertTrue('first_row' in self.client.get(Frame, 'video_1/frame_new').present_items)
+
+		frame = self.client.get(Frame, 'video_1/frame_new')
+		frame['image'] = frame['image'][::2, ::2]
+		self.assertEqual(frame['first_row'].shape, (256, 3))
+		self.client.sync()
+		self.assertTrue(os.path.exists(first_row_path))
+		self.assertEqual(self.client.get(Frame, 'video_1/frame_new')['first_row'].shape, (256, 3))
+
+
+	def test_sync_baselines_inserted(self):
+		"""
+			FilesystemSync: INSERTED THROUGH THE CLIENT
+			-------------------------------------------
+			objects inserted without a 'stat' only get one recorded;
+			their derived items are kept
+		"""
+		self.client.add_item(Frame, 'side', {'kind':'derived', 'func':lambda image: image.shape[0], 'inputs':['image']})
+		frame = self.client.insert(Frame, 'frame_new', frame_data, parent=self.video, method='cp')
+		self.assertEqual(frame['side'], 512)
+
+		stats = self.client.sync()
+		self.assertEqual(stats['Frame'], {'inserted':0, 'updated':0, 'deleted':0, 'unchanged':4})
+		self.assertTrue('side' in self.client.get(Frame, 'video_1/frame_new').present_items)
+		self.assertTrue('stat' in self.client.get_collection(Frame).find_one({'_id':'video_1/frame_new'}))
+		self.assertEqual(self.client.sync()['Frame']['unchanged'], 4)
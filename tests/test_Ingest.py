@@ -0,0 +1,98 @@
+'''
+Test: Ingest
+============
+
+Description:
+------------
+	
+	Tests journaled ingestion, including resuming after a crash
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import nose
+from nose.tools import *
+
+from ModalDB import *
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_Ingest(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	journal_path = os.path.join(data_dir, 'ingest_journal.tmp')
+
+	def setUp(self):
+		super(Test_Ingest, self).setUp()
+
+	def tearDown(self):
+		if os.path.exists(self.journal_path):
+			os.remove(self.journal_path)
+
+
+	def ingest_all(self, ingestor):
+		video = ingestor.ingest(Video, 'video_1', video_data)
+		for t in range(3):
+			ingestor.ingest(Frame, 'frame_%d' % t, frame_data, parent=video)
+
+
+
+
+	################################################################################
+	####################[ INGESTION	]###############################################
+	################################################################################
+
+	def test_ingest(self):
+		"""
+			Ingest: INGEST AND JOURNAL
+			--------------------------
+			inserts objects, journaling each
+		"""
+		reports = []
+		with self.client.ingestor(self.journal_path, report_every=2, callback=reports.append) as ingestor:
+			self.ingest_all(ingestor)
+		self.assertEqual(ingestor.stats()['inserted'], 4)
+		self.assertEqual(len(reports), 2)
+		self.assertEqual(len(open(self.journal_path).readlines()), 4)
+		self.assertEqual(len(self.client.get(Video, 'video_1').children.get_childtype_dict(Frame)), 3)
+
+
+	def test_resume(self):
+		"""
+			Ingest: RESUME
+			--------------
+			rerunning skips journaled objects, and objects inserted 
+			but not journaled before a crash
+		"""
+		with self.client.ingestor(self.journal_path) as ingestor:
+			video = ingestor.ingest(Video, 'video_1', video_data)
+			ingestor.ingest(Frame, 'frame_0', frame_data, parent=video)
+
+		#=====[ crash after inserting frame_1, before journaling it	]=====
+		self.client.insert(Frame, 'frame_1', frame_data, parent=self.client.get(Video, 'video_1'), method='cp')
+
+		with self.client.ingestor(self.journal_path) as ingestor:
+			self.ingest_all(ingestor)
+		self.assertEqual(ingestor.stats()['skipped'], 3)
+		self.assertEqual(ingestor.stats()['inserted'], 1)
+		self.assertEqual(sorted([f._id for f in self.client.iter(Frame)]), ['video_1/frame_0', 'video_1/frame_1', 'video_1/frame_2'])
+		self.assertEqual(len(open(self.journal_path).readlines()), 4)
+
+		#=====[ all journaled: nothing loaded unless used	]=====
+		with self.client.ingestor(self.journal_path) as ingestor:
+			video = ingestor.ingest(Video, 'video_1', video_data)
+			frame = ingestor.ingest(Frame, 'frame_0', frame_data, parent=video)
+			self.assertTrue(video.dataobject is None and frame.dataobject is None)
+			self.assertEqual(frame['subtitles'], 'hello, world!')
+			ingestor.ingest(Frame, 'frame_3', frame_data, parent=video)
+			self.assertFalse(video.dataobject is None)
+		self.assertEqual(len(self.client.get(Video, 'video_1').children.get_childtype_dict(Frame)), 4)
@@ -27,8 +27,11 @@ from nose.tools import *
 import numpy as np
 from scipy.io import loadmat, savemat
 from scipy.misc import imsave, imread
+from pymongo import MongoClient
 
 from ModalDB import *
+from ModalDB.DataObject import find_client
+from ModalDB.BackgroundJobs import BackfillJob
 
 from schema_example import schema_ex
 from dataobject_example import video_data, frame_data, data_dir
@@ -52,6 +55,7 @@ class Test_ModalSchema(unittest.TestCase):
 
 	def reset_filesystem(self):
 		shutil.rmtree(os.path.join(data_dir, 'Video'))
+		shutil.rmtree(os.path.join(data_dir, '.ModalDB_trash'), ignore_errors=True)
 
 	def reset(self):
 		self.reset_images()
@@ -185,6 +189,36 @@ class Test_ModalSchema(unittest.TestCase):
 		self.assertFalse(os.path.exists(os.path.join(data_dir, 'Video/test_video/')))
 
 
+	def test_recursive_deletion(self):
+		"""
+			RECURSIVE DELETION OF VIDEO
+			---------------------------
+			deleting a video removes its frames' docs and, in the 
+			background, its directory; failures are reported
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir)
+		client.clear_db()
+		video = client.insert(Video, 'test_video', self.video_data, method='cp')
+		client.insert(Frame, 'frame_1', self.frame_data, parent=video, method='cp')
+		client.insert(Frame, 'frame_2', self.frame_data, parent=video, method='cp')
+		other = client.insert(Video, 'test_video_2', self.video_data, method='cp')
+		client.insert(Frame, 'frame_1', self.frame_data, parent=other, method='cp')
+
+		client.delete(Video, 'test_video')
+		self.assertFalse(os.path.exists(os.path.join(data_dir, 'Video/test_video/')))
+		self.assertEqual([f._id for f in client.iter(Frame)], ['test_video_2/frame_1'])
+		assert_raises(KeyError, client.get, Frame, 'test_video/frame_1')
+
+		client.wait_for_deletes()
+		self.assertEqual(os.listdir(os.path.join(data_dir, '.ModalDB_trash')), [])
+
+		#=====[ failed removals are reported	]=====
+		client.get_deleter().queue.put(os.path.join(data_dir, '.ModalDB_trash', 'missing'))
+		assert_raises(Exception, client.wait_for_deletes)
+		client.wait_for_deletes()
+
+
 
 	def test_get_basic(self):
 		"""
@@ -313,6 +347,205 @@ class Test_ModalSchema(unittest.TestCase):
 
 
 
+	def test_iter_descendants(self):
+		"""
+			ModalClient: ITERATING/COUNTING DESCENDANTS
+			-------------------------------------------
+			finds objects nested under one or more ancestors, and 
+			nothing under ancestors sharing a prefix
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir)
+		client.clear_db()
+		videos = [client.insert(Video, name, self.video_data, method='cp') for name in ['video_1', 'video_10', 'video_2']]
+		for video in videos:
+			for t in range(2):
+				client.insert(Frame, 'frame_%d' % t, self.frame_data, parent=video, method='cp')
+
+		self.assertEqual([f._id for f in client.iter_descendants(videos[0], Frame)], ['video_1/frame_0', 'video_1/frame_1'])
+		self.assertEqual(client.count_descendants('video_1', Frame), 2)
+		self.assertEqual(client.count_descendants(videos[1:], Frame), 4)
+		self.assertEqual([f._id for f in client.iter_descendants(['video_2', 'video_10'], Frame, view=True)][0], 'video_10/frame_0')
+		self.assertEqual(client.count_descendants(videos[0], Video), 0)
+
+
+	def test_count_coverage(self):
+		"""
+			ModalClient: COUNTS AND ITEM COVERAGE
+			-------------------------------------
+			counts objects and present/absent items server-side
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir)
+		client.clear_db()
+		videos = [client.insert(Video, name, self.video_data, method='cp') for name in ['video_1', 'video_2']]
+		client.insert(Frame, 'frame_0', self.frame_data, parent=videos[0], method='cp')
+		client.insert(Frame, 'frame_1', {'subtitles':'hi'}, parent=videos[0], method='cp')
+		client.insert(Frame, 'frame_0', {}, parent=videos[1], method='cp')
+
+		self.assertEqual(client.count(Frame), 3)
+		self.assertEqual(client.count(Frame, where={'parent':'video_1'}), 2)
+
+		coverage = client.coverage(Frame)
+		self.assertEqual(coverage['total'], 3)
+		self.assertEqual(coverage['items']['image'], {'present':1, 'absent':2})
+		self.assertEqual(coverage['items']['subtitles']['present'], 2)
+
+		by_parent = client.coverage(Frame, by_parent=True)
+		self.assertEqual(by_parent['video_2']['items']['subtitles'], {'present':0, 'absent':1})
+		self.assertEqual(by_parent['video_1']['total'], 2)
+
+
+	def test_iter_view(self):
+		"""
+			ModalClient: ITERATION THROUGH FRAME VIEWS
+			------------------------------------------
+			iterates through all frames as views, then as a flyweight
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir)
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		client.insert(Frame, 'frame_1', self.frame_data, parent=video, method='cp')
+		client.insert(Frame, 'frame_2', self.frame_data, parent=video, method='cp')
+
+		views = list(client.iter(Frame, view=True))
+		self.assertEqual(sorted([v._id for v in views]), ['video_1/frame_1', 'video_1/frame_2'])
+		self.assertEqual(views[0]['image'].shape, (512, 512, 3))
+
+		ids = []
+		for frame in client.iter(Frame, view=True, flyweight=True):
+			ids.append(frame._id)
+			self.assertEqual(frame['subtitles'], 'hello, world!')
+		self.assertEqual(sorted(ids), ['video_1/frame_1', 'video_1/frame_2'])
+
+
+
+	def test_instrumentation(self):
+		"""
+			ModalClient: INSTRUMENTATION
+			----------------------------
+			counts mongodb calls (find when consumed) and disk loads 
+			while enabled
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir)
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		client.insert(Frame, 'frame_1', self.frame_data, parent=video, method='cp')
+		client.insert(Frame, 'frame_2', self.frame_data, parent=video, method='cp')
+		self.assertEqual(client.stats(), {})
+
+		events = []
+		client.instrument(callback=lambda *args: events.append(args))
+		video = client.get(Video, 'video_1')
+		for frame in video.iter_children():
+			frame['image']
+
+		stats = client.stats()
+		self.assertEqual(stats['mongo.find_one']['Frame']['count'], 2)
+		self.assertEqual(stats['disk_load']['Frame.image']['count'], 2)
+		self.assertTrue(stats['disk_load']['Frame.image']['bytes'] > 0)
+		self.assertEqual(len(events), 5)
+
+		#=====[ find is recorded once its cursor is consumed	]=====
+		cursor = client.get_collection(Frame).find().sort('_id', 1)
+		self.assertEqual(len(events), 5)
+		self.assertEqual([d['_id'] for d in cursor], ['video_1/frame_1', 'video_1/frame_2'])
+		self.assertEqual(events[-1][:2], ('mongo.find', 'Frame'))
+		self.assertEqual(len(events), 6)
+
+		client.instrument(False)
+		client.get(Video, 'video_1')
+		self.assertEqual(client.stats(), {})
+
+
+
+	def test_pickle_dataobject(self):
+		"""
+			ModalClient: PICKLING DATAOBJECTS
+			---------------------------------
+			DataObjects pickle as (datatype, _id, mongo_doc, database
+			key) and rebind to this process's client of that database
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir)
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		frame = client.insert(Frame, 'frame_1', self.frame_data, parent=video, method='cp')
+
+		frame = pickle.loads(pickle.dumps(client.get(Frame, 'video_1/frame_1')))
+		self.assertEqual(type(frame), Frame)
+		self.assertEqual(frame._id, 'video_1/frame_1')
+		self.assertEqual(frame['subtitles'], 'hello, world!')
+		self.assertEqual(frame['image'].shape, (512, 512, 3))
+		video = pickle.loads(pickle.dumps(video))
+		self.assertEqual(video.get_child('frame_1')._id, 'video_1/frame_1')
+
+		#=====[ another database under the same root	]=====
+		other = ModalClient(root=data_dir, mongo_client=MongoClient())
+		self.assertEqual(pickle.loads(pickle.dumps(frame)).client.database_key(), client.database_key())
+		other_frame = Frame(frame.to_mongo_doc(), other.get_schema(Frame), other)
+		self.assertTrue(pickle.loads(pickle.dumps(other_frame)).client is other)
+		assert_raises(Exception, find_client, frame.root)
+
+
+	def test_reconnect_after_fork(self):
+		"""
+			ModalClient: RECONNECT AFTER FORK
+			---------------------------------
+			a client used from a different pid reconnects
+		"""
+		client = ModalClient(root=data_dir)
+		old_mongo_client = client.mongo_client
+		self.assertTrue(client.mongo_client is old_mongo_client)
+		client.pid = -1
+		client.db
+		self.assertFalse(client.mongo_client is old_mongo_client)
+
+
+
+	def test_snapshot(self):
+		"""
+			ModalClient: EXPORTING AND OPENING SNAPSHOTS
+			--------------------------------------------
+			serves get, iter and children from a snapshot
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir)
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		client.insert(Frame, 'frame_1', self.frame_data, parent=video, method='cp')
+		client.insert(Frame, 'frame_2', self.frame_data, parent=video, method='cp')
+
+		snapshot_path = os.path.join(data_dir, 'snapshot.tmp')
+		client.export_snapshot(snapshot_path)
+		try:
+			snapshot_client = ModalClient.open_snapshot(snapshot_path)
+			video = snapshot_client.get(Video, 'video_1')
+			self.assertEqual(video['summary'], 'hello, world!')
+			frame = video.get_child('frame_2')
+			self.assertEqual(frame['image'].shape, (512, 512, 3))
+			self.assertEqual(sorted([f._id for f in snapshot_client.iter(Frame)]), ['video_1/frame_1', 'video_1/frame_2'])
+			self.assertEqual(len(snapshot_client.get_many(Frame, ['video_1/frame_2', 'video_1/frame_1'])), 2)
+			assert_raises(KeyError, snapshot_client.get, Frame, 'video_1/frame_3')
+			self.assertEqual([f._id for f in snapshot_client.iter_descendants(video, Frame)], ['video_1/frame_1', 'video_1/frame_2'])
+
+			#=====[ cursors: sorting by _id, skip/limit without materializing	]=====
+			frames = snapshot_client.get_collection(Frame)
+			in_query = {'_id':{'$in':['video_1/frame_2', 'video_1/frame_1']}}
+			self.assertEqual([d['_id'] for d in frames.find(in_query).sort('_id', 1)], ['video_1/frame_1', 'video_1/frame_2'])
+			self.assertEqual([d['_id'] for d in frames.find(in_query).sort('_id', -1)], ['video_1/frame_2', 'video_1/frame_1'])
+			self.assertEqual([d['_id'] for d in frames.find().sort('_id', -1).skip(1)], ['video_1/frame_1'])
+			cursor = frames.find().skip(1).limit(1)
+			self.assertEqual(type(cursor.positions), xrange)
+			self.assertEqual([d['_id'] for d in cursor], ['video_1/frame_2'])
+			self.assertEqual(type(snapshot_client.get_random(Frame)), Frame)
+		finally:
+			os.remove(snapshot_path)
+
+
+
 	################################################################################
 	####################[ ADDING/REMOVING ITEMS	]###################################
 	################################################################################
@@ -368,3 +601,208 @@ class Test_ModalSchema(unittest.TestCase):
 
 
 
+
+
+	def test_delete_item_purge(self):
+		"""
+			ModalClient: PURGING DELETED ITEMS
+			----------------------------------
+			deleting an item removes its files and its entries in 
+			mongo_docs, in the background, notifying listeners
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir, schema=ModalSchema(deepcopy(schema_ex)))
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		for name in ['frame_1', 'frame_2', 'frame_3']:
+			client.insert(Frame, name, self.frame_data, parent=video, method='cp')
+		client.add_item(Frame, 'skeleton', {'mode':'disk', 'filename':'skeleton.npy', 'format':'npy'})
+		for frame in client.iter(Frame):
+			frame['skeleton'] = np.zeros(3)
+		skeleton_path = os.path.join(video.get_child('frame_1').root, 'skeleton.npy')
+		self.assertTrue(os.path.exists(skeleton_path))
+
+		class Listener(object):
+			updates = []
+			def on_update(self, datatype, _id, new_item_dict):
+				self.updates.append((_id, new_item_dict))
+		client.add_listener(Listener())
+
+		progress = []
+		job = client.delete_item(Frame, 'skeleton', now=False, callback=lambda j: progress.append(j.done))
+		job.wait()
+		self.assertEqual(job.progress(), {'done':3, 'total':3})
+		self.assertEqual(progress, [3])
+		self.assertEqual(sorted(_id for _id, items in Listener.updates if not 'skeleton' in items), ['video_1/frame_1', 'video_1/frame_2', 'video_1/frame_3'])
+		self.assertFalse(os.path.exists(skeleton_path))
+		self.assertEqual(client.get_collection(Frame).count_documents({'items.skeleton':{'$exists':True}}), 0)
+		self.assertFalse('skeleton' in client.get(Frame, 'video_1/frame_1').present_items)
+
+
+	def test_add_item_backfill(self):
+		"""
+			ModalClient: BACKFILLING ADDED ITEMS
+			------------------------------------
+			adding an item with a backfill function computes it for
+			all existing objects, notifying listeners
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir, schema=ModalSchema(deepcopy(schema_ex)))
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		for name in ['frame_1', 'frame_2', 'frame_3']:
+			client.insert(Frame, name, self.frame_data, parent=video, method='cp')
+
+		class Listener(object):
+			updates = []
+			def on_update(self, datatype, _id, new_item_dict):
+				self.updates.append((_id, new_item_dict))
+		client.add_listener(Listener())
+
+		skip = lambda frame: None if frame._id.endswith('3') else frame
+		job = client.add_item(Frame, 'n_pixels', {'mode':'memory'}, backfill=lambda frame: skip(frame) and frame['image'].size, workers=2)
+		self.assertEqual(list(job.skipped_ids()), ['video_1/frame_3'])
+		self.assertEqual(job.n_skipped, 1)
+		self.assertEqual(sorted(_id for _id, items in Listener.updates if 'n_pixels' in items), ['video_1/frame_1', 'video_1/frame_2'])
+		client.add_item(Frame, 'mean', {'mode':'disk', 'filename':'mean.npy', 'format':'npy'}, backfill=lambda frame: frame['image'].mean(axis=(0, 1)))
+
+		job = client.add_item(Frame, 'side', {'mode':'memory'}, backfill=lambda frame: frame['image'].shape[0], now=False)
+		job.wait()
+		self.assertEqual(job.progress(), {'done':3, 'total':3})
+
+		frame_1, frame_3 = client.get(Frame, 'video_1/frame_1'), client.get(Frame, 'video_1/frame_3')
+		self.assertEqual(frame_1['n_pixels'], 512 * 512 * 3)
+		self.assertTrue(frame_3['n_pixels'] is None)
+		self.assertEqual(frame_3['mean'].shape, (3,))
+		self.assertEqual(frame_3['side'], 512)
+
+
+	def test_backfill_resume(self):
+		"""
+			ModalClient: RESUMING BACKFILLS
+			-------------------------------
+			a backfill interrupted by an error resumes after the last
+			batch written, without revisiting skipped objects
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir, schema=ModalSchema(deepcopy(schema_ex)))
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		for name in ['frame_1', 'frame_2', 'frame_3']:
+			client.insert(Frame, name, self.frame_data, parent=video, method='cp')
+		client.add_item(Frame, 'name', {'mode':'memory'})
+
+		calls = []
+		def name(frame):
+			calls.append(frame._id)
+			if frame._id.endswith('3') and len(calls) < 4:
+				raise Exception("interrupted")
+			return None if frame._id.endswith('1') else frame._id
+		assert_raises(Exception, BackfillJob(client, Frame, 'name', name, batch_size=1).run)
+
+		job = BackfillJob(client, Frame, 'name', name, batch_size=1)
+		job.run()
+		self.assertEqual(calls, ['video_1/frame_1', 'video_1/frame_2', 'video_1/frame_3', 'video_1/frame_3'])
+		self.assertEqual(list(job.skipped_ids()), ['video_1/frame_1'])
+		self.assertEqual(job.progress(), {'done':1, 'total':1})
+		self.assertEqual(client.get(Frame, 'video_1/frame_3')['name'], 'video_1/frame_3')
+
+
+	def test_write_behind(self):
+		"""
+			ModalClient: WRITE-BEHIND DISK ITEMS
+			------------------------------------
+			disk item saves are queued; new items are recorded in
+			mongodb once flushed, with no temporary files left over
+		"""
+		self.reset()
+		client = ModalClient(root=data_dir, schema=ModalSchema(deepcopy(schema_ex)))
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		client.insert(Frame, 'frame_1', self.frame_data, parent=video, method='cp')
+		client.add_item(Frame, 'mean', {'mode':'disk', 'filename':'mean.npy', 'format':'npy'})
+		frame = client.get(Frame, 'video_1/frame_1')
+
+		class Listener(object):
+			updates = []
+			def on_update(self, datatype, _id, new_item_dict):
+				self.updates.append(_id)
+		client.add_listener(Listener())
+
+		client.write_behind(workers=2)
+		for i in range(5):
+			frame['mean'] = np.ones(3) * i
+		frame['image'] = np.zeros((4, 4, 3), dtype=np.uint8)
+		self.assertEqual(frame['mean'][0], 4)
+		client.flush()
+
+		reloaded = client.get(Frame, 'video_1/frame_1')
+		self.assertTrue('mean' in reloaded.present_items)
+		self.assertEqual(reloaded['mean'][0], 4)
+		self.assertEqual(reloaded['image'].shape, (4, 4, 3))
+		self.assertEqual([f for f in os.listdir(frame.root) if f.startswith('.tmp')], [])
+
+		#=====[ listeners hear of overwrites once written	]=====
+		del Listener.updates[:]
+		frame['mean'] = np.ones(3) * 5
+		client.flush()
+		self.assertEqual(Listener.updates, ['video_1/frame_1'])
+
+		#=====[ a failed save leaves a new item absent	]=====
+		def fail(x, path):
+			raise IOError("disk full")
+		client.add_item(Frame, 'broken', {'mode':'disk', 'filename':'broken.pkl', 'load_func':lambda p: pickle.load(open(p, 'r')), 'save_func':fail})
+		frame = client.get(Frame, 'video_1/frame_1')
+		frame['broken'] = 1
+		assert_raises(Exception, client.flush)
+		self.assertFalse('broken' in frame.present_items)
+		self.assertTrue(frame['broken'] is None)
+		self.assertFalse('broken' in client.get(Frame, 'video_1/frame_1').present_items)
+		self.assertEqual([f for f in os.listdir(frame.root) if f.startswith('.tmp')], [])
+		client.close()
+		self.assertTrue(client.writer is None)
+
+
+	def test_derived_items(self):
+		"""
+			ModalClient: DERIVED ITEMS
+			--------------------------
+			derived items are computed and stored on first access,
+			invalidated by writes to their inputs, and precomputed in bulk
+		"""
+		self.reset()
+		calls = []
+		def mean_color(image):
+			calls.append(1)
+			return image.mean(axis=(0, 1))
+		schema = deepcopy(schema_ex)
+		schema[Frame]['mean_color'] = {'kind':'derived', 'func':mean_color, 'inputs':['image'], 'mode':'disk', 'filename':'mean_color.npy', 'format':'npy'}
+		schema[Frame]['brightness'] = {'kind':'derived', 'func':lambda c: float(c.mean()), 'inputs':['mean_color']}
+		client = ModalClient(root=data_dir, schema=ModalSchema(schema))
+		client.clear_db()
+		video = client.insert(Video, 'video_1', self.video_data, method='cp')
+		for name in ['frame_1', 'frame_2', 'frame_3']:
+			client.insert(Frame, name, self.frame_data, parent=video, method='cp')
+
+		#=====[ computed once, then stored	]=====
+		frame = client.get(Frame, 'video_1/frame_1')
+		brightness = frame['brightness']
+		self.assertEqual(len(calls), 1)
+		frame = client.get(Frame, 'video_1/frame_1')
+		self.assertEqual(frame.present_items, set(['image', 'subtitles', 'mean_color', 'brightness']))
+		self.assertEqual(frame['brightness'], brightness)
+		self.assertEqual(list(client.iter(Frame, view=True))[0]['brightness'], brightness)
+		self.assertEqual(len(calls), 1)
+
+		#=====[ writing an input drops everything derived from it	]=====
+		frame['image'] = np.zeros((4, 4, 3), dtype=np.uint8)
+		self.assertFalse(os.path.exists(os.path.join(frame.root, 'mean_color.npy')))
+		self.assertEqual(client.get(Frame, 'video_1/frame_1').present_items, set(['image', 'subtitles']))
+		self.assertEqual(client.get(Frame, 'video_1/frame_1')['brightness'], 0.0)
+
+		#=====[ precomputed in bulk	]=====
+		job = client.precompute(Frame, 'mean_color', workers=2)
+		self.assertEqual(job.progress(), {'done':2, 'total':2})
+		self.assertTrue(os.path.exists(os.path.join(client.get(Frame, 'video_1/frame_3').root, 'mean_color.npy')))
+		self.assertEqual(len(calls), 4)
+		assert_raises(KeyError, client.precompute, Frame, 'image')
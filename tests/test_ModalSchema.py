@@ -175,6 +175,33 @@ class Test_ModalSchema(unittest.TestCase):
 		self.assertFalse('depth_image' in schema.schema_dict[Frame])
 
 
+	################################################################################
+	####################[ Compiled Tables	]#######################################
+	################################################################################
+
+	def test_compiled_tables(self):
+		"""
+			COMPILED TABLES
+			---------------
+			per-datatype tables reflect the schema and its modifications
+		"""
+		schema = ModalSchema(deepcopy(self.schema_ex))
+		self.assertEqual(schema.root_types, frozenset([Video]))
+		frame_table = schema.table(Frame)
+		self.assertEqual(frame_table.items_by_mode['disk'], frozenset(['image']))
+		self.assertEqual(frame_table.filenames, {'image':'image.png'})
+		self.assertEqual(frame_table.item_names, ('image', 'subtitles'))
+		self.assertEqual(frame_table['subtitles']['mode'], 'memory')
+		self.assertTrue(schema.table(Video).is_root)
+		self.assertEqual(schema.table(Video)['contains'], [Frame])
+		assert_raises(AttributeError, setattr, frame_table, 'is_root', True)
+
+		schema.add_item(Frame, 'depth_image', {'mode':'memory'})
+		self.assertTrue('depth_image' in schema.table(Frame).item_set)
+		self.assertFalse('depth_image' in frame_table.item_set)
+
+
+
 	
 	################################################################################
 	####################[ Load and Save	]###########################################
@@ -195,5 +222,83 @@ class Test_ModalSchema(unittest.TestCase):
 		os.remove('./tests/schema_temp.pkl')
 
 
+	def test_declarative_load_save(self):
+		"""
+			DECLARATIVE LOADING AND SAVING
+			------------------------------
+			formats and dotted names resolve to functions; schemas 
+			without lambdas round-trip through JSON
+		"""
+		from ModalDB.Formats import get_format, load_npy, save_npy
+		schema = ModalSchema({
+								'ModalDB.Frame.Frame':{
+											'image':{'mode':'disk', 'filename':'image.png', 'format':'png'},
+											'features':{'mode':'disk', 'filename':'features.npy', 'load_func':'ModalDB.Formats.load_npy', 'save_func':'ModalDB.Formats.save_npy'},
+											'subtitles':{'mode':'memory'}
+										},
+								'ModalDB.Video.Video':{
+											'summary':{'mode':'memory'},
+											'contains':['ModalDB.Frame.Frame']
+										}
+							})
+		self.assertEqual(schema.table(Frame).load_funcs['image'], get_format('png')[0])
+		self.assertEqual(schema.table(Frame).save_funcs['features'], save_npy)
+		self.assertEqual(schema.table(Video).childtypes, (Frame,))
+		self.assertTrue(schema.is_declarative())
+
+		schema.save('./tests/schema_temp.json')
+		try:
+			loaded = ModalSchema('./tests/schema_temp.json')
+			self.assertEqual(loaded.table(Frame).load_funcs['features'], load_npy)
+			self.assertEqual(loaded.schema_dict[Frame]['image']['format'], 'png')
+			self.assertEqual(loaded.to_declarative(), schema.to_declarative())
+
+			#=====[ cached parse; copies are independent	]=====
+			loaded.delete_item(Frame, 'subtitles')
+			self.assertTrue('subtitles' in ModalSchema('./tests/schema_temp.json').table(Frame).item_set)
+		finally:
+			os.remove('./tests/schema_temp.json')
+
+		#=====[ lambdas can't be saved declaratively	]=====
+		schema = ModalSchema(deepcopy(self.schema_ex))
+		self.assertFalse(schema.is_declarative())
+		assert_raises(TypeError, schema.save, './tests/schema_temp.json')
+
+
 
 
+
+
+	def test_derived_items(self):
+		"""
+			DERIVED ITEMS
+			-------------
+			derived items need a func and existing inputs, without
+			cycles; dependents are transitive
+		"""
+		schema_dict = deepcopy(self.schema_ex)
+		schema_dict[Frame]['side'] = {'kind':'derived', 'func':lambda image: image.shape[0], 'inputs':['image']}
+		schema_dict[Frame]['half'] = {'kind':'derived', 'func':lambda side: side / 2, 'inputs':['side']}
+		schema = ModalSchema(schema_dict)
+		table = schema.table(Frame)
+		self.assertEqual(table.modes['side'], 'memory')
+		self.assertEqual(table.derived['half'][1], ('side',))
+		self.assertEqual(table.dependents['image'], frozenset(['side', 'half']))
+		self.assertEqual(table.dependents['side'], frozenset(['half']))
+
+		assert_raises(TypeError, schema.add_item, Frame, 'bad', {'kind':'derived', 'func':len, 'inputs':['missing']})
+		assert_raises(TypeError, schema.add_item, Frame, 'bad', {'kind':'derived', 'inputs':['image']})
+		assert_raises(TypeError, schema.add_item, Frame, 'side', {'kind':'derived', 'func':len, 'inputs':['half']})
+		assert_raises(TypeError, schema.delete_item, Frame, 'side')
+
+		#=====[ declarative, given a named func	]=====
+		schema = ModalSchema({
+								'ModalDB.Frame.Frame':{
+											'features':{'mode':'disk', 'filename':'features.npy', 'format':'npy'},
+											'flat':{'kind':'derived', 'func':'numpy.ravel', 'inputs':['features'], 'mode':'disk', 'filename':'flat.npy', 'format':'npy'}
+										}
+							})
+		self.assertTrue(schema.is_declarative())
+		from ModalDB.Formats import resolve_name
+		import numpy as np
+		self.assertTrue(resolve_name(schema.to_declarative()['ModalDB.Frame.Frame']['flat']['func']) is np.ravel)
@@ -0,0 +1,165 @@
+'''
+Test: NearestNeighbors
+======================
+
+Description:
+------------
+
+	Tests k-NN search over feature items
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import numpy as np
+import nose
+from nose.tools import *
+
+from ModalDB import *
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_NearestNeighbors(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	def schema(self):
+		schema = super(Test_NearestNeighbors, self).schema()
+		schema[Frame]['features'] = {'mode':'disk', 'filename':'features.npy', 'format':'npy'}
+		schema[Frame]['mask_features'] = {'mode':'memory'}
+		return schema
+
+
+	def setUp(self):
+		"""
+			inserts video_1 with 20 frames; frame_t has features pointing
+			at angle t/10 and two mask features
+		"""
+		super(Test_NearestNeighbors, self).setUp()
+		self.video = self.client.insert(Video, 'video_1', video_data, method='cp')
+		for t in range(20):
+			frame = self.client.insert(Frame, 'frame_%d' % t, frame_data, parent=self.video, method='cp')
+			frame['features'] = self.feature(t / 10.0)
+			frame['mask_features'] = [[float(t), 0.0], [0.0, float(t + 1)]]
+
+
+	def feature(self, angle):
+		return np.array([np.cos(angle), np.sin(angle)])
+
+
+	def frame(self, t):
+		return self.client.get(Frame, 'video_1/frame_%d' % t)
+
+
+
+
+	################################################################################
+	####################[ SEARCH	]###############################################
+	################################################################################
+
+	def test_exact_search(self):
+		"""
+			NearestNeighbors: EXACT SEARCH
+			------------------------------
+			neighbors are closest first, by cosine or l2
+		"""
+		index = self.client.feature_index(Frame, 'features', block_size=7)
+		self.assertEqual(len(index), 20)
+		results = index.neighbors(self.frame(5), k=4)
+		self.assertEqual(sorted(k for k, _ in results[:2]), ['video_1/frame_4', 'video_1/frame_6'])
+		self.assertEqual(sorted(k for k, _ in results[2:]), ['video_1/frame_3', 'video_1/frame_7'])
+		self.assertAlmostEqual(results[0][1], np.cos(0.1), places=5)
+
+		index = self.client.feature_index(Frame, 'features', metric='l2')
+		key, distance = index.search(self.feature(1.0) * 2, k=1)[0][0]
+		self.assertEqual(key, 'video_1/frame_10')
+		self.assertAlmostEqual(distance, 1.0, places=5)
+
+
+	def test_ivf_search(self):
+		"""
+			NearestNeighbors: IVF SEARCH
+			----------------------------
+			approximate search probing all buckets matches exact search
+		"""
+		exact = self.client.feature_index(Frame, 'features')
+		ivf = self.client.feature_index(Frame, 'features', mode='ivf', n_lists=4, n_probe=4)
+		self.assertFalse(ivf.centroids is None)
+		queries = np.array([self.feature(a) for a in [0.05, 0.8, 1.7]])
+		self.assertEqual([[k for k, _ in r] for r in ivf.search(queries, k=3)], [[k for k, _ in r] for r in exact.search(queries, k=3)])
+
+		ivf = self.client.feature_index(Frame, 'features', mode='ivf', n_lists=4, n_probe=1)
+		self.assertEqual(ivf.search(self.feature(0.0), k=1)[0][0][0], 'video_1/frame_0')
+
+
+	def test_mask_features(self):
+		"""
+			NearestNeighbors: PER-MASK FEATURES
+			-----------------------------------
+			matrix items are indexed per row; results can be DataObjects
+		"""
+		index = self.client.feature_index(Frame, 'mask_features', metric='l2')
+		self.assertEqual(len(index), 40)
+		assert_raises(ValueError, index.neighbors, self.frame(3))
+		results = index.neighbors(self.frame(3), k=2, mask_id=1)
+		self.assertEqual(sorted(k for k, _ in results), [('video_1/frame_2', 1), ('video_1/frame_4', 1)])
+
+		(frame, mask_id), distance = index.neighbors('video_1/frame_3', k=1, mask_id=0, as_objects=True)[0]
+		self.assertTrue(isinstance(frame, Frame))
+		self.assertTrue(frame._id in ['video_1/frame_2', 'video_1/frame_4'])
+		self.assertEqual(mask_id, 0)
+		self.assertAlmostEqual(distance, 1.0, places=5)
+
+		#=====[ several rows of one frame among the results	]=====
+		results = index.neighbors(self.frame(0), k=6, mask_id=0, as_objects=True)
+		keys = [k for k, _ in index.neighbors(self.frame(0), k=6, mask_id=0)]
+		self.assertTrue(len(set(_id for _id, _ in keys)) < 6)
+		self.assertEqual([(frame._id, mask_id) for (frame, mask_id), _ in results], keys)
+
+		assert_raises(KeyError, index.neighbors, ('video_1/frame_99', 0))
+		assert_raises(KeyError, index.neighbors, 'video_1/frame_3', mask_id=7)
+		assert_raises(ValueError, index.neighbors, 'video_1/frame_3')
+
+
+
+
+	################################################################################
+	####################[ UPDATES	]###############################################
+	################################################################################
+
+	def test_incremental_updates(self):
+		"""
+			NearestNeighbors: INCREMENTAL UPDATES
+			-------------------------------------
+			inserts, updates and deletes through the client are reflected
+		"""
+		for mode in ['exact', 'ivf']:
+			self.setUp()
+			index = self.client.feature_index(Frame, 'features', mode=mode, n_lists=4, n_probe=4)
+			query = self.feature(3.0)
+			self.assertEqual(index.search(query, k=1)[0][0][0], 'video_1/frame_19')
+
+			frame = self.client.insert(Frame, 'frame_new', frame_data, parent=self.video, method='cp')
+			frame['features'] = query
+			self.assertEqual(len(index), 21)
+			self.assertEqual(index.search(query, k=1)[0][0][0], 'video_1/frame_new')
+
+			frame = self.frame(0)
+			frame['features'] = query * 0.5
+			self.assertEqual(len(index), 21)
+			self.assertEqual(sorted(k for k, _ in index.search(query, k=2)[0]), ['video_1/frame_0', 'video_1/frame_new'])
+
+			self.client.delete(Frame, 'video_1/frame_new', background=False)
+			self.client.delete(Frame, 'video_1/frame_0', background=False)
+			self.assertEqual(len(index), 19)
+			self.assertEqual(index.search(query, k=1)[0][0][0], 'video_1/frame_19')
+			if mode == 'ivf':
+				self.assertEqual(sorted(pos for l in index.lists for pos in l), range(19))
+				self.assertTrue(all(index.assignments[pos] == c and l[index.list_pos[pos]] == pos for c, l in enumerate(index.lists) for pos in l))
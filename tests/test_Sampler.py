@@ -0,0 +1,138 @@
+'''
+Test: Sampler
+=============
+
+Description:
+------------
+	
+	Tests alias tables and hierarchy-aware sampling, including 
+	incremental updates on insert/update/delete
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import nose
+from nose.tools import *
+import numpy as np
+
+from ModalDB import *
+from ModalDB.Sampler import AliasTable
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_Sampler(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	def setUp(self):
+		"""
+			inserts video_1 with 4 frames and video_2 with 1 frame
+		"""
+		super(Test_Sampler, self).setUp()
+		self.client.add_item(Frame, 'score', {'mode':'memory'})
+		self.videos = [self.client.insert(Video, 'video_%d' % i, video_data, method='cp') for i in range(2)]
+		for t in range(4):
+			self.client.insert(Frame, 'frame_%d' % t, dict(frame_data, score=0.0), parent=self.videos[0], method='cp')
+		self.client.insert(Frame, 'frame_0', dict(frame_data, score=1.0), parent=self.videos[1], method='cp')
+
+
+
+
+	################################################################################
+	####################[ AliasTable	]###########################################
+	################################################################################
+
+	def test_alias_table(self):
+		"""
+			Sampler: ALIAS TABLE
+			--------------------
+			draws follow the weights
+		"""
+		table = AliasTable([1.0, 0.0, 3.0])
+		draws = table.draw(np.random.RandomState(0), 40000)
+		counts = np.bincount(draws, minlength=3) / 40000.
+		self.assertEqual(counts[1], 0)
+		self.assertAlmostEqual(counts[2], 0.75, places=1)
+		assert_raises(ValueError, AliasTable, [0.0, 0.0])
+
+
+
+
+	################################################################################
+	####################[ HierarchySampler	]#######################################
+	################################################################################
+
+	def test_uniform(self):
+		"""
+			Sampler: UNIFORM ACROSS PARENTS
+			-------------------------------
+			all frames are drawn, without replacement without repeats
+		"""
+		sampler = self.client.sampler(Video, Frame, seed=0)
+		self.assertEqual(len(sampler), 5)
+		ids = sampler.sample_ids(5, replace=False)
+		self.assertEqual(len(set(ids)), 5)
+		self.assertEqual(type(sampler.draw()), Frame)
+
+
+	def test_stratified(self):
+		"""
+			Sampler: STRATIFIED
+			-------------------
+			the lone frame of video_2 is drawn half the time; without
+			replacement, only until it has been drawn
+		"""
+		sampler = self.client.sampler(Video, Frame, mode='stratified', seed=0)
+		ids = sampler.sample_ids(4000)
+		self.assertAlmostEqual(ids.count('video_1/frame_0') / 4000., 0.5, places=1)
+
+		firsts = [sampler.sample_ids(2, replace=False) for _ in range(2000)]
+		self.assertAlmostEqual([ids[0] for ids in firsts].count('video_1/frame_0') / 2000., 0.5, places=1)
+		self.assertTrue(all(len(set(ids)) == 2 for ids in firsts))
+		self.assertEqual(len(set(sampler.sample_ids(5, replace=False))), 5)
+
+
+	def test_weighted(self):
+		"""
+			Sampler: WEIGHTED
+			-----------------
+			only frames with nonzero score are drawn; updates to the 
+			score are picked up
+		"""
+		sampler = self.client.sampler(Video, Frame, weight='score', seed=0)
+		self.assertEqual(set(sampler.sample_ids(100)), set(['video_1/frame_0']))
+
+		frame = self.client.get(Frame, 'video_0/frame_2')
+		frame['score'] = 1.0
+		frame.update_mongo_doc()
+		self.assertEqual(set(sampler.sample_ids(100)), set(['video_1/frame_0', 'video_0/frame_2']))
+
+		#=====[ without replacement: first draw still follows weights	]=====
+		frame['score'] = 3.0
+		firsts = [sampler.sample_ids(1, replace=False)[0] for _ in range(2000)]
+		self.assertAlmostEqual(firsts.count('video_0/frame_2') / 2000., 0.75, places=1)
+		self.assertEqual(sorted(sampler.sample_ids(2, replace=False)), ['video_0/frame_2', 'video_1/frame_0'])
+		assert_raises(ValueError, sampler.sample_ids, 3, replace=False)
+
+
+	def test_incremental(self):
+		"""
+			Sampler: INCREMENTAL UPDATES
+			----------------------------
+			inserts and deletes through the client update the sampler
+		"""
+		sampler = self.client.sampler(Video, Frame, mode='stratified', seed=0)
+		self.client.insert(Frame, 'frame_1', frame_data, parent=self.videos[1], method='cp')
+		self.assertEqual(len(sampler), 6)
+		self.client.delete(Frame, 'frame_0', parent=self.videos[1])
+		self.client.delete(Frame, 'frame_1', parent=self.videos[1])
+		self.assertEqual(len(sampler), 4)
+		self.assertEqual(sampler.parents, ['video_0'])
@@ -0,0 +1,167 @@
+'''
+Test: Video
+===========
+
+Description:
+------------
+	
+	Tests Video's sorted frame index, both in isolation and 
+	against frames inserted through a ModalClient
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import nose
+from nose.tools import *
+
+from ModalDB import *
+from ModalDB.Video import FrameIndex
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_Video(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	def make_video(self, frame_numbers):
+		"""
+			inserts a video containing frames with the given numbers
+		"""
+		self.reset()
+		client = self.make_client()
+		video = client.insert(Video, 'video_1', video_data, method='cp')
+		for t in frame_numbers:
+			client.insert(Frame, 'frame_%d' % t, frame_data, parent=video, method='cp')
+		return client.get(Video, 'video_1')
+
+
+
+
+	################################################################################
+	####################[ FrameIndex	]###########################################
+	################################################################################
+
+	def test_frame_index_dense(self):
+		"""
+			Video: DENSE FRAME INDEX
+			------------------------
+			contiguous frame numbers are sorted numerically and 
+			looked up arithmetically
+		"""
+		index = FrameIndex({'frame_%d' % t:'v/frame_%d' % t for t in range(12)})
+		self.assertTrue(index.dense)
+		self.assertEqual(len(index), 12)
+		self.assertEqual(list(index.numbers), range(12))
+		self.assertEqual(index.ids[index.position(10)], 'v/frame_10')
+		self.assertEqual(index.position(12), None)
+		self.assertEqual(index.range_positions(3, 7), (3, 7))
+
+
+	def test_frame_index_sparse(self):
+		"""
+			Video: SPARSE FRAME INDEX
+			-------------------------
+			gaps in frame numbers fall back to dict lookups
+		"""
+		index = FrameIndex({'frame_%d' % t:'v/frame_%d' % t for t in [30, 0, 10, 20]})
+		self.assertFalse(index.dense)
+		self.assertEqual(list(index.ids), ['v/frame_0', 'v/frame_10', 'v/frame_20', 'v/frame_30'])
+		self.assertEqual(index.position(20), 2)
+		self.assertEqual(index.position(15), None)
+		self.assertEqual(index.range_positions(5, 25), (1, 3))
+
+
+	def test_frame_index_no_number(self):
+		"""
+			Video: FRAME ID WITHOUT NUMBER
+			------------------------------
+			should raise a ValueError
+		"""
+		assert_raises(ValueError, FrameIndex, {'frame':'v/frame'})
+
+
+
+
+	################################################################################
+	####################[ Frame Access	]###########################################
+	################################################################################
+
+	def test_get_frame(self):
+		"""
+			Video: GET FRAME BY NUMBER
+			--------------------------
+			inserts frames out of order, retrieves them by number
+		"""
+		video = self.make_video([2, 0, 1])
+		self.assertEqual(len(video), 3)
+		self.assertEqual(video.get_frame(2)._id, 'video_1/frame_2')
+		self.assertEqual(video.get_frame(3), None)
+		self.assertEqual([f._id for f in video.iter_frames()], ['video_1/frame_0', 'video_1/frame_1', 'video_1/frame_2'])
+		self.assertEqual([f._id for f in video.iter_frames(subsample_rate=2)], ['video_1/frame_0', 'video_1/frame_2'])
+
+
+	def test_frames_slicing(self):
+		"""
+			Video: FRAME SLICING
+			--------------------
+			slices frames by number range and stride
+		"""
+		video = self.make_video([0, 1, 2, 3, 5])
+		self.assertEqual([f._id for f in video.frames[1:4]], ['video_1/frame_1', 'video_1/frame_2', 'video_1/frame_3'])
+		self.assertEqual([f._id for f in video.frames[::2]], ['video_1/frame_0', 'video_1/frame_2', 'video_1/frame_5'])
+		self.assertEqual(video.frames[5]._id, 'video_1/frame_5')
+
+
+
+
+	################################################################################
+	####################[ Windows	]###############################################
+	################################################################################
+
+	def test_load_window(self):
+		"""
+			Video: LOAD WINDOW
+			------------------
+			stacks images of a range of frames, fetched with one query,
+			with and without padding
+		"""
+		video = self.make_video([0, 1, 2])
+		get = video.client.get
+		video.client.get = None
+		self.assertEqual(video.load_window('image', 0, 3).shape, (3, 512, 512, 3))
+		video.client.get = get
+		self.assertEqual(video.load_window('image', 0, 3, step=2).shape, (2, 512, 512, 3))
+
+		padded = video.load_window('image', 1, 5, pad='zero')
+		self.assertEqual(padded.shape, (4, 512, 512, 3))
+		self.assertEqual(padded[3].max(), 0)
+		self.assertTrue((video.load_window('image', 1, 5, pad='edge')[3] == padded[1]).all())
+		assert_raises(KeyError, video.load_window, 'image', 1, 5)
+
+
+	def test_iter_windows(self):
+		"""
+			Video: ITER WINDOWS
+			-------------------
+			yields overlapping windows over all frames, including
+			zero-padded ones over gaps
+		"""
+		video = self.make_video([0, 1, 2, 3])
+		windows = list(video.iter_windows('image', 2, stride=1))
+		self.assertEqual(len(windows), 3)
+		self.assertEqual(windows[0].shape, (2, 512, 512, 3))
+
+		#=====[ zero padding: windows over gaps are all zeros	]=====
+		video = self.make_video([0, 1, 5])
+		windows = list(video.iter_windows('image', 2, stride=1, pad='zero'))
+		self.assertEqual(len(windows), 5)
+		self.assertEqual([w.shape for w in windows], [(2, 512, 512, 3)] * 5)
+		self.assertEqual([w.max() == 0 for w in windows], [False, False, True, True, False])
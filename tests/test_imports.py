@@ -0,0 +1,41 @@
+"""
+Test: imports
+=============
+
+Description:
+------------
+
+	Tests that importing ModalDB stays lightweight, i.e. heavy
+	optional dependencies load only when used.
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+"""
+import sys
+import json
+import subprocess
+import unittest
+import nose
+from nose.tools import *
+
+
+heavy_modules = ['scipy', 'pandas', 'matplotlib', 'sklearn', 'dill']
+
+
+class Test_imports(unittest.TestCase):
+
+	def test_no_heavy_imports(self):
+		"""
+			imports: NO HEAVY IMPORTS
+			-------------------------
+			import ModalDB in a fresh interpreter shouldn't load
+			scipy, pandas, matplotlib, sklearn or dill
+		"""
+		probe = "import sys, json, ModalDB; print json.dumps([m for m in %r if m in sys.modules])" % heavy_modules
+		loaded = json.loads(subprocess.check_output([sys.executable, '-c', probe]).strip().split('\n')[-1])
+		self.assertEqual(loaded, [])
+
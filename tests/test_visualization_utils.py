@@ -0,0 +1,121 @@
+'''
+Test: visualization_utils
+=========================
+
+Description:
+------------
+
+	Tests contact sheets of object proposals
+
+
+##################
+Jay Hack
+Fall 2014
+jhack@stanford.edu
+##################
+'''
+import os
+import shutil
+import tempfile
+import numpy as np
+import nose
+from nose.tools import *
+
+from ModalDB import *
+from ModalDB.visualization_utils import sample_cluster, sample_to_proposals, render_contact_sheet, save_contact_sheet, ThumbnailCache
+
+from dataobject_example import video_data, frame_data, data_dir
+from client_fixture import ClientFixture
+
+class Test_visualization_utils(ClientFixture):
+
+	################################################################################
+	####################[ setUp	]###################################################
+	################################################################################
+
+	def schema(self):
+		schema = super(Test_visualization_utils, self).schema()
+		schema[Frame]['masks'] = {'mode':'disk', 'filename':'masks.npy', 'format':'npy'}
+		return schema
+
+
+	def setUp(self):
+		"""
+			inserts video_1 with 2 frames, each with masks: the top-left
+			quarter, the bottom-right 100x50 block, and nothing
+		"""
+		super(Test_visualization_utils, self).setUp()
+		self.tmp_dir = tempfile.mkdtemp()
+		video = self.client.insert(Video, 'video_1', video_data, method='cp')
+		masks = np.zeros((512, 512, 3), dtype=np.uint8)
+		masks[:256, :256, 0] = 1
+		masks[-100:, -50:, 1] = 1
+		for name in ['frame_1', 'frame_2']:
+			self.client.insert(Frame, name, frame_data, parent=video, method='cp')['masks'] = masks
+
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+
+
+
+	################################################################################
+	####################[ CONTACT SHEETS	]#######################################
+	################################################################################
+
+	def test_contact_sheet(self):
+		"""
+			visualization_utils: CONTACT SHEET
+			----------------------------------
+			proposals are cropped, scaled into cells in order, and cached
+			until their frame's files change
+		"""
+		proposals = [('video_1/frame_1', 0), ('video_1/frame_2', 1), ('video_1/frame_1', 2)]
+		cache_dir = os.path.join(self.tmp_dir, 'thumbnails')
+		grid = render_contact_sheet(self.client, proposals, columns=2, size=32, cache_dir=cache_dir, workers=2)
+		self.assertEqual(grid.shape, (64, 64, 3))
+		image = self.client.get(Frame, 'video_1/frame_1')['image']
+		self.assertTrue((grid[0, 0] == image[0, 0]).all() and grid[31, :32].any())
+		self.assertTrue((grid[:32, 32:][:, :8] == 0).all()) 	# 100x50 -> 32x16, centered
+		self.assertTrue(grid[:32, 32:][:, 8:24].any())
+		self.assertFalse(grid[32:, :32].any()) 					# empty mask
+		self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+		#=====[ all cached: no frames loaded	]=====
+		get_many = self.client.get_many
+		self.client.get_many = None
+		self.assertTrue((render_contact_sheet(self.client, proposals, columns=2, size=32, cache_dir=cache_dir) == grid).all())
+		self.client.get_many = get_many
+
+		#=====[ changed masks: frame_1's thumbnails are rerendered	]=====
+		frame = self.client.get(Frame, 'video_1/frame_1')
+		masks = frame['masks'].copy()
+		masks[:, :, 2] = 1
+		frame['masks'] = masks
+		os.utime(os.path.join(frame.root, 'masks.npy'), (0, 0))
+		updated = render_contact_sheet(self.client, proposals, columns=2, size=32, cache_dir=cache_dir)
+		self.assertEqual(len(os.listdir(cache_dir)), 5)
+		self.assertTrue((updated[:32] == grid[:32]).all())
+		self.assertTrue(updated[32:, :32].any())
+
+		#=====[ non-ascii ids	]=====
+		cache = ThumbnailCache(cache_dir)
+		self.assertEqual(cache.path(u'vid\xe9o_1/frame_1', 0, 32, False, None), cache.path(u'vid\xe9o_1/frame_1'.encode('utf-8'), 0, 32, False, None))
+
+
+	def test_save_cluster_sample(self):
+		"""
+			visualization_utils: SAVE CLUSTER SAMPLE
+			----------------------------------------
+			samples a cluster from a dataframe and writes it as an image
+		"""
+		import pandas as pd
+		df = pd.DataFrame({'cluster_id':[0, 1, 1], 'video_id':['video_1'] * 3, 'frame_id':['frame_1', 'frame_1', 'frame_2'], 'mask_id':[0, 1, 0]})
+		proposals = sample_to_proposals(sample_cluster(df, 1, samples=9))
+		self.assertEqual(sorted(proposals), [('video_1/frame_1', 1), ('video_1/frame_2', 0)])
+
+		outpath = os.path.join(self.tmp_dir, 'cluster_1.png')
+		grid = save_contact_sheet(self.client, proposals, outpath, size=16)
+		self.assertEqual(grid.shape, (16, 32, 3))
+		self.assertTrue(os.path.exists(outpath))